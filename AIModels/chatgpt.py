@@ -1,5 +1,4 @@
 import asyncio
-from datetime import datetime
 import json
 import os
 from typing import List, Dict, Optional
@@ -8,7 +7,9 @@ from telegram.ext import CallbackContext, ConversationHandler
 from openai import OpenAI
 from AIModels.tts import generate_tts
 from config import OPENAI_API_KEY
-from utils.database import execute_query, get_data
+from utils.database import get_data
+from utils.database_writer import chat_writer, usage_writer
+from utils.timestamps import is_today, now_epoch
 from utils.user_management import get_user_setting
 
 client = OpenAI(api_key=OPENAI_API_KEY)
@@ -122,16 +123,14 @@ class ChatGPT:
 
     async def check_usage_limit(self, user_id: int) -> bool:
         """Checks if the user has reached their daily ChatGPT usage limit."""
-        today = datetime.now().date()
         usage_data = get_data(
             "SELECT usage_count, last_used FROM chatgpt_usage WHERE user_id = ?",
             (user_id,),
         )
 
         if usage_data:
-            usage_count, last_used_str = usage_data[0]
-            last_used = datetime.strptime(last_used_str, "%Y-%m-%d").date()
-            if last_used == today:
+            usage_count, last_used = usage_data[0]
+            if is_today(last_used):
                 # limit = (
                 #     PAID_TIER_LIMIT
                 #     if await self.is_subscribed(user_id)
@@ -143,38 +142,33 @@ class ChatGPT:
                 await self.reset_daily_usage(user_id)
                 return True  # Allow usage as it's reset
         else:  # No usage data yet, create new entry and allow
-            execute_query(
+            await usage_writer.write(
                 "INSERT INTO chatgpt_usage (user_id, usage_count, last_used) VALUES (?, ?, ?)",
-                (user_id, 0, today.strftime("%Y-%m-%d")),
+                (user_id, 0, now_epoch()),
             )
             return True
 
     async def increment_usage(self, user_id: int):
         """Increments the user's ChatGPT usage count."""
-        today = datetime.now().date()
-        execute_query(
+        await usage_writer.write(
             "UPDATE chatgpt_usage SET usage_count = usage_count + 1, last_used = ? WHERE user_id = ?",
-            (today.strftime("%Y-%m-%d"), user_id),
+            (now_epoch(), user_id),
         )
 
     async def reset_daily_usage(self, user_id: int):
         """Resets the user's daily usage count."""
-        today = datetime.now().date()
-        execute_query(
+        await usage_writer.write(
             "UPDATE chatgpt_usage SET usage_count = 0, last_used = ? WHERE user_id = ?",
-            (today.strftime("%Y-%m-%d"), user_id),
+            (now_epoch(), user_id),
         )
 
     async def is_subscribed(self, user_id: int) -> bool:
         """Checks if the user has an active subscription."""
-        subscription_end_time_str = await get_user_setting(
+        subscription_end_time = await get_user_setting(
             user_id, "subscription_end_time"
         )
-        if subscription_end_time_str:
-            subscription_end_time = datetime.strptime(
-                subscription_end_time_str, "%Y-%m-%d %H:%M:%S.%f"
-            )
-            return subscription_end_time > datetime.now()
+        if subscription_end_time:
+            return subscription_end_time > now_epoch()
         return False
 
     @staticmethod
@@ -195,15 +189,13 @@ class ChatGPT:
         existing_history = await ChatGPT.get_chat_history(user_id)
         if existing_history:
             # Update existing chat history
-            await asyncio.to_thread(
-                execute_query,  # Run database query in a separate thread
+            await chat_writer.write(
                 "UPDATE chat_history SET messages = ? WHERE user_id = ?",
                 (json.dumps(messages), user_id),
             )
         else:
             # Insert new chat history if it doesn't exist
-            await asyncio.to_thread(
-                execute_query,  # Run database query in a separate thread
+            await chat_writer.write(
                 "INSERT INTO chat_history (user_id, messages) VALUES (?, ?)",
                 (user_id, json.dumps(messages)),
             )
@@ -211,8 +203,7 @@ class ChatGPT:
     @staticmethod
     async def clear_user_history(user_id: int) -> None:  # Make this asynchronous
         """Clears the chat history for a specific user."""
-        await asyncio.to_thread(
-            execute_query,  # Run database query in a separate thread
+        await chat_writer.write(
             "DELETE FROM chat_history WHERE user_id = ?",
             (user_id,),
         )
@@ -13,6 +13,8 @@ from telegram.ext import (
     filters,
 )
 import config
+from utils import database
+from utils.question_search import search_questions
 
 # Load environment variables
 load_dotenv()
@@ -372,30 +374,53 @@ class AdminBot:
 
         return await self.show_main_menu(update, context)
 
+    async def search(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Lists the questions matching /search <words>, staying in the current state."""
+        words = " ".join(context.args)
+        if not words:
+            await update.message.reply_text("الاستخدام: /search كلمات البحث")
+            return
+        results = await database.db.run(search_questions, words)
+        if not results:
+            await update.message.reply_text("لا توجد نتائج.")
+            return
+        lines = [
+            f"{question_id} | {question_type} | {main_category_id} | {question_text[:80]}"
+            for question_id, question_type, main_category_id, _, question_text in results
+        ]
+        await update.message.reply_text("\n".join(lines))
+
     async def set_commands(self, application: Application) -> None:
-        commands = [BotCommand("start", "تسجيل الدخول")]
+        commands = [BotCommand("start", "تسجيل الدخول"), BotCommand("search", "البحث في الأسئلة")]
         await application.bot.set_my_commands(commands)
 
     def build_application(self) -> Application:
         application = Application.builder().token(self.bot_token).post_init(self.set_commands).build()
 
+        # Only offered once logged in
+        search_handler = CommandHandler("search", self.search)
         conv_handler = ConversationHandler(
             entry_points=[CommandHandler("start", self.start)],
             states={
                 LOGIN: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.check_password)],
-                MAIN_MENU: [CallbackQueryHandler(self.handle_category_selection)],
-                FILE_SELECTION: [CallbackQueryHandler(self.handle_file_or_folder_selection)],
+                MAIN_MENU: [CallbackQueryHandler(self.handle_category_selection), search_handler],
+                FILE_SELECTION: [
+                    CallbackQueryHandler(self.handle_file_or_folder_selection),
+                    search_handler,
+                ],
                 FILE_ACTION: [
                     CallbackQueryHandler(self.handle_download, pattern=f"^{DOWNLOAD_FILE_PREFIX}"),
                     CallbackQueryHandler(self.handle_replace, pattern=f"^{REPLACE_FILE_PREFIX}"),
                     CallbackQueryHandler(self.handle_category_selection, pattern=rf"^{CAT_PREFIX}"),
                     MessageHandler(filters.Document.ALL, self.handle_upload),
+                    search_handler,
                 ],
                 FOLDER_ACTION: [
                     CallbackQueryHandler(self.handle_download, pattern=f"^{DOWNLOAD_FOLDER_PREFIX}"),
                     CallbackQueryHandler(self.handle_replace, pattern=f"^{REPLACE_FOLDER_PREFIX}"),
                     CallbackQueryHandler(self.handle_category_selection, pattern=rf"^{CAT_PREFIX}"),
                     MessageHandler(filters.Document.ALL, self.handle_upload),
+                    search_handler,
                 ],
             },
             fallbacks=[CommandHandler("start", self.start)],
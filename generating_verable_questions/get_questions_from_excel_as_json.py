@@ -4,7 +4,9 @@ import json
 import os
 
 from AIModels.chatgpt import get_chatgpt_instance
-from config import CONTEXT_DIRECTORY, VERBAL_FILE
+from config import CONTEXT_DIRECTORY, NEAR_DUPLICATE_THRESHOLD, VERBAL_FILE
+from utils.database import get_data
+from utils.question_dedup import dedup_text, drop_near_duplicates
 
 
 def read_context_from_folder(folder_path, context_name):
@@ -102,6 +104,42 @@ def prepare_fine_tuning_data(excel_file, context_folder):
         return None
 
 
+def bank_question_texts():
+    """Returns (ids, texts) of the active questions, as dedup_text() builds them."""
+    rows = get_data(
+        "SELECT id, question_text, option_a, option_b, option_c, option_d FROM active_questions ORDER BY id"
+    )
+    return [row[0] for row in rows], [" ".join(str(value) for value in row[1:]) for row in rows]
+
+
+def drop_duplicate_questions(new_df, existing_df=None, threshold=NEAR_DUPLICATE_THRESHOLD):
+    """Drops the generated questions that near-duplicate the question bank,
+    the questions already in the output file, or each other.
+
+    Prints the clusters that were found and returns the remaining rows.
+    """
+    if new_df.empty:
+        return new_df
+    _, existing_texts = bank_question_texts()
+    if existing_df is not None:
+        existing_texts += [dedup_text(row) for row in existing_df.to_dict("records")]
+    new_questions = new_df.to_dict("records")
+    kept, clusters = drop_near_duplicates(
+        [dedup_text(question) for question in new_questions], existing_texts, threshold
+    )
+    for members in clusters:
+        described = [
+            f"existing: {existing_texts[index][:40]}"
+            if source == "existing"
+            else f"new #{new_questions[index].get('رقم السؤال', index + 1)}"
+            for source, index in members
+        ]
+        print("Near-duplicates: " + " | ".join(described))
+    if len(kept) < len(new_df):
+        print(f"Dropped {len(new_df) - len(kept)} near-duplicate questions in {len(clusters)} clusters.")
+    return new_df.iloc[kept]
+
+
 async def generate_similar_questions_excel(
     excel_file,
     chatgpt_instance,
@@ -201,10 +239,11 @@ async def generate_similar_questions_excel(
         if os.path.exists(file_path):
             # If file exists, load existing data and append new questions
             existing_df = pd.read_excel(file_path)
+            new_df = drop_duplicate_questions(new_df, existing_df)
             updated_df = pd.concat([existing_df, new_df], ignore_index=True)
         else:
             # If file does not exist, use the new DataFrame as the updated DataFrame
-            updated_df = new_df
+            updated_df = drop_duplicate_questions(new_df)
 
         # Save the updated DataFrame back to the Excel file
         updated_df.to_excel(file_path, index=False)
@@ -319,13 +358,14 @@ async def generate_similar_questions_excel_batch(
             print("Reached 'استيعاب المقروء'. File processing complete.")
             break
 
-    # Save new questions to the Excel file
+    # Save new questions to the Excel file, without near-duplicates
     new_df = pd.DataFrame(new_questions)
     if os.path.exists(file_path):
         existing_df = pd.read_excel(file_path)
+        new_df = drop_duplicate_questions(new_df, existing_df)
         updated_df = pd.concat([existing_df, new_df], ignore_index=True)
     else:
-        updated_df = new_df
+        updated_df = drop_duplicate_questions(new_df)
 
     updated_df.to_excel(file_path, index=False)
     print(f"Questions saved to {file_path}")
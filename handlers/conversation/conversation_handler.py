@@ -1,4 +1,3 @@
-from datetime import datetime, timedelta
 import logging
 from telegram import (
     Update,
@@ -16,6 +15,7 @@ from telegram.ext import (
 
 from handlers.main_menu_handler import main_menu_handler
 from utils.database import execute_query
+from utils.timestamps import epoch_after
 from utils.user_management import save_user_data, user_exists
 from .keyboards import (
     create_gender_keyboard,
@@ -192,9 +192,7 @@ async def handle_preference_selection(update: Update, context: CallbackContext)
         # await update.effective_message.reply_text("قد تم حفظ بياناتك.")
 
         # Grant the user a free one-hour trial
-        subscription_end_time = (datetime.now() + timedelta(hours=1)).strftime(
-            "%Y-%m-%d %H:%M:%S"
-        )
+        subscription_end_time = epoch_after(hours=1)
         execute_query(
             "UPDATE users SET subscription_end_time = ? ,type_of_last_subscription = ? WHERE telegram_id = ?",
             (subscription_end_time, "تجربة مجانية الساعية", update.effective_user.id),
@@ -12,6 +12,7 @@ from main_menu_sections.level_determination.level_determination_handler import (
 from main_menu_sections.traditional_learning.traditional_learning_handler import (
     TRADITIONAL_LEARNING_HANDLERS,
     TRADITIONAL_LEARNING_HANDLERS_PATTERNS,
+    search_conv_handler,
 )
 from main_menu_sections.conversation_learning.conversation_learning_handler import (
     CONVERSATION_LEARNING_HANDLERS,
@@ -75,7 +76,8 @@ CONVERSATION_HANDLERS = {
     test_conv_ai_assistance_handler,
     conversation_learning_conv_handler,
     tips_and_strategies_conv_handler,
-    customize_conversation
+    customize_conversation,
+    search_conv_handler,
 }
 
 def register_all_main_menu_handlers(application: Application):
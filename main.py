@@ -1,10 +1,16 @@
 import asyncio
 import logging
-import os
 from telegram import BotCommand
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler
 from telegram.request import HTTPXRequest
-from config import BOT_TOKEN, DATABASE_FILE
+from config import (
+    ANSWER_COMPACTION_INTERVAL_SECONDS,
+    BOT_TOKEN,
+    DATABASE_BACKEND,
+    MAINTENANCE_INTERVAL_SECONDS,
+    QUERY_STATS_FLUSH_INTERVAL_SECONDS,
+    SNAPSHOT_INTERVAL_SECONDS,
+)
 
 from handlers.conversation.conversation_handler import (
     register_converstaion_handlers,
@@ -16,9 +22,15 @@ from handlers.personal_assistant_chat_handler import (
     personal_assistant_handler,
 )
 from handlers.help_support_handler import help_support_handler
-from utils.database import create_tables
+from utils.answer_rollup import compact_answers_job
+from utils.database import connection_manager, db
+from utils.database_writer import chat_writer, database_writer, usage_writer
+from utils.db_maintenance import maintenance_job
+from utils.migrations import migrate
 from utils.motivation.button_click_tracker import load_motivational_messages
+from utils.query_stats import query_stats
 from utils.reminders import register_reminders_handlers
+from utils.snapshots import snapshot_job
 
 # Enable logging
 logging.basicConfig(
@@ -35,6 +47,7 @@ async def set_persistent_menu(application):
     commands = [
         BotCommand("main_menu", "القائمة الرئيسية"),
         BotCommand("help_support", "المساعدة والدعم"),
+        BotCommand("search", "البحث في الأسئلة"),
         BotCommand("personal_assistant_chat", "محادثة المساعد الشخصي"),
         BotCommand("end_chat", "إنهاء المحادثة المساعد الشخصي"),
         BotCommand("clear_history", "مسح ذاكرة محادثة مساعد شخصي"),
@@ -42,12 +55,26 @@ async def set_persistent_menu(application):
     await application.bot.set_my_commands(commands)
 
 
+async def close_database(application):
+    """Flush pending writes and close the database connections when the bot stops."""
+    await database_writer.close()
+    await chat_writer.close()
+    await usage_writer.close()
+    db.shutdown()
+    connection_manager.close_all()
+    query_stats.dump()
+
+
+async def flush_query_stats(context):
+    """Periodically write query statistics for `manage.py db-stats`."""
+    query_stats.dump()
+
+
 def main():
     """Start the bot."""
     loop = asyncio.get_event_loop()
-    # Check if the database file exists
-    if not os.path.exists(DATABASE_FILE):
-        create_tables()
+    # Create the database if it is missing and apply pending migrations
+    migrate()
 
     request = HTTPXRequest(
         connect_timeout=20.0,  # Increase the connection timeout (default is 5.0)
@@ -59,6 +86,7 @@ def main():
         .concurrent_updates(True)
         .request(request)
         .post_init(set_persistent_menu)
+        .post_shutdown(close_database)
         .build()
     )
 
@@ -75,6 +103,24 @@ def main():
     application.add_handler(personal_assistant_handler)
     application.add_handler(CommandHandler("help_support", help_support_handler))
 
+    application.job_queue.run_repeating(
+        flush_query_stats, interval=QUERY_STATS_FLUSH_INTERVAL_SECONDS
+    )
+    # Keep user_answers bounded by rolling up answers of old tests
+    application.job_queue.run_repeating(
+        compact_answers_job, interval=ANSWER_COMPACTION_INTERVAL_SECONDS, first=60
+    )
+    # SQLite file upkeep; PostgreSQL has pg_dump and autovacuum for this
+    if DATABASE_BACKEND == "sqlite":
+        # Compressed online backups of the database
+        application.job_queue.run_repeating(
+            snapshot_job, interval=SNAPSHOT_INTERVAL_SECONDS, first=300
+        )
+        # Planner statistics, free-page reclaim, WAL checkpoint and integrity checks
+        application.job_queue.run_repeating(
+            maintenance_job, interval=MAINTENANCE_INTERVAL_SECONDS, first=600
+        )
+
     # Run the reminder setup on the loop
     loop.run_until_complete(register_reminders_handlers(application))
 
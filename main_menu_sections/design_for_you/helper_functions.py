@@ -9,7 +9,8 @@ from pptx import Presentation
 import aiohttp
 from config import DESIGNS_FOR_FEMALE_FILE, DESIGNS_FOR_MALE_FILE
 from template_maker.file_exports import convert_ppt_to_image
-from utils.database import execute_query, get_data
+from utils.database import get_data
+from utils.database_writer import usage_writer
 from utils.user_management import get_user_data
 
 logger = logging.getLogger(__name__)
@@ -114,4 +115,4 @@ async def update_user_ai_usage(user_id: int):
         VALUES (?, ?)
     """
     params = (user_id, datetime.datetime.now())
-    await asyncio.to_thread(execute_query, query, params)  # Make this awaitable
+    await usage_writer.write(query, params)
@@ -4,7 +4,6 @@ import logging
 from datetime import datetime, timedelta
 import math
 import os
-import random
 from typing import Dict, List
 
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
@@ -17,19 +16,27 @@ from telegram.ext import (
     CommandHandler,
 )
 
-from config import CONTEXT_DIRECTORY
+from config import ADAPTIVE_MAX_QUESTIONS, PASSAGE_AWARE_SAMPLING
 from handlers.main_menu_handler import main_menu_handler
 from handlers.personal_assistant_chat_handler import chatgpt, SYSTEM_MESSAGE
 from template_maker.content_population import find_expression, generate_number
 from template_maker.generate_files import generate_quiz_pdf, generate_quiz_video
 from utils import database
+from utils.category_mangement import category_registry
 from utils.section_manager import section_manager
+from utils.timestamps import from_epoch, now_epoch
 from utils.database import (
-    execute_query,
     get_data,
     execute_query_return_id,
 )
-from utils.question_management import get_passage_content, get_random_questions
+from utils.database_writer import database_writer
+from utils.adaptive_testing import AdaptiveTest
+from utils.question_bank import seen_questions
+from utils.question_management import (
+    fetch_questions,
+    get_random_questions,
+)
+from utils.question_render import send_question_message
 from utils.subscription_management import check_subscription
 from utils.user_management import (
     calculate_percentage_expected,
@@ -129,6 +136,11 @@ async def handle_quiz_type_choice(update: Update, context: CallbackContext):
                     "عن طريق اختبار بمدة زمنية محددة ⏱️", callback_data="time_limit"
                 )
             ],
+            [
+                InlineKeyboardButton(
+                    "اختبار تكيفي بأسئلة أقل 🎯", callback_data="adaptive_level"
+                )
+            ],
             [
                 InlineKeyboardButton(
                     "الرجوع للخلف 🔙", callback_data="test_current_level"
@@ -156,6 +168,23 @@ async def handle_number_of_questions_choice(update: Update, context: CallbackCon
     return GET_NUMBER_OF_QUESTIONS
 
 
+async def handle_adaptive_choice(update: Update, context: CallbackContext):
+    """Starts an adaptive test, which stops as soon as the level is clear."""
+    query = update.callback_query
+    await query.answer()
+    await query.edit_message_text(
+        "سيتم اختيار كل سؤال حسب إجاباتك السابقة، وسينتهي الاختبار عند تحديد مستواك بدقة. 🎯"
+    )
+    num_questions = ADAPTIVE_MAX_QUESTIONS
+    context.user_data["adaptive"] = True
+    context.user_data["end_time"] = datetime.now() + timedelta(
+        minutes=num_questions * 1.5
+    )
+    context.user_data["num_questions"] = num_questions
+    await start_quiz(update, context)
+    return ANSWER_QUESTIONS
+
+
 async def handle_time_limit_choice(update: Update, context: CallbackContext):
     """Handles the choice of specifying the time limit."""
     await update.callback_query.edit_message_text("كم دقيقة لديك متاحة للاختبار؟ ⏱️")
@@ -170,6 +199,7 @@ async def handle_number_of_questions_input(update: Update, context: CallbackCont
             await update.message.reply_text("الرجاء إدخال عدد أسئلة بين 10 و 100. ⚠️")
             return GET_NUMBER_OF_QUESTIONS
 
+        context.user_data["adaptive"] = False
         context.user_data["end_time"] = datetime.now() + timedelta(
             minutes=num_questions * 1.5
         )
@@ -194,6 +224,7 @@ async def handle_time_limit_input(update: Update, context: CallbackContext):
             await update.message.reply_text("الرجاء إدخال وقت صحيح أكبر من 0. ⏱️")
             return GET_TIME_LIMIT
 
+        context.user_data["adaptive"] = False
         context.user_data["end_time"] = datetime.now() + timedelta(minutes=time_limit)
         num_questions = int(time_limit / 1.2)
         context.user_data["num_questions"] = num_questions
@@ -216,10 +247,28 @@ async def start_quiz(update: Update, context: CallbackContext):
     question_type = context.user_data["level_quiz_type"]
 
     try:
-        questions = get_random_questions(num_questions, question_type)
+        if context.user_data.get("adaptive"):
+            # Questions are picked one at a time as the answers come in.
+            adaptive_test = AdaptiveTest(user_id, question_type, num_questions)
+            context.user_data["adaptive_test"] = adaptive_test
+            context.user_data["passage_groups"] = False
+            questions = await database.db.run(next_adaptive_questions, adaptive_test)
+        else:
+            context.user_data.pop("adaptive_test", None)
+            # get_random_questions keeps the questions of a passage together.
+            context.user_data["passage_groups"] = PASSAGE_AWARE_SAMPLING
+            questions = await database.db.run(
+                get_random_questions, num_questions, question_type, user_id
+            )
     except Exception as e:
         logger.error(f"Error in getting questions: {e}")
-        await update.message.reply_text(
+        await update.effective_message.reply_text(
+            "حدث خطأ أثناء تحميل الأسئلة. يرجى المحاولة مرة أخرى. ⚠️"
+        )
+        return ConversationHandler.END
+
+    if not questions:
+        await update.effective_message.reply_text(
             "حدث خطأ أثناء تحميل الأسئلة. يرجى المحاولة مرة أخرى. ⚠️"
         )
         return ConversationHandler.END
@@ -232,7 +281,7 @@ async def start_quiz(update: Update, context: CallbackContext):
     context.user_data["results"] = []
 
     try:
-        timestamp = datetime.now()
+        timestamp = now_epoch()
         level_determination_id = execute_query_return_id(
             """
             INSERT INTO level_determinations (user_id, timestamp, num_questions, percentage, time_taken, pdf_path)
@@ -243,12 +292,12 @@ async def start_quiz(update: Update, context: CallbackContext):
         context.user_data["level_determination_id"] = level_determination_id
     except Exception as e:
         logger.error(f"Error in database insertion: {e}")
-        await update.message.reply_text(
+        await update.effective_message.reply_text(
             "حدث خطأ أثناء بدء الاختبار. يرجى المحاولة مرة أخرى. ⚠️"
         )
         return ConversationHandler.END
 
-    await update.message.reply_text(
+    await update.effective_message.reply_text(
         "سيتم تقييم مستواك من خلال هذه الأسئلة. 📝\n"
         "علما بأنه سيتم توضيح وشرح جميع الأسئلة لك خطوة بخطوة في نهاية الاختبار. 😊"
     )
@@ -261,6 +310,27 @@ async def start_quiz(update: Update, context: CallbackContext):
     await send_question(update, context)
 
 
+def next_adaptive_questions(adaptive_test: AdaptiveTest):
+    """Returns the next question row of an adaptive test as a list ([] when done)."""
+    if adaptive_test.finished():
+        return []
+    question_id = adaptive_test.next_question_id()
+    if question_id is None:
+        return []
+    questions, _ = fetch_questions([question_id])
+    return questions or []
+
+
+def get_level_percentage(context: CallbackContext):
+    """The level of the finished quiz: the adaptive estimate, else the raw score."""
+    adaptive_test = context.user_data.get("adaptive_test")
+    if adaptive_test is not None and adaptive_test.responses:
+        return adaptive_test.expected_percentage()
+    return calculate_percentage_expected(
+        context.user_data["score"], len(context.user_data["questions"])
+    )
+
+
 async def send_question(update: Update, context: CallbackContext):
     """Sends the current question to the user with randomized answer order."""
     if (
@@ -274,54 +344,12 @@ async def send_question(update: Update, context: CallbackContext):
     current_question_index = context.user_data["current_question"]
 
     if current_question_index < len(questions):
-        question_data = questions[current_question_index]
-        (
-            question_id,
-            correct_answer,
-            question_text,
-            option_a,
-            option_b,
-            option_c,
-            option_d,
-            explanation,
-            main_category_id,
-            question_type,
-            image_path,
-            passage_name,
-        ) = question_data
-
-        passage_content = ""
-        if passage_name != "-":
-            passage_content = get_passage_content(CONTEXT_DIRECTORY, passage_name)
-
-        passage_text = f"النص: {passage_content}\n\n" if passage_content else ""
-        answer_options = [
-            (f"أ. {option_a}", f"answer_{question_id}_أ"),
-            (f"ب. {option_b}", f"answer_{question_id}_ب"),
-            (f"ج. {option_c}", f"answer_{question_id}_ج"),
-            (f"د. {option_d}", f"answer_{question_id}_د"),
-        ]
-        random.shuffle(answer_options)
-
-        keyboard = []
-        for i in range(0, len(answer_options), 2):
-            row = [
-                InlineKeyboardButton(text, callback_data=data)
-                for text, data in answer_options[i : i + 2]
-            ]
-            keyboard.append(row)
-
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        if current_question_index == 0:
-            await update.effective_message.reply_text(
-                f"{passage_text}" f"*{current_question_index+1}.* {question_text}",
-                reply_markup=reply_markup,
-            )
-        else:
-            await update.effective_message.edit_text(
-                f"{passage_text}" f"*{current_question_index+1}.* {question_text}",
-                reply_markup=reply_markup,
-            )
+        await send_question_message(
+            update.effective_message,
+            context.user_data,
+            questions[current_question_index],
+            current_question_index,
+        )
     else:
         await end_quiz(update, context)
         return ConversationHandler.END
@@ -368,10 +396,16 @@ async def handle_answer(update: Update, context: CallbackContext):
     context.user_data["answers"].append(user_answer)
     context.user_data["results"].append(is_correct)
 
+    adaptive_test = context.user_data.get("adaptive_test")
+    if adaptive_test is not None:
+        adaptive_test.record(question_id, is_correct)
+        # An empty result ends the quiz after this answer
+        questions.extend(await database.db.run(next_adaptive_questions, adaptive_test))
+
     level_determination_id = context.user_data["level_determination_id"]
 
     try:
-        record_user_answer(
+        await record_user_answer(
             user_id, question_id, user_answer, is_correct, level_determination_id
         )
     except Exception as e:
@@ -404,12 +438,13 @@ async def handle_answer(update: Update, context: CallbackContext):
     await send_question(update, context)
 
 
-def record_user_answer(
+async def record_user_answer(
     user_id, question_id, user_answer, is_correct, level_determination_id
 ):
     """Records the user's answer in the database, linked to the level determination."""
+    seen_questions.record_answer(user_id, question_id, is_correct)
     try:
-        execute_query(
+        await database_writer.write(
             """
             INSERT INTO level_determination_answers (user_id, question_id, user_answer, is_correct, level_determination_id)
             VALUES (?, ?, ?, ?, ?)
@@ -456,15 +491,16 @@ async def end_quiz(update: Update, context: CallbackContext):
         )
 
         # Update user's total usage time in the database
-        update_user_usage_time(user_id, total_time)
+        await update_user_usage_time(user_id, total_time)
         update_user_created_questions(user_id, total_questions)
-        percentage_expected = calculate_percentage_expected(score, total_questions)
+        percentage_expected = get_level_percentage(context)
         update_user_percentage_expected(user_id, percentage_expected)
         points_earned = calculate_points(total_time, score, total_questions)
-        update_user_points(user_id, points_earned)
+        await update_user_points(user_id, points_earned)
 
 
         # Prepare data for analysis
+        main_category_names = dict(await database.db.run(category_registry.main_categories))
         quiz_data = []
         for i, question_data in enumerate(questions):
             question_id = question_data[0]
@@ -473,8 +509,8 @@ async def end_quiz(update: Update, context: CallbackContext):
             user_answer = context.user_data["answers"][i]
             is_correct = context.user_data["results"][i]
 
-            # Fetch category and question type from the database
-            category_name, question_type = await get_question_category_and_type(question_id)
+            category_name = main_category_names.get(question_data[8]) or "Unknown"
+            question_type = question_data[9] or "Unknown"
 
             quiz_data.append(
                 {
@@ -524,25 +560,6 @@ async def end_quiz(update: Update, context: CallbackContext):
             )
 
 
-async def get_question_category_and_type(question_id: int):
-    """Fetches the category name and question type for a given question."""
-    query = """
-    SELECT main_categories.name, questions.question_type
-    FROM questions
-    JOIN main_categories ON questions.main_category_id = main_categories.id
-    WHERE questions.id = ?
-    """
-    try:
-        result = await asyncio.to_thread(get_data, query, (question_id,))
-        if result:
-            category_name, question_type = result[0]
-            return category_name, question_type
-        return "Unknown", "Unknown"
-    except Exception as e:
-        logger.error(f"Error fetching question details: {e}")
-        return "Unknown", "Unknown"
-
-
 async def generate_feedback_with_chatgpt(
     user_id: int,
     quiz_data: List[Dict],
@@ -609,7 +626,7 @@ async def handle_output_format_choice(update: Update, context: CallbackContext):
     total_time = (end_time - start_time).total_seconds()
     total_questions = len(context.user_data["questions"])
     score = context.user_data["score"]
-    percentage = calculate_percentage_expected(score, total_questions)
+    percentage = get_level_percentage(context)
 
     questions = context.user_data["questions"]
     user_id = update.effective_user.id
@@ -698,10 +715,17 @@ async def handle_output_format_choice(update: Update, context: CallbackContext):
         database.execute_query(
             """
             UPDATE level_determinations
-            SET percentage = ?, time_taken = ?, pdf_path = ?, video_path = ?
+            SET percentage = ?, num_questions = ?, time_taken = ?, pdf_path = ?, video_path = ?
             WHERE id = ?
             """,
-            (percentage, total_time, pdf_filepath, video_filepath, level_determination_id),
+            (
+                percentage,
+                total_questions,
+                total_time,
+                pdf_filepath,
+                video_filepath,
+                level_determination_id,
+            ),
         )
 
     except Exception as e:
@@ -826,7 +850,7 @@ async def track_progress(update: Update, context: CallbackContext):
     keyboard = []
     for i, determination in enumerate(level_determinations):
         det_id, timestamp, percentage, num_questions = determination
-        test_date = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S.%f").strftime(
+        test_date = from_epoch(timestamp).strftime(
             "%Y-%m-%d %H:%M"
         )
         keyboard.append(
@@ -948,11 +972,12 @@ async def get_level_data(level_determination_id):
                    COUNT(lda.id) as total_answered,
                    ld.user_id
             FROM level_determinations ld
-            LEFT JOIN level_determination_answers lda ON ld.id = lda.level_determination_id
+            LEFT JOIN all_level_determination_answers lda ON ld.id = lda.level_determination_id AND lda.level_determination_id = ?
             WHERE ld.id = ?
             GROUP BY ld.id
             """,
-            (level_determination_id,),
+            # The id is repeated so the lookup reaches the indexes inside the view
+            (level_determination_id, level_determination_id),
         )
     except Exception as e:
         logger.error(f"Error fetching level determination details: {e}")
@@ -962,7 +987,7 @@ def format_level_details_message(
     timestamp, num_questions, percentage, time_taken, correct_answers, total_answered
 ):
     """Formats the level determination details message."""
-    test_date = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S.%f").strftime(
+    test_date = from_epoch(timestamp).strftime(
         "%Y/%m/%d %H:%M"
     )
     return (
@@ -977,7 +1002,7 @@ def format_level_details_message(
 
 async def get_user_data_for_level(user_id, level_determination_id, timestamp, num_questions, percentage):
     """Gets user data for the level determination."""
-    end_time = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S.%f")
+    end_time = from_epoch(timestamp)
     test_number = database.get_data(
         """
         SELECT COUNT(*) 
@@ -1040,7 +1065,7 @@ async def handle_download_level_file(update: Update, context: CallbackContext, f
             """
             SELECT q.* 
             FROM questions q
-            JOIN level_determination_answers ua ON q.id = ua.question_id
+            JOIN all_level_determination_answers ua ON q.id = ua.question_id
             WHERE ua.level_determination_id = ?
             """,
             (level_determination_id,),
@@ -1133,6 +1158,7 @@ level_conv_handler = ConversationHandler(
                 handle_number_of_questions_choice, pattern="^number_of_questions$"
             ),
             CallbackQueryHandler(handle_time_limit_choice, pattern="^time_limit$"),
+            CallbackQueryHandler(handle_adaptive_choice, pattern="^adaptive_level$"),
         ],
         GET_NUMBER_OF_QUESTIONS: [
             MessageHandler(
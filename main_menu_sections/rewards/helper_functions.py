@@ -1,5 +1,4 @@
 
-from datetime import datetime
 import logging
 import os
 import re
@@ -7,7 +6,8 @@ import re
 from pptx import Presentation
 
 from template_maker.file_exports import convert_ppt_to_image
-from utils.database import execute_query, get_data
+from utils.database import db, get_data
+from utils.timestamps import is_today, now_epoch
 
 
 logging.basicConfig(
@@ -30,27 +30,24 @@ def create_daily_gifts_folders(daily_gifts_path):
 
 async def has_user_claimed_daily_reward(user_id):
     """Checks if the user has already claimed the daily reward today."""
-    user_data = get_data(
+    user_data = await db.fetch_all(
         "SELECT last_daily_reward_claim FROM users WHERE telegram_id = ?", (user_id,)
     )
 
     if not user_data or not user_data[0][0]:  # No claim date or first time claim
         return False
 
-    last_claim_date = datetime.strptime(user_data[0][0], "%Y-%m-%d").date()
-    today = datetime.now().date()
-
-    return last_claim_date == today
+    return is_today(user_data[0][0])
 
 
 async def increment_user_daily_gifts_used(user_id):
     """Increments the user's number_of_daily_gifts_used in the database."""
-    is_today = await has_user_claimed_daily_reward(user_id)
-    if is_today:
+    claimed_today = await has_user_claimed_daily_reward(user_id)
+    if claimed_today:
         return
-    execute_query(
+    await db.execute(
         "UPDATE users SET number_of_daily_gifts_used = number_of_daily_gifts_used + 1, last_daily_reward_claim = ? WHERE telegram_id = ?",
-        (datetime.now().strftime("%Y-%m-%d"), user_id),
+        (now_epoch(), user_id),
     )
 
 async def process_ppt_design_user_data(ppt_file, user_data):
@@ -104,7 +101,7 @@ def get_user_custom_data(user_id):
 async def get_user_stats(user_id):
     """Fetches and formats user statistics from the database."""
     try:
-        user_data = get_data(
+        user_data = await db.fetch_all(
             "SELECT points, percentage_expected, usage_time, total_number_of_created_questions FROM users WHERE telegram_id = ?",
             (user_id,),
         )
@@ -27,7 +27,7 @@ from main_menu_sections.rewards.helper_functions import (
     validate_phone,
 )
 from template_maker.file_exports import convert_ppt_to_image
-from utils.database import execute_query
+from utils.database import db
 from utils.subscription_management import check_subscription
 
 # Enable logging
@@ -96,7 +96,7 @@ async def handle_daily_reward(update: Update, context: CallbackContext):
                     message_text += f.read()
             elif filename.endswith(".pptx"):
                 user_id = update.effective_user.id
-                user_data = get_user_custom_data(user_id)
+                user_data = await db.run(get_user_custom_data, user_id)
 
                 try:
                     image_path = await process_ppt_design_user_data(file_path, user_data)
@@ -188,12 +188,12 @@ async def save_name(update: Update, context: CallbackContext):
         return NAME
 
     try:
-        row_exists = execute_query("SELECT 1 FROM user_customizations WHERE telegram_id = ?", (user_id,), fetch_one=True)[0]
+        row_exists = await db.fetch_value("SELECT 1 FROM user_customizations WHERE telegram_id = ?", (user_id,))
         if row_exists:
-            execute_query("UPDATE user_customizations SET name = ? WHERE telegram_id = ?", (name, user_id))
+            await db.execute("UPDATE user_customizations SET name = ? WHERE telegram_id = ?", (name, user_id))
             await update.message.reply_text("تم تحديث الاسم بنجاح!")
         else:
-            execute_query("INSERT INTO user_customizations (telegram_id, name) VALUES (?, ?)", (user_id, name))
+            await db.execute("INSERT INTO user_customizations (telegram_id, name) VALUES (?, ?)", (user_id, name))
             await update.message.reply_text("تم حفظ الاسم بنجاح!")
 
         await customize_gifts(update, context) # Show the customize menu again
@@ -218,12 +218,12 @@ async def save_phone(update: Update, context: CallbackContext):
         return PHONE
 
     try:
-        row_exists = execute_query("SELECT 1 FROM user_customizations WHERE telegram_id = ?", (user_id,), fetch_one=True)[0]
+        row_exists = await db.fetch_value("SELECT 1 FROM user_customizations WHERE telegram_id = ?", (user_id,))
         if row_exists:
-            execute_query("UPDATE user_customizations SET phone_number = ? WHERE telegram_id = ?", (phone_number, user_id))
+            await db.execute("UPDATE user_customizations SET phone_number = ? WHERE telegram_id = ?", (phone_number, user_id))
             await update.message.reply_text("تم تحديث رقم الهاتف بنجاح!")
         else:
-            execute_query("INSERT INTO user_customizations (telegram_id, phone_number) VALUES (?, ?)", (user_id, phone_number))
+            await db.execute("INSERT INTO user_customizations (telegram_id, phone_number) VALUES (?, ?)", (user_id, phone_number))
             await update.message.reply_text("تم حفظ رقم الهاتف بنجاح!")
 
         await customize_gifts(update, context)
@@ -249,12 +249,12 @@ async def save_email(update: Update, context: CallbackContext):
         return EMAIL
 
     try:
-        row_exists = execute_query("SELECT 1 FROM user_customizations WHERE telegram_id = ?", (user_id,), fetch_one=True)[0]
+        row_exists = await db.fetch_value("SELECT 1 FROM user_customizations WHERE telegram_id = ?", (user_id,))
         if row_exists:
-            execute_query("UPDATE user_customizations SET email = ? WHERE telegram_id = ?", (email, user_id))
+            await db.execute("UPDATE user_customizations SET email = ? WHERE telegram_id = ?", (email, user_id))
             await update.message.reply_text("تم تحديث البريد الإلكتروني بنجاح!")
         else:
-            execute_query("INSERT INTO user_customizations (telegram_id, email) VALUES (?, ?)", (user_id, email))
+            await db.execute("INSERT INTO user_customizations (telegram_id, email) VALUES (?, ?)", (user_id, email))
             await update.message.reply_text("تم حفظ البريد الإلكتروني بنجاح!")
 
         await customize_gifts(update, context)
@@ -280,12 +280,12 @@ async def save_custom_text(update: Update, context: CallbackContext):
         return CUSTOM_TEXT
 
     try:
-        row_exists = execute_query("SELECT 1 FROM user_customizations WHERE telegram_id = ?", (user_id,), fetch_one=True)[0]
+        row_exists = await db.fetch_value("SELECT 1 FROM user_customizations WHERE telegram_id = ?", (user_id,))
         if row_exists:
-            execute_query("UPDATE user_customizations SET custom_text = ? WHERE telegram_id = ?", (custom_text, user_id))
+            await db.execute("UPDATE user_customizations SET custom_text = ? WHERE telegram_id = ?", (custom_text, user_id))
             await update.message.reply_text("تم تحديث النص المخصص بنجاح!")
         else:
-            execute_query("INSERT INTO user_customizations (telegram_id, custom_text) VALUES (?, ?)", (user_id, custom_text))
+            await db.execute("INSERT INTO user_customizations (telegram_id, custom_text) VALUES (?, ?)", (user_id, custom_text))
             await update.message.reply_text("تم حفظ النص المخصص بنجاح!")
 
         await customize_gifts(update, context)
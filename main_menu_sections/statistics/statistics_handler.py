@@ -1,4 +1,3 @@
-from datetime import datetime
 from io import BytesIO
 import numpy as np
 from telegram.ext import CallbackContext
@@ -7,7 +6,8 @@ import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import arabic_reshaper
 from bidi.algorithm import get_display
-from utils.database import get_data
+from utils.database import db
+from utils.timestamps import days_since, from_epoch
 from utils.section_manager import section_manager
 
 
@@ -43,7 +43,7 @@ async def handle_performance_statistics(update: Update, context: CallbackContext
     user_id = update.effective_user.id
 
     # Fetch level determination data
-    level_determination_data = get_data(
+    level_determination_data = await db.fetch_all(
         """
         SELECT percentage, time_taken, timestamp
         FROM level_determinations
@@ -55,7 +55,7 @@ async def handle_performance_statistics(update: Update, context: CallbackContext
     )
 
     # Fetch previous tests data
-    previous_tests_data = get_data(
+    previous_tests_data = await db.fetch_all(
         """
         SELECT score, time_taken, timestamp
         FROM previous_tests
@@ -67,13 +67,12 @@ async def handle_performance_statistics(update: Update, context: CallbackContext
     )
 
     # Fetch main category performance
-    main_category_performance = get_data(
+    main_category_performance = await db.fetch_all(
         """
-        SELECT mc.name, AVG(ua.is_correct) as avg_correct, COUNT(ua.id) as total_questions
-        FROM user_answers ua
-        JOIN questions q ON ua.question_id = q.id
-        JOIN main_categories mc ON q.main_category_id = mc.id
-        WHERE ua.user_id = ?
+        SELECT mc.name, SUM(t.correct) * 1.0 / SUM(t.graded) as avg_correct, SUM(t.answered) as total_questions
+        FROM user_category_totals t
+        JOIN main_categories mc ON t.main_category_id = mc.id
+        WHERE t.user_id = ? AND t.source = 'tests'
         GROUP BY mc.id
         ORDER BY avg_correct DESC
         """,
@@ -81,14 +80,13 @@ async def handle_performance_statistics(update: Update, context: CallbackContext
     )
 
     # Fetch subcategory performance
-    subcategory_performance = get_data(
+    subcategory_performance = await db.fetch_all(
         """
-        SELECT sc.name, AVG(ua.is_correct) as avg_correct, COUNT(ua.id) as total_questions
-        FROM user_answers ua
-        JOIN questions q ON ua.question_id = q.id
-        JOIN main_sub_links msl ON q.main_category_id = msl.main_category_id
+        SELECT sc.name, SUM(t.correct) * 1.0 / SUM(t.graded) as avg_correct, SUM(t.answered) as total_questions
+        FROM user_category_totals t
+        JOIN main_sub_links msl ON t.main_category_id = msl.main_category_id
         JOIN subcategories sc ON msl.subcategory_id = sc.id
-        WHERE ua.user_id = ?
+        WHERE t.user_id = ? AND t.source = 'tests'
         GROUP BY sc.id
         ORDER BY avg_correct DESC
         LIMIT 5
@@ -104,7 +102,7 @@ async def handle_performance_statistics(update: Update, context: CallbackContext
             level_determination_data
         )
         message += "*تحديد المستوى:*\n"
-        message += f"• أحدث نتيجة: {recent_ld[0]:.2f}% (قبل {(datetime.now() - datetime.strptime(recent_ld[2], '%Y-%m-%d %H:%M:%S.%f')).days} أيام)\n"
+        message += f"• أحدث نتيجة: {recent_ld[0]:.2f}% (قبل {days_since(recent_ld[2])} أيام)\n"
         message += f"• متوسط آخر 5 محاولات: {avg_ld:.2f}%\n"
         if len(level_determination_data) > 1:
             progress = recent_ld[0] - level_determination_data[-1][0]
@@ -117,7 +115,7 @@ async def handle_performance_statistics(update: Update, context: CallbackContext
         recent_pt = previous_tests_data[0]
         avg_pt = sum(row[0] for row in previous_tests_data) / len(previous_tests_data)
         message += "*الاختبارات السابقة:*\n"
-        message += f"• أحدث نتيجة: {recent_pt[0]} (قبل {(datetime.now() - datetime.strptime(recent_pt[2], '%Y-%m-%d %H:%M:%S.%f')).days} أيام)\n"
+        message += f"• أحدث نتيجة: {recent_pt[0]} (قبل {days_since(recent_pt[2])} أيام)\n"
         message += f"• متوسط آخر 5 اختبارات: {avg_pt:.2f}\n"
         if len(previous_tests_data) > 1:
             progress = recent_pt[0] - previous_tests_data[-1][0]
@@ -184,13 +182,12 @@ async def handle_performance_statistics(update: Update, context: CallbackContext
 
 async def handle_main_categories_details(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
-    main_category_performance = get_data(
+    main_category_performance = await db.fetch_all(
         """
-        SELECT mc.name, AVG(ua.is_correct) as avg_correct, COUNT(ua.id) as total_questions
-        FROM user_answers ua
-        JOIN questions q ON ua.question_id = q.id
-        JOIN main_categories mc ON q.main_category_id = mc.id
-        WHERE ua.user_id = ?
+        SELECT mc.name, SUM(t.correct) * 1.0 / SUM(t.graded) as avg_correct, SUM(t.answered) as total_questions
+        FROM user_category_totals t
+        JOIN main_categories mc ON t.main_category_id = mc.id
+        WHERE t.user_id = ? AND t.source = 'tests'
         GROUP BY mc.id
         ORDER BY avg_correct DESC
         """,
@@ -218,14 +215,13 @@ async def handle_main_categories_details(update: Update, context: CallbackContex
 
 async def handle_subcategories_details(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
-    subcategory_performance = get_data(
+    subcategory_performance = await db.fetch_all(
         """
-        SELECT sc.name, AVG(ua.is_correct) as avg_correct, COUNT(ua.id) as total_questions
-        FROM user_answers ua
-        JOIN questions q ON ua.question_id = q.id
-        JOIN main_sub_links msl ON q.main_category_id = msl.main_category_id
+        SELECT sc.name, SUM(t.correct) * 1.0 / SUM(t.graded) as avg_correct, SUM(t.answered) as total_questions
+        FROM user_category_totals t
+        JOIN main_sub_links msl ON t.main_category_id = msl.main_category_id
         JOIN subcategories sc ON msl.subcategory_id = sc.id
-        WHERE ua.user_id = ?
+        WHERE t.user_id = ? AND t.source = 'tests'
         GROUP BY sc.id
         ORDER BY avg_correct DESC
         """,
@@ -268,7 +264,7 @@ async def handle_progress_graph(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
 
     # Fetch data for both level determinations and previous tests
-    level_determination_scores = get_data(
+    level_determination_scores = await db.fetch_all(
         """
         SELECT timestamp, percentage, num_questions
         FROM level_determinations
@@ -278,7 +274,7 @@ async def handle_progress_graph(update: Update, context: CallbackContext):
         (user_id,),
     )
 
-    previous_tests_scores = get_data(
+    previous_tests_scores = await db.fetch_all(
         """
         SELECT timestamp, score, num_questions
         FROM previous_tests
@@ -294,9 +290,7 @@ async def handle_progress_graph(update: Update, context: CallbackContext):
     # Plot Level Determination data (percentage)
     if level_determination_scores:
         timestamps, percentages, num_questions = zip(*level_determination_scores)
-        formatted_dates = [
-            datetime.strptime(ts, "%Y-%m-%d %H:%M:%S.%f") for ts in timestamps
-        ]
+        formatted_dates = [from_epoch(ts) for ts in timestamps]
         ax_level_det.plot(
             formatted_dates,
             percentages,
@@ -332,9 +326,7 @@ async def handle_progress_graph(update: Update, context: CallbackContext):
     # Plot Previous Tests data (score)
     if previous_tests_scores:
         timestamps, scores, num_questions = zip(*previous_tests_scores)
-        formatted_dates = [
-            datetime.strptime(ts, "%Y-%m-%d %H:%M:%S.%f") for ts in timestamps
-        ]
+        formatted_dates = [from_epoch(ts) for ts in timestamps]
         ax_prev_tests.plot(
             formatted_dates,
             scores,
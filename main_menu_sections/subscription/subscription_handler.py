@@ -1,5 +1,3 @@
-from datetime import datetime, timedelta
-import sqlite3
 import openpyxl
 from telegram import (
     KeyboardButton,
@@ -17,7 +15,9 @@ from telegram.ext import (
     filters,
     CommandHandler,
 )
-from config import DATABASE_FILE, SUBSCRIPTION_PLANS
+from config import SUBSCRIPTION_PLANS
+from utils.database import db
+from utils.timestamps import epoch_after, from_epoch
 from utils.subscription_management import (
     SERIAL_CODE_DATA,
     activate_free_trial,
@@ -81,9 +81,7 @@ async def handle_start_free_trial(update: Update, context: CallbackContext):
                 await get_subscription_details(user_id)
             )
             # Extract date and time from the new_subscription_end_date string
-            end_date_obj = datetime.strptime(
-                new_subscription_end_date, "%Y-%m-%d %H:%M:%S"
-            )
+            end_date_obj = from_epoch(new_subscription_end_date)
             end_date_str = end_date_obj.strftime("%Y-%m-%d")
             end_time_str = end_date_obj.strftime("%H:%M:%S")
 
@@ -114,7 +112,7 @@ async def handle_view_subscription_details(update: Update, context: CallbackCont
         subscription_end_date = "لقد قمت بألغاء الاشتراك من قبل"
     else:
         # Extract date and time from the new_subscription_end_date string
-        end_date_obj = datetime.strptime(subscription_end_date, "%Y-%m-%d %H:%M:%S")
+        end_date_obj = from_epoch(subscription_end_date)
         end_date_str = end_date_obj.strftime("%Y-%m-%d")
         end_time_str = end_date_obj.strftime("%H:%M:%S")
 
@@ -160,7 +158,7 @@ async def handle_change_cancel_subscription(update: Update, context: CallbackCon
             subscription_end_date = "لقد قمت بألغاء الاشتراك من قبل"
         else:
             # Extract date and time from the new_subscription_end_date string
-            end_date_obj = datetime.strptime(subscription_end_date, "%Y-%m-%d %H:%M:%S")
+            end_date_obj = from_epoch(subscription_end_date)
             end_date_str = end_date_obj.strftime("%Y-%m-%d")
             end_time_str = end_date_obj.strftime("%H:%M:%S")
             subscription_end_date = (
@@ -199,14 +197,10 @@ async def handle_confirm_cancel(update: Update, context: CallbackContext):
     """Handles the cancellation confirmation (if user confirms)."""
     user_id = update.effective_user.id
 
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute(
+    await db.execute(
         "UPDATE users SET subscription_end_time = NULL WHERE telegram_id = ?",
         (user_id,),
     )
-    conn.commit()
-    conn.close()
     await update.callback_query.edit_message_text("تم إلغاء اشتراكك بنجاح ✅.")
 
 
@@ -263,33 +257,22 @@ async def handle_serial_code(update: Update, context: CallbackContext):
         return ConversationHandler.END  # End the conversation
 
     # 3. Update user's subscription
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-
-    cursor.execute(
+    row = await db.fetch_one(
         "SELECT subscription_end_time FROM users WHERE telegram_id = ?", (user_id,)
     )
-    row = cursor.fetchone()
     if row and row[0]:
-        current_end_date = datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S")
-        new_end_date = current_end_date + timedelta(
-            days=30 * code_data["duration_months"]
-        )
+        new_end_date = epoch_after(row[0], days=30 * code_data["duration_months"])
     else:
-        new_end_date = datetime.now() + timedelta(
-            days=30 * code_data["duration_months"]
-        )
+        new_end_date = epoch_after(days=30 * code_data["duration_months"])
 
-    cursor.execute(
+    await db.execute(
         "UPDATE users SET subscription_end_time = ?, type_of_last_subscription = ? WHERE telegram_id = ?",
         (
-            new_end_date.strftime("%Y-%m-%d %H:%M:%S"),
+            new_end_date,
             f"مدفوع - {code_data['duration_months']} شهر",
             user_id,
         ),
     )
-    conn.commit()
-    conn.close()
 
     await update.message.reply_text(
         f"تم تفعيل اشتراكك بنجاح لمدة {code_data['duration_months']} شهر! 🎉"
@@ -350,11 +333,9 @@ async def handle_earn_subscription_referral(update: Update, context: CallbackCon
     """Handles the 'اكسب اشتراكا عبر دعوة غيرك' sub-option."""
     user_id = update.effective_user.id
 
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT referral_code FROM users WHERE telegram_id = ?", (user_id,))
-    referral_code = cursor.fetchone()
-    conn.close()
+    referral_code = await db.fetch_one(
+        "SELECT referral_code FROM users WHERE telegram_id = ?", (user_id,)
+    )
 
     if referral_code:
         await update.callback_query.message.reply_text(
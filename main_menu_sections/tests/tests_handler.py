@@ -2,7 +2,6 @@ import asyncio
 import logging
 import math
 import os
-import random
 from datetime import datetime, timedelta
 from typing import Dict, List, Tuple
 
@@ -17,15 +16,26 @@ from telegram.ext import (
     filters,
 )
 
-from config import CONTEXT_DIRECTORY
 from handlers.main_menu_handler import main_menu_handler
 from handlers.personal_assistant_chat_handler import chatgpt, SYSTEM_MESSAGE
+from main_menu_sections.traditional_learning.traditional_learning_handler import material_keyboard
 from template_maker.content_population import find_expression, generate_number
 from template_maker.generate_files import generate_quiz_pdf, generate_quiz_video
 from utils import database
+from utils.category_mangement import (
+    category_registry,
+    get_main_category_name,
+    get_subcategory_name,
+    paginate,
+)
+from utils.database_writer import database_writer
 from utils.section_manager import section_manager
-from utils.question_management import get_passage_content, get_questions_by_category
+from utils.question_bank import seen_questions
+from utils.question_management import get_questions_by_category
+from utils.question_render import send_question_message
+from utils.question_similarity import similar_to_any
 from utils.subscription_management import check_subscription
+from utils.timestamps import from_epoch, now_epoch
 from utils.user_management import (
     calculate_points,
     get_user_name,
@@ -168,27 +178,13 @@ async def handle_show_main_categories(
     try:
         quiz_type = context.user_data.get("quiz_type", "quantitative")
 
-        main_categories = database.get_data(
-            """
-            SELECT DISTINCT mc.id, mc.name 
-            FROM main_categories mc
-            JOIN questions q ON mc.id = q.main_category_id
-            WHERE q.question_type = ?
-            LIMIT ? OFFSET ?
-            """,
-            (quiz_type, CATEGORIES_PER_PAGE, (page - 1) * CATEGORIES_PER_PAGE),
+        all_main_categories = await database.db.run(
+            category_registry.main_categories_for_type, quiz_type
         )
+        main_categories = paginate(all_main_categories, page, CATEGORIES_PER_PAGE)
 
         # Get the total count for pagination
-        total_categories = database.get_data(
-            """
-            SELECT COUNT(DISTINCT mc.id)
-            FROM main_categories mc
-            JOIN questions q ON mc.id = q.main_category_id
-            WHERE q.question_type = ?
-            """,
-            (quiz_type,),
-        )[0][0]
+        total_categories = len(all_main_categories)
 
         total_pages = (
             total_categories + CATEGORIES_PER_PAGE - 1
@@ -250,12 +246,10 @@ async def handle_show_subcategories(
 ):
     """Displays a paginated list of subcategories."""
     try:
-        subcategories = database.get_data(
-            "SELECT id, name FROM subcategories LIMIT ? OFFSET ?",
-            (CATEGORIES_PER_PAGE, (page - 1) * CATEGORIES_PER_PAGE),
-        )
+        all_subcategories = await database.db.run(category_registry.subcategories)
+        subcategories = paginate(all_subcategories, page, CATEGORIES_PER_PAGE)
 
-        total_categories = database.get_data("SELECT COUNT(*) FROM subcategories")[0][0]
+        total_categories = len(all_subcategories)
         total_pages = (
             total_categories + CATEGORIES_PER_PAGE - 1
         ) // CATEGORIES_PER_PAGE
@@ -425,8 +419,15 @@ async def start_quiz(update: Update, context: CallbackContext):
         category_type = context.user_data["category_type"]
 
         # Retrieve questions based on category type (main or sub)
-        questions = get_questions_by_category(
-            category_id, num_questions, category_type, context.user_data["quiz_type"]
+        questions = (
+            await database.db.run(
+                get_questions_by_category,
+                category_id,
+                num_questions,
+                category_type,
+                context.user_data["quiz_type"],
+                user_id,
+            )
         )[0]
         if not questions:
             logger.error(
@@ -438,17 +439,20 @@ async def start_quiz(update: Update, context: CallbackContext):
             return ConversationHandler.END
 
         context.user_data["questions"] = questions
+        # Category questions are drawn one by one, not as passage groups.
+        context.user_data["passage_groups"] = False
         context.user_data["current_question"] = 0
         context.user_data["score"] = 0
+        context.user_data["wrong_question_ids"] = []
         context.user_data["start_time"] = datetime.now()
 
         # Create a new entry in the previous_tests table using database function
-        previous_test_id = database.execute_query_return_id(
+        previous_test_id = await database.db.execute_return_id(
             """
             INSERT INTO previous_tests (user_id, timestamp, num_questions, score, time_taken, pdf_path) 
             VALUES (?, ?, ?, 0, 0, '')
             """,
-            (user_id, str(datetime.now()), num_questions),
+            (user_id, now_epoch(), num_questions),
         )
 
         context.user_data["previous_test_id"] = previous_test_id  # Store in user_data
@@ -479,57 +483,13 @@ async def send_question(update: Update, context: CallbackContext):
     current_question_index = context.user_data["current_question"]
 
     if current_question_index < len(questions):
-        question_data = questions[current_question_index]
-        (
-            question_id,
-            correct_answer,
-            question_text,
-            option_a,
-            option_b,
-            option_c,
-            option_d,
-            explanation,
-            main_category_id,
-            question_type,
-            image_path,
-            passage_name,
-            *_,
-        ) = question_data
-        passage_content = ""
-        if passage_name != "-":
-            passage_content = get_passage_content(CONTEXT_DIRECTORY, passage_name)
-
-        passage_text = f"النص: {passage_content}\n\n" if passage_content else ""
-        # Create a list of answer options and shuffle them
-        answer_options = [
-            (f"أ. {option_a}", f"answer_{question_id}_أ"),
-            (f"ب. {option_b}", f"answer_{question_id}_ب"),
-            (f"ج. {option_c}", f"answer_{question_id}_ج"),
-            (f"د. {option_d}", f"answer_{question_id}_د"),
-        ]
-        random.shuffle(answer_options)
-
-        # Create the keyboard with shuffled options
-        keyboard = []
-        for i in range(0, len(answer_options), 2):  # Create rows of 2 buttons
-            row = [
-                InlineKeyboardButton(text, callback_data=data)
-                for text, data in answer_options[i : i + 2]
-            ]
-            keyboard.append(row)
-
-        reply_markup = InlineKeyboardMarkup(keyboard)
         try:
-            if current_question_index == 0:
-                await update.effective_message.reply_text(
-                    f"{passage_text}" f"*{current_question_index+1}.* {question_text}",
-                    reply_markup=reply_markup,
-                )
-            else:
-                await update.effective_message.edit_text(
-                    f"{passage_text}" f"*{current_question_index+1}.* {question_text}",
-                    reply_markup=reply_markup,
-                )
+            await send_question_message(
+                update.effective_message,
+                context.user_data,
+                questions[current_question_index],
+                current_question_index,
+            )
         except Exception as e:
             logger.error(f"Error sending question: {e}")
             await update.effective_message.reply_text(
@@ -599,6 +559,7 @@ async def handle_answer(update: Update, context: CallbackContext):
             show_alert=True,
         )
     else:
+        context.user_data.setdefault("wrong_question_ids", []).append(question_id)
         correct_option_text = get_option_text(question_data, correct_answer)
         user_answer_text = get_option_text(question_data, user_answer)
 
@@ -623,8 +584,9 @@ async def record_user_answer(
     previous_test_id: int,
 ):
     """Records the user's answer to a question."""
+    seen_questions.record_answer(user_id, question_id, is_correct)
     try:
-        database.execute_query(
+        await database_writer.write(
             """
             INSERT INTO user_answers (user_id, question_id, user_answer, is_correct, previous_tests_id)
             VALUES (?, ?, ?, ?, ?)
@@ -662,14 +624,14 @@ async def end_quiz(update: Update, context: CallbackContext):
         user_id = update.effective_user.id
 
         # Update user's total usage time in the database
-        update_user_usage_time(user_id, total_time)
+        await update_user_usage_time(user_id, total_time)
 
         # Update user's total created questions in the database
-        update_user_created_questions(user_id, total_questions)
+        await database.db.run(update_user_created_questions, user_id, total_questions)
 
         # Calculate and award points
         points_earned = calculate_points(total_time, score, total_questions)
-        update_user_points(user_id, points_earned)
+        await update_user_points(user_id, points_earned)
         user_id = update.effective_user.id
 
         if (
@@ -692,6 +654,14 @@ async def end_quiz(update: Update, context: CallbackContext):
                 ),
             ],
         ]
+        if context.user_data.get("wrong_question_ids"):
+            keyboard.append(
+                [
+                    InlineKeyboardButton(
+                        "أسئلة مشابهة لأخطائك 🔁", callback_data="more_like_mistakes"
+                    )
+                ]
+            )
         await update.effective_message.reply_text(
             "اختر صيغة الملف النهائي:", reply_markup=InlineKeyboardMarkup(keyboard)
         )
@@ -702,6 +672,22 @@ async def end_quiz(update: Update, context: CallbackContext):
         )
 
 
+async def handle_more_like_mistakes(update: Update, context: CallbackContext):
+    """Lists questions similar to the ones answered wrong in the last test."""
+    query = update.callback_query
+    await query.answer()
+    results = await database.db.run(
+        similar_to_any, context.user_data.get("wrong_question_ids", [])
+    )
+    if not results:
+        await query.message.reply_text("لا توجد أسئلة مشابهة لأخطائك حاليا 🚫")
+        return
+    await query.message.reply_text(
+        "تدرب على أسئلة مشابهة لما أخطأت فيه، اختر النموذج:",
+        reply_markup=material_keyboard(results),
+    )
+
+
 async def handle_output_format_choice(update: Update, context: CallbackContext):
     """Handles the user's choice of output format."""
     query = update.callback_query
@@ -724,29 +710,21 @@ async def handle_output_format_choice(update: Update, context: CallbackContext):
     category_type = context.user_data["category_type"]
 
     if category_type == "main_category_id":
-        category_name = database.get_data(
-            "SELECT name FROM main_categories WHERE id = ?", (category_id,)
-        )[0][
-            0
-        ]  # Access the first element of the tuple and then the first element of the list
+        category_name = await get_main_category_name(category_id)
     elif category_type == "sub_category_id":
-        category_name = database.get_data(
-            "SELECT name FROM subcategories WHERE id = ?", (category_id,)
-        )[0][
-            0
-        ]  # Access the first element of the tuple and then the first element of the list
+        category_name = await get_subcategory_name(category_id)
     else:
         logger.error(f"Invalid category_type: {category_type}")
         category_name = "غير محدد"
 
-    test_number = database.get_data(
+    test_number = (await database.db.fetch_all(
         """
         SELECT COUNT(*) 
         FROM previous_tests 
         WHERE user_id = ? AND id <= ?
         """,
         (user_id, previous_test_id),
-    )[0][0]
+    ))[0][0]
 
     # Collect user data for the Main page
     phone_number = await get_user_phone_number(user_id)
@@ -819,7 +797,7 @@ async def handle_output_format_choice(update: Update, context: CallbackContext):
             )  # Video generation failed.
     try:
         # Update the previous_tests entry
-        database.execute_query(
+        await database.db.execute(
             """
             UPDATE previous_tests
             SET score = ?, time_taken = ?, pdf_path = ?, video_path = ?
@@ -915,15 +893,15 @@ async def handle_list_previous_tests(update: Update, context: CallbackContext):
     page = int(data[1]) if len(data) > 1 else 1
 
     # Retrieve total test count for pagination
-    total_tests = database.get_data(
+    total_tests = (await database.db.fetch_all(
         "SELECT COUNT(*) FROM previous_tests WHERE user_id = ?", (user_id,)
-    )[0][0]
+    ))[0][0]
 
     # Calculate offset for pagination
     offset = (page - 1) * ITEMS_PER_PAGE
 
     # Retrieve test records for the current page
-    test_records = database.get_data(
+    test_records = await database.db.fetch_all(
         "SELECT id, timestamp, score, num_questions FROM previous_tests WHERE user_id = ? ORDER BY timestamp DESC LIMIT ? OFFSET ?",
         (user_id, ITEMS_PER_PAGE, offset),
     )
@@ -936,7 +914,7 @@ async def handle_list_previous_tests(update: Update, context: CallbackContext):
     keyboard = []
     for i, record in enumerate(test_records):
         test_id, timestamp, score, num_questions = record
-        date_time = datetime.fromisoformat(timestamp)
+        date_time = from_epoch(timestamp)
         formatted_date = date_time.strftime("%Y-%m-%d %H:%M")  # Example format
         keyboard.append(
             [
@@ -1050,24 +1028,25 @@ async def download_test_video(update: Update, context: CallbackContext):
 
 async def get_test_data(test_id):
     """Retrieves test data from the database."""
-    return database.get_data(
+    return await database.db.fetch_all(
         """
         SELECT pt.timestamp, pt.num_questions, pt.score, pt.time_taken, pt.pdf_path, pt.user_id,
                COUNT(CASE WHEN ua.is_correct = 1 THEN 1 END) as correct_answers,
                COUNT(ua.id) as total_answered
         FROM previous_tests pt
-        LEFT JOIN user_answers ua ON pt.id = ua.previous_tests_id
+        LEFT JOIN all_user_answers ua ON pt.id = ua.previous_tests_id AND ua.previous_tests_id = ?
         WHERE pt.id = ?
         GROUP BY pt.id
         """,
-        (test_id,),
+        # The id is repeated so the lookup reaches the indexes inside the view
+        (test_id, test_id),
     )
 
 def format_test_details_message(
     timestamp, num_questions, score, time_taken, correct_answers, total_answered
 ):
     """Formats the test details message."""
-    test_date = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S.%f").strftime(
+    test_date = from_epoch(timestamp).strftime(
         "%Y/%m/%d %H:%M"
     )
     percentage = (score / num_questions) * 100 if num_questions > 0 else 0
@@ -1083,15 +1062,15 @@ def format_test_details_message(
 
 async def get_user_data_for_test(user_id, test_id, timestamp, num_questions, score):
     """Gets user data for the test."""
-    end_time = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S.%f")
-    test_number = database.get_data(
+    end_time = from_epoch(timestamp)
+    test_number = (await database.db.fetch_all(
         """
         SELECT COUNT(*) 
         FROM previous_tests 
         WHERE user_id = ? AND id <= ?
         """,
         (user_id, test_id),
-    )[0][0]
+    ))[0][0]
 
     percentage = (score / num_questions) * 100 if num_questions > 0 else 0
 
@@ -1123,7 +1102,7 @@ async def handle_download_test_file(update: Update, context: CallbackContext, fi
 
     generating_message = await query.message.reply_text(f"جارٍ إنشاء ملف {file_type.upper()}... ⏳")
 
-    test_details = database.get_data(
+    test_details = await database.db.fetch_all(
         f"""
         SELECT user_id, {file_type}_path, timestamp 
         FROM previous_tests 
@@ -1144,11 +1123,11 @@ async def handle_download_test_file(update: Update, context: CallbackContext, fi
     if not file_path or not os.path.exists(file_path):
         await generating_message.edit_text(f"جارٍ إنشاء ملف {file_type.upper()}... 🔄")
 
-        questions = database.get_data(
+        questions = await database.db.fetch_all(
             """
             SELECT q.* 
             FROM questions q
-            JOIN user_answers ua ON q.id = ua.question_id
+            JOIN all_user_answers ua ON q.id = ua.question_id
             WHERE ua.previous_tests_id = ?
             """,
             (test_id,),
@@ -1174,7 +1153,7 @@ async def handle_download_test_file(update: Update, context: CallbackContext, fi
             )
 
         if file_path:
-            database.execute_query(
+            await database.db.execute(
                 f"UPDATE previous_tests SET {file_type}_path = ? WHERE id = ?",
                 (file_path, test_id),
             )
@@ -1214,6 +1193,7 @@ TESTS_HANDLERS = {
 TESTS_HANDLERS_PATTERN = {
     r"^handle_list_previous_tests:\d+$": handle_list_previous_tests,
     r"^output_format_tests:.+$": handle_output_format_choice,
+    r"^more_like_mistakes$": handle_more_like_mistakes,
     r"^download_tests_pdf:.+$": download_test_pdf,
     r"^download_tests_video:.+$": download_test_video,
     r"^main_category_page:\d+$": lambda update, context: handle_show_main_categories(
@@ -55,7 +55,7 @@ async def generate_material_pdf(main_category_id, subcategory_id, question_id, u
             "modelNumber": question_id,
             "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),  # Current date and time
             "materialCategory": await get_main_category_name(main_category_id) if main_category_id else "غير محدد",
-            "materialSubcategory": await get_subcategory_name(subcategory_id) if subcategory_id else "غير محدد",
+            "materialSubcategory": await get_subcategory_name(subcategory_id) or "غير محدد",
             "questionText": question_text, # Adding question text to the main page
         }
 
@@ -130,7 +130,7 @@ async def generate_material_video(main_category_id, subcategory_id, question_id,
             "modelNumber": question_id,
             "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),  # Current date and time
             "materialCategory": await get_main_category_name(main_category_id) if main_category_id else "غير محدد",
-            "materialSubcategory": await get_subcategory_name(subcategory_id) if subcategory_id else "غير محدد",
+            "materialSubcategory": await get_subcategory_name(subcategory_id) or "غير محدد",
             "questionText": question_text, # Adding question text to the main page
         }
 
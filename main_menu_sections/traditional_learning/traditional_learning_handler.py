@@ -1,18 +1,33 @@
 import os
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
-from telegram.ext import CallbackContext
+from telegram.ext import (
+    CallbackContext,
+    CallbackQueryHandler,
+    CommandHandler,
+    ConversationHandler,
+    MessageHandler,
+    filters,
+)
 from telegram.error import BadRequest
 from main_menu_sections.traditional_learning.generating_materials import generate_material_pdf, generate_material_text, generate_material_video
 from utils.section_manager import section_manager
 from utils.category_mangement import (
+    get_main_categories,
     get_main_categories_by_subcategory,
+    get_main_category_name,
     get_material_path,
     get_subcategories,
     get_subcategories_all,
+    get_subcategory_name,
 )
+from utils import database
 from utils.database import get_data
+from utils.question_search import search_questions
+from utils.question_similarity import similar_questions
 from utils.subscription_management import check_subscription
 
+WAITING_FOR_SEARCH_QUERY = 0
+
 
 async def handle_traditional_learning(update: Update, context: CallbackContext):
     """Handles the 'التعلم بالطريقة التقليدية' option."""
@@ -66,6 +81,7 @@ async def handle_traditional_learning_type(update: Update, context: CallbackCont
                     "تصفح حسب التصنيف الرئيسي 🗂️", callback_data="show_main_categories"
                 )
             ],
+            [InlineKeyboardButton("البحث في الأسئلة 🔍", callback_data="search_questions")],
             [
                 InlineKeyboardButton(
                     "الرجوع للخلف 🔙", callback_data="traditional_learning"
@@ -84,6 +100,7 @@ async def handle_traditional_learning_type(update: Update, context: CallbackCont
                     "تصفح حسب التصنيف الفرعي 🗂️", callback_data="show_subcategories"
                 )
             ],
+            [InlineKeyboardButton("البحث في الأسئلة 🔍", callback_data="search_questions")],
             [
                 InlineKeyboardButton(
                     "الرجوع للخلف 🔙", callback_data="traditional_learning"
@@ -107,9 +124,7 @@ async def handle_show_main_categories(update: Update, context: CallbackContext):
     parts = callback_data.split(":")
     page = int(parts[1]) if len(parts) > 1 else 1
 
-    categories = get_data(
-        "SELECT id, name FROM main_categories LIMIT 10 OFFSET ?", ((page - 1) * 10,)
-    )
+    categories = await database.db.run(get_main_categories, page=page)
     keyboard = []
     for category in categories:
         if context.user_data.get("question_type") == "verbal":
@@ -157,11 +172,9 @@ async def handle_show_subcategories(update: Update, context: CallbackContext):
         main_category_id = int(parts[1])
         page = int(parts[2]) if len(parts) > 2 else 1
 
-        subcategories = get_subcategories(main_category_id, page=page)
+        subcategories = await database.db.run(get_subcategories, main_category_id, page=page)
 
-        main_category_name = get_data(
-            "SELECT name FROM main_categories WHERE id = ?", (main_category_id,)
-        )[0][0]
+        main_category_name = await get_main_category_name(main_category_id)
 
         keyboard = []
         for subcategory in subcategories:
@@ -215,11 +228,11 @@ async def handle_show_subcategories(update: Update, context: CallbackContext):
         subcategory_id = int(parts[1])
         page = int(parts[2]) if len(parts) > 2 else 1
 
-        main_categories = get_main_categories_by_subcategory(subcategory_id, page=page)
+        main_categories = await database.db.run(
+            get_main_categories_by_subcategory, subcategory_id, page=page
+        )
 
-        subcategory_name = get_data(
-            "SELECT name FROM subcategories WHERE id = ?", (subcategory_id,)
-        )[0][0]
+        subcategory_name = await get_subcategory_name(subcategory_id)
 
         keyboard = []
         for main_category in main_categories:
@@ -271,7 +284,7 @@ async def handle_show_subcategories(update: Update, context: CallbackContext):
 
     else:
         page = int(parts[1]) if len(parts) > 1 else 1
-        subcategories = get_subcategories_all(page=page)
+        subcategories = await database.db.run(get_subcategories_all, page=page)
 
         keyboard = []
         for subcategory in subcategories:
@@ -324,19 +337,17 @@ async def handle_material_selection(update: Update, context: CallbackContext):
     callback_data = update.callback_query.data
     parts = callback_data.split(":")
     main_category_id = int(parts[1])
+    subcategory_id = int(parts[2]) if len(parts) > 2 else 0  # 0 for verbal
     page = int(parts[3]) if len(parts) > 3 else 1  # Extract page number
     QUESTIONS_PER_PAGE = 10
 
-    main_category_name = get_data(
-        "SELECT name FROM main_categories WHERE id = ?", (main_category_id,)
-    )[0][0]
+    main_category_name = await get_main_category_name(main_category_id)
 
-    if context.user_data.get("question_type") == "verbal":
-        subcategory_id = 0  # Placeholder for verbal
+    if not subcategory_id:
         questions = get_data(
             """
             SELECT id, question_text 
-            FROM questions 
+            FROM active_questions 
             WHERE main_category_id = ? AND question_type = 'verbal'
             LIMIT ? OFFSET ?
             """,
@@ -345,7 +356,7 @@ async def handle_material_selection(update: Update, context: CallbackContext):
         total_questions = get_data( # Getting the total for pagination of verbal questions.
             """
             SELECT COUNT(*)
-            FROM questions
+            FROM active_questions
             WHERE main_category_id = ? AND question_type = 'verbal'
             """,
             (main_category_id,),
@@ -353,26 +364,25 @@ async def handle_material_selection(update: Update, context: CallbackContext):
 
         back_button_data = "traditional_learning:verbal"
     else:
-        subcategory_id = int(parts[2])
-        subcategory_name = get_data(
-            "SELECT name FROM subcategories WHERE id = ?", (subcategory_id,)
-        )[0][0]
+        # Questions carry only their main category; the subcategory groups
+        # main categories through main_sub_links.
+        subcategory_name = await get_subcategory_name(subcategory_id)
         questions = get_data(
              """
             SELECT id, question_text 
-            FROM questions 
-            WHERE main_category_id = ? AND subcategory_id = ?
+            FROM active_questions 
+            WHERE main_category_id = ? AND question_type = 'quantitative'
             LIMIT ? OFFSET ?
             """,
-            (main_category_id, subcategory_id, QUESTIONS_PER_PAGE, (page - 1) * QUESTIONS_PER_PAGE),
+            (main_category_id, QUESTIONS_PER_PAGE, (page - 1) * QUESTIONS_PER_PAGE),
         )
         total_questions = get_data(
             """
             SELECT COUNT(*)
-            FROM questions
-            WHERE main_category_id = ? AND subcategory_id = ?
+            FROM active_questions
+            WHERE main_category_id = ? AND question_type = 'quantitative'
             """,
-             (main_category_id, subcategory_id),
+             (main_category_id,),
         )[0][0]
 
 
@@ -418,7 +428,7 @@ async def handle_material_selection(update: Update, context: CallbackContext):
     reply_markup = InlineKeyboardMarkup(keyboard)
 
 
-    if context.user_data.get("question_type") == "verbal":
+    if not subcategory_id:
         message_text = f"اختر رقم النموذج من '{main_category_name}':"
     else:
         message_text = (f"اختر رقم النموذج من '{main_category_name}' من التصنيف الفرعي '{subcategory_name}':")
@@ -448,6 +458,7 @@ async def handle_show_format_options(update: Update, context: CallbackContext):
             InlineKeyboardButton("PDF 📄", callback_data="send_material:pdf"),
             InlineKeyboardButton("فيديو 🎥", callback_data="send_material:video"),
         ],
+        [InlineKeyboardButton("أسئلة مشابهة 🔁", callback_data=f"more_like:{question_id}")],
         [
             InlineKeyboardButton(
                 "الرجوع للخلف 🔙",
@@ -504,6 +515,88 @@ async def handle_send_material(update: Update, context: CallbackContext):
         await update.callback_query.message.reply_text("صيغة غير مدعومة. 🚫")
 
 
+def material_keyboard(questions) -> InlineKeyboardMarkup:
+    """One material button per search_questions() row."""
+    return InlineKeyboardMarkup(
+        [
+            [
+                InlineKeyboardButton(
+                    f"نموذج {question_id}: {question_text}",
+                    callback_data=f"show_format_options:{main_category_id}:{subcategory_id}:{question_id}",
+                )
+            ]
+            for question_id, _, main_category_id, subcategory_id, question_text in questions
+        ]
+    )
+
+
+async def handle_more_like_this(update: Update, context: CallbackContext):
+    """Lists the questions most similar to a question, precomputed by build-similar."""
+    query = update.callback_query
+    await query.answer()
+    question_id = int(query.data.split(":")[1])
+    results = await database.db.run(similar_questions, question_id)
+    if not results:
+        await query.message.reply_text("لا توجد أسئلة مشابهة لهذا السؤال حاليا 🚫")
+        return
+    await query.message.reply_text(
+        "أسئلة مشابهة، اختر النموذج:", reply_markup=material_keyboard(results)
+    )
+
+
+async def handle_search_start(update: Update, context: CallbackContext):
+    """Asks for the words to search the questions for (button or /search)."""
+    if update.callback_query:
+        query = update.callback_query
+        await query.answer()
+        # From the button, search the question type being browsed
+        context.user_data["search_question_type"] = context.user_data.get("question_type")
+        message = query.message
+    else:
+        context.user_data["search_question_type"] = None
+        message = update.message
+
+    if not await check_subscription(update, context):
+        return ConversationHandler.END
+
+    await message.reply_text("أرسل كلمات البحث 🔍 (أو /cancel للإلغاء):")
+    return WAITING_FOR_SEARCH_QUERY
+
+
+async def handle_search_query(update: Update, context: CallbackContext):
+    """Lists the questions matching the search words as material buttons."""
+    question_type = context.user_data.pop("search_question_type", None)
+    results = await database.db.run(search_questions, update.message.text, question_type)
+    if not results:
+        await update.message.reply_text("لا توجد نتائج لهذا البحث 🚫")
+        return ConversationHandler.END
+
+    await update.message.reply_text(
+        "نتائج البحث، اختر النموذج:", reply_markup=material_keyboard(results)
+    )
+    return ConversationHandler.END
+
+
+async def cancel_search(update: Update, context: CallbackContext):
+    context.user_data.pop("search_question_type", None)
+    await update.message.reply_text("تم إلغاء البحث.")
+    return ConversationHandler.END
+
+
+search_conv_handler = ConversationHandler(
+    entry_points=[
+        CallbackQueryHandler(handle_search_start, pattern="^search_questions$"),
+        CommandHandler("search", handle_search_start),
+    ],
+    states={
+        WAITING_FOR_SEARCH_QUERY: [
+            MessageHandler(filters.TEXT & ~filters.COMMAND, handle_search_query)
+        ],
+    },
+    fallbacks=[CommandHandler("cancel", cancel_search)],
+)
+
+
 # Dictionary to map handler names to functions (for simple callback data)
 TRADITIONAL_LEARNING_HANDLERS = { }
 
@@ -522,4 +615,5 @@ TRADITIONAL_LEARNING_HANDLERS_PATTERNS = {
     r"^sel_mat:(\d+):(\d+):(\d+)$": handle_material_selection,
     r"^show_format_options:\w+:\w+:\d+$": handle_show_format_options,
     r"^send_material:(text|pdf|video)$": handle_send_material,
+    r"^more_like:\d+$": handle_more_like_this,
 }
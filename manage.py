@@ -4,7 +4,7 @@ import asyncio
 import sys
 from typing import Callable, Dict, Optional
 import os
-from config import DATABASE_FILE
+from config import DATABASE_BACKEND, DATABASE_FILE
 from utils.database import get_data
 
 class CommandManager:
@@ -52,12 +52,16 @@ class CommandManager:
 
 
 def initbot(args):
-    from config import DATABASE_FILE
+    from utils.database import DATABASE_FILES
 
     remove_db = args.rmdb if hasattr(args, "rmdb") else False
 
-    if os.path.exists(DATABASE_FILE) and remove_db:
-        os.remove(DATABASE_FILE)
+    if remove_db:
+        # The main database and the attached ones, with their WAL files.
+        for path in DATABASE_FILES.values():
+            for file in (path, f"{path}-wal", f"{path}-shm"):
+                if os.path.exists(file):
+                    os.remove(file)
     create_db(args)
     generate_verbal_questions(args)
     create_context_files_command(args)
@@ -85,10 +89,152 @@ def finetune(args):
 
 
 def create_db(args):
-    # Import and run database creation logic
-    from utils.database import create_tables
+    # Create the schema (if missing) and apply pending migrations
+    from utils.migrations import migrate
 
-    create_tables()
+    migrate()
+
+
+def migrate_db(args):
+    """Upgrades the database schema and prints a query plan report."""
+    from utils.migrations import LATEST_VERSION, format_plan_report, migrate
+
+    from_version, to_version, plans_before, plans_after = migrate(args.target)
+    if from_version == to_version:
+        print(f"Database is up to date (schema v{to_version}).")
+    else:
+        print(f"Migrated database from schema v{from_version} to v{to_version} (latest v{LATEST_VERSION}).")
+    print()
+    print("Query plans:")
+    print(format_plan_report(plans_before, plans_after))
+
+
+def setup_migrate_args(parser):
+    parser.add_argument(
+        "--target", type=int, default=None, help="Schema version to migrate to (default: latest)"
+    )
+
+
+def db_stats(args):
+    """Prints the query latency statistics written by the running bot."""
+    from utils.query_stats import format_stats_report, load_stats
+
+    print(format_stats_report(load_stats(), sort_by=args.sort, limit=args.limit))
+
+
+def setup_db_stats_args(parser):
+    parser.add_argument(
+        "--sort",
+        choices=["total_ms", "count", "max_ms", "slow_count"],
+        default="total_ms",
+        help="Column to sort statements by",
+    )
+    parser.add_argument("--limit", type=int, default=20, help="Number of statements to show")
+
+
+def compact_answers_command(args):
+    """Folds answers of old tests into user_category_stats and archives them."""
+    from utils.answer_rollup import compact_answers
+
+    for source, (tests, answers) in compact_answers(args.days, args.batch).items():
+        print(f"{source}: compacted {answers} answers of {tests} tests")
+
+
+def setup_compact_answers_args(parser):
+    from config import ANSWER_COMPACTION_AGE_DAYS, ANSWER_COMPACTION_BATCH_SIZE
+
+    parser.add_argument(
+        "--days",
+        type=int,
+        default=ANSWER_COMPACTION_AGE_DAYS,
+        help="Compact answers of tests older than this many days",
+    )
+    parser.add_argument(
+        "--batch", type=int, default=ANSWER_COMPACTION_BATCH_SIZE, help="Tests per transaction"
+    )
+
+
+def snapshot_command(args):
+    """Writes a compressed online snapshot of the database, or lists them."""
+    from utils.snapshots import create_snapshot, list_snapshots, prune_snapshots
+
+    if DATABASE_BACKEND != "sqlite":
+        print("Snapshots copy the SQLite files; use pg_dump with the PostgreSQL backend.")
+        return
+    if args.list:
+        for taken_at, paths in list_snapshots(args.directory):
+            size = sum(os.path.getsize(path) for path in paths)
+            print(f"{taken_at:%Y-%m-%d %H:%M:%S}  {size / 1024:>10.0f} KiB  {', '.join(paths)}")
+        return
+    for path in create_snapshot(args.directory):
+        print(f"Snapshot written to {path}")
+    if not args.no_prune:
+        for path in prune_snapshots(args.directory):
+            print(f"Removed {path}")
+
+
+def setup_snapshot_args(parser):
+    from config import SNAPSHOT_DIRECTORY
+
+    parser.add_argument(
+        "--directory", default=SNAPSHOT_DIRECTORY, help="Folder the snapshots are kept in"
+    )
+    parser.add_argument("--list", action="store_true", help="List existing snapshots")
+    parser.add_argument(
+        "--no-prune", action="store_true", help="Keep old snapshots (skip the retention rules)"
+    )
+
+
+def db_maintain(args):
+    """Runs ANALYZE/optimize, incremental vacuum, checkpoints and integrity checks."""
+    from utils.db_maintenance import (
+        enable_incremental_vacuum,
+        format_maintenance_report,
+        run_maintenance,
+    )
+
+    if DATABASE_BACKEND != "sqlite":
+        print("db-maintain works on the SQLite files; PostgreSQL relies on autovacuum.")
+        return
+    if args.enable_incremental_vacuum:
+        converted = enable_incremental_vacuum()
+        print(f"Enabled incremental vacuum on: {', '.join(converted) or 'nothing to convert'}")
+    report = run_maintenance(
+        time_budget=args.budget,
+        steps=args.steps,
+        analyze=args.analyze,
+        checkpoint_mode=args.checkpoint,
+        full_check=args.full_check,
+    )
+    print(format_maintenance_report(report))
+
+
+def setup_db_maintain_args(parser):
+    from config import MAINTENANCE_TIME_BUDGET_SECONDS
+    from utils.db_maintenance import MAINTENANCE_STEPS
+
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=MAINTENANCE_TIME_BUDGET_SECONDS,
+        help="Seconds the maintenance may take; later steps are skipped",
+    )
+    parser.add_argument(
+        "--steps", nargs="+", choices=MAINTENANCE_STEPS, default=None, help="Steps to run (default: all)"
+    )
+    parser.add_argument("--analyze", action="store_true", help="Run a full ANALYZE instead of PRAGMA optimize")
+    parser.add_argument(
+        "--checkpoint",
+        choices=["PASSIVE", "FULL", "RESTART", "TRUNCATE"],
+        default="TRUNCATE",
+        help="WAL checkpoint mode",
+    )
+    parser.add_argument("--full-check", action="store_true", help="Run integrity_check instead of quick_check")
+    parser.add_argument(
+        "--enable-incremental-vacuum",
+        action="store_true",
+        help="Convert existing files to auto_vacuum=INCREMENTAL (full VACUUM, stop the bot first)",
+    )
 
 
 def generate_verbal_questions(args):
@@ -98,16 +244,143 @@ def generate_verbal_questions(args):
     generate_question()
 
 
+def sync_questions_command(args):
+    """Re-imports the question workbooks, writing only the rows that changed."""
+    from utils.question_management import (
+        generate_questions_with_categories,
+        generate_verbal_questions,
+    )
+
+    if args.type in ("quantitative", "all"):
+        generate_questions_with_categories()
+    if args.type in ("verbal", "all"):
+        generate_verbal_questions()
+    # A snapshot of the old questions would no longer be used; refresh it.
+    from config import QUESTION_SNAPSHOT_FILE
+
+    if os.path.exists(QUESTION_SNAPSHOT_FILE):
+        build_snapshot_command(argparse.Namespace(path=QUESTION_SNAPSHOT_FILE))
+    # Likewise new and edited questions need their similar questions.
+    if get_data("SELECT 1 FROM question_similar LIMIT 1"):
+        build_similar_command(argparse.Namespace(k=None))
+
+
+def setup_sync_questions_args(parser):
+    parser.add_argument(
+        "--type",
+        choices=["verbal", "quantitative", "all"],
+        default="all",
+        help="Which workbook to sync",
+    )
+
+
+def build_snapshot_command(args):
+    """Writes the question bank as a file every bot process memory-maps."""
+    import time
+
+    from utils.question_bank import build_question_snapshot
+
+    started = time.perf_counter()
+    header = build_question_snapshot(args.path)
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(args.path)
+    print(
+        f"Wrote {header['count']} questions ({size / 1024:.0f} KiB) "
+        f"to {args.path} in {elapsed:.2f}s."
+    )
+
+
+def setup_build_snapshot_args(parser):
+    from config import QUESTION_SNAPSHOT_FILE
+
+    parser.add_argument(
+        "--path", default=QUESTION_SNAPSHOT_FILE, help="File to write the snapshot to"
+    )
+
+
+def build_similar_command(args):
+    """Precomputes the similar questions behind the "more like this" buttons."""
+    import time
+
+    from config import SIMILAR_QUESTIONS_PER_QUESTION
+    from utils.question_similarity import build_similar_questions
+
+    started = time.perf_counter()
+    result = build_similar_questions(args.k or SIMILAR_QUESTIONS_PER_QUESTION)
+    elapsed = time.perf_counter() - started
+    print(
+        f"Stored {result['neighbours']} similar questions for "
+        f"{result['questions']} questions in {elapsed:.2f}s."
+    )
+
+
+def setup_build_similar_args(parser):
+    parser.add_argument(
+        "--k", type=int, default=None, help="Similar questions to keep per question"
+    )
+
+
+def find_duplicates_command(args):
+    """Reports clusters of near-duplicate questions in the bank or an Excel file."""
+    import time
+
+    from generating_verable_questions.get_questions_from_excel_as_json import (
+        bank_question_texts,
+        drop_duplicate_questions,
+    )
+    from utils.question_dedup import dedup_text, find_near_duplicates
+
+    started = time.perf_counter()
+    if args.file:
+        import pandas as pd
+
+        df = pd.read_excel(args.file)
+        if args.drop:
+            kept_df = drop_duplicate_questions(df, threshold=args.threshold)
+            kept_df.to_excel(args.file, index=False)
+            print(f"Kept {len(kept_df)} of {len(df)} questions in {args.file}.")
+            return
+        labels = [f"row {index + 2}" for index in range(len(df))]
+        texts = [dedup_text(row) for row in df.to_dict("records")]
+    else:
+        ids, texts = bank_question_texts()
+        labels = [f"#{question_id}" for question_id in ids]
+    clusters = find_near_duplicates(texts, args.threshold)
+    for cluster in clusters:
+        print(", ".join(labels[index] for index in cluster), "|", texts[cluster[0]][:60])
+    elapsed = time.perf_counter() - started
+    print(
+        f"{len(clusters)} clusters ({sum(len(cluster) for cluster in clusters)} questions) "
+        f"among {len(texts)} questions in {elapsed:.2f}s."
+    )
+
+
+def setup_find_duplicates_args(parser):
+    from config import NEAR_DUPLICATE_THRESHOLD
+
+    parser.add_argument(
+        "--file", default=None, help="Excel file of generated questions (default: the question bank)"
+    )
+    parser.add_argument(
+        "--drop",
+        action="store_true",
+        help="Remove the file's questions that duplicate the bank or each other",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=NEAR_DUPLICATE_THRESHOLD,
+        help="Word-bigram Jaccard similarity from which questions are duplicates",
+    )
+
+
 def create_context_files_command(args):
-    """Creates context files from Excel data."""
-    from config import ARABIC_PARAGHRAPHS_MK_EXCEL_FILE, CONTEXT_DIRECTORY
-    output_dir = CONTEXT_DIRECTORY # Access the output_dir argument
-    print(os.path.exists(output_dir))
-    if not os.path.exists(output_dir):
-        from utils.question_management import create_context_files
+    """Imports the passages (question contexts) from Excel into the database."""
+    from config import ARABIC_PARAGHRAPHS_MK_EXCEL_FILE
+    from utils.question_management import import_passages_from_excel
 
-        excel_file = ARABIC_PARAGHRAPHS_MK_EXCEL_FILE  # Access the excel_file argument
-        create_context_files(excel_file, output_dir)
+    # Unchanged passages are skipped, so this is safe to run again
+    import_passages_from_excel(ARABIC_PARAGHRAPHS_MK_EXCEL_FILE)
 
 def generate_questions_from_chatgpt(args):
     from generating_verable_questions.get_questions_from_excel_as_json import generate_similar_questions_excel
@@ -203,16 +476,79 @@ def main():
 
     manager.register_command("createdb", create_db, "Create the database")
 
+    manager.register_command(
+        "migrate",
+        migrate_db,
+        "Apply pending database migrations",
+        setup_migrate_args,
+    )
+
+    manager.register_command(
+        "db-stats",
+        db_stats,
+        "Show per-statement query latency statistics",
+        setup_db_stats_args,
+    )
+
+    manager.register_command(
+        "compact-answers",
+        compact_answers_command,
+        "Roll up and archive answers of old tests",
+        setup_compact_answers_args,
+    )
+
+    manager.register_command(
+        "snapshot",
+        snapshot_command,
+        "Take an online, compressed snapshot of the database",
+        setup_snapshot_args,
+    )
+
+    manager.register_command(
+        "db-maintain",
+        db_maintain,
+        "Analyze, vacuum, checkpoint and check the databases",
+        setup_db_maintain_args,
+    )
+
     manager.register_command(
         "generate-verbal",
         generate_verbal_questions,
         "Putting the questions from excel file to database",
     )
 
+    manager.register_command(
+        "sync-questions",
+        sync_questions_command,
+        "Sync the questions with the Excel workbooks (keeps question ids)",
+        setup_sync_questions_args,
+    )
+
+    manager.register_command(
+        "build-snapshot",
+        build_snapshot_command,
+        "Write the question bank as a memory-mapped snapshot file",
+        setup_build_snapshot_args,
+    )
+
+    manager.register_command(
+        "build-similar",
+        build_similar_command,
+        "Precompute similar questions (TF-IDF) for \"more like this\"",
+        setup_build_similar_args,
+    )
+
+    manager.register_command(
+        "find-duplicates",
+        find_duplicates_command,
+        "Report (or drop) near-duplicate questions",
+        setup_find_duplicates_args,
+    )
+
     manager.register_command(
         "create-contexts",
         create_context_files_command,
-        "Create context files from Excel",
+        "Import passages (question contexts) from Excel into the database",
     )
 
     manager.register_command(
@@ -229,6 +565,15 @@ def main():
 ##### Example:
 # python manage.py finetune
 # python manage.py createdb
+# python manage.py migrate
+# python manage.py db-stats --sort max_ms --limit 10
+# python manage.py compact-answers --days 90
+# python manage.py snapshot
+# python manage.py snapshot --list
+# python manage.py db-maintain --budget 60 --full-check
+# python manage.py build-snapshot
+# python manage.py build-similar --k 10
+# python manage.py find-duplicates --file new_questions.xlsx --drop
 # python manage.py generate-verbal
 # python manage.py generate-questions --num 20
 
@@ -1,6 +1,5 @@
 import logging
 import os
-from datetime import datetime
 import platform
 
 from config import POWERPOINT_MAIN_PATH, Q_AND_A_FILE_PATH, Q_AND_A_FILE_PATH_POWERPOINT, WORD_MAIN_PATH
@@ -12,6 +11,8 @@ from template_maker.file_exports import (
     merge_word_documents,
 )
 from utils import database
+from utils.category_mangement import category_registry
+from utils.timestamps import from_epoch
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +30,9 @@ async def generate_quiz_pdf(
         os.makedirs(user_dir, exist_ok=True)  # Create if it doesn't exist
 
         # Prepare the data for the Word template
+        main_category_names = (
+            {} if category_name else dict(await database.db.run(category_registry.main_categories))
+        )
         quiz_data = []
         for i, question_data in enumerate(questions):
             (
@@ -50,9 +54,7 @@ async def generate_quiz_pdf(
             if category_name:
                 category = category_name
             else:
-                category = database.get_data(
-                    "SELECT name FROM main_categories WHERE id = ?", (main_category_id,)
-                )[0][0]
+                category = main_category_names.get(main_category_id)
 
             quiz_data.append(
                 {
@@ -75,13 +77,8 @@ async def generate_quiz_pdf(
         else:
             quiz = "ليس_محدد"
 
-        # Use the test timestamp instead of current date
-        try:
-            # Parse the timestamp to extract date and time
-            timestamp_obj = datetime.strptime(quiz_timestamp, "%Y-%m-%d %H:%M:%S.%f")
-        except ValueError:
-            # Fallback to parsing without microseconds
-            timestamp_obj = datetime.strptime(quiz_timestamp, "%Y-%m-%d %H:%M:%S")
+        # Use the test timestamp (an epoch, or the start datetime) instead of current date
+        timestamp_obj = from_epoch(quiz_timestamp)
 
         datestamp = timestamp_obj.strftime("%Y-%m-%d")
         timestamp = timestamp_obj.strftime("%H-%M-%S")
@@ -139,6 +136,9 @@ async def generate_quiz_video(
         user_dir = os.path.join(base_dir, str(user_id))
         os.makedirs(user_dir, exist_ok=True)  # Create if it doesn't exist
 
+        main_category_names = (
+            {} if category_name else dict(await database.db.run(category_registry.main_categories))
+        )
         quiz_data = []
         for i, question_data in enumerate(questions):
             (
@@ -160,9 +160,7 @@ async def generate_quiz_video(
             if category_name:
                 category = category_name
             else:
-                category = database.get_data(
-                    "SELECT name FROM main_categories WHERE id = ?", (main_category_id,)
-                )[0][0]
+                category = main_category_names.get(main_category_id)
 
             quiz_data.append(
                 {
@@ -185,13 +183,8 @@ async def generate_quiz_video(
         else:
             quiz = "ليس_محدد"
 
-        # Use the test timestamp instead of current date
-        try:
-            # Parse the timestamp to extract date and time
-            timestamp_obj = datetime.strptime(quiz_timestamp, "%Y-%m-%d %H:%M:%S.%f")
-        except ValueError:
-            # Fallback to parsing without microseconds
-            timestamp_obj = datetime.strptime(quiz_timestamp, "%Y-%m-%d %H:%M:%S")
+        # Use the test timestamp (an epoch, or the start datetime) instead of current date
+        timestamp_obj = from_epoch(quiz_timestamp)
 
         datestamp = timestamp_obj.strftime("%Y-%m-%d")
         timestamp = timestamp_obj.strftime("%H-%M-%S")
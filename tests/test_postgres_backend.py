@@ -0,0 +1,271 @@
+"""Integration tests of the PostgreSQL backend against a real server.
+
+Skipped unless TEST_DATABASE_URL points at a PostgreSQL server, e.g.
+
+    TEST_DATABASE_URL=postgresql://postgres@localhost/postgres python -m pytest tests
+
+The URL's user must be allowed to create databases: every test class works
+in a database of its own, dropped afterwards.
+"""
+
+import os
+import sqlite3
+import threading
+import unittest
+import uuid
+from unittest import mock
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+try:
+    import psycopg
+    from psycopg.conninfo import make_conninfo
+except ImportError:
+    psycopg = None
+
+from utils.storage_backends import PostgresBackend, translate_sql
+
+
+def setUpModule():
+    if not TEST_DATABASE_URL:
+        raise unittest.SkipTest("TEST_DATABASE_URL is not set")
+    if psycopg is None:
+        raise unittest.SkipTest("psycopg is not installed (requirements-postgres.txt)")
+
+
+class PostgresTestCase(unittest.TestCase):
+    """Gives each test class an empty database and a backend on it."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.database_name = f"student_helper_test_{uuid.uuid4().hex[:12]}"
+        with psycopg.connect(TEST_DATABASE_URL, autocommit=True) as admin:
+            admin.execute(f"CREATE DATABASE {cls.database_name}")
+        cls.url = make_conninfo(TEST_DATABASE_URL, dbname=cls.database_name)
+        cls.backend = PostgresBackend(cls.url)
+
+    @classmethod
+    def tearDownClass(cls):
+        with psycopg.connect(TEST_DATABASE_URL, autocommit=True) as admin:
+            admin.execute(f"DROP DATABASE IF EXISTS {cls.database_name} WITH (FORCE)")
+
+    def connect(self):
+        conn = self.backend.connect(attach=True)
+        self.addCleanup(conn.close)
+        return conn
+
+
+class TranslateSqlTest(PostgresTestCase):
+    def test_placeholders_and_literals(self):
+        conn = self.connect()
+        row = conn.execute("SELECT ? || '%?', 100 % 7", ("a",)).fetchone()
+        self.assertEqual(row, ("a%?", 2))
+        row = conn.execute("SELECT 'abc' LIKE '%b%', 'it''s ?' || ?", ("x",)).fetchone()
+        self.assertEqual(row, (True, "it's ?x"))
+
+    def test_create_table_ddl(self):
+        conn = self.connect()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS parents (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS children (
+                id INTEGER PRIMARY KEY,
+                parent_id INTEGER REFERENCES parents(id) ON DELETE CASCADE,
+                active BOOLEAN DEFAULT TRUE,
+                score REAL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (parent_id) REFERENCES parents(id) ON DELETE CASCADE
+            )
+            """
+        )
+        columns = dict(
+            conn.execute(
+                """
+                SELECT column_name, data_type FROM information_schema.columns
+                WHERE table_name = 'children'
+                """
+            ).fetchall()
+        )
+        self.assertEqual(columns["parent_id"], "bigint")
+        self.assertEqual(columns["active"], "bigint")
+        self.assertEqual(columns["score"], "double precision")
+        self.assertEqual(columns["created_at"], "timestamp without time zone")
+        # Foreign keys are left out, so orphans are accepted as in SQLite.
+        conn.execute("INSERT INTO children (parent_id, score) VALUES (?, ?)", (12345, 1.5))
+        conn.commit()
+        self.assertEqual(conn.execute("SELECT active FROM children").fetchone(), (1,))
+
+    def test_qualified_index(self):
+        conn = self.connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS chat.notes (id INTEGER PRIMARY KEY, body TEXT)")
+        conn.execute("CREATE INDEX IF NOT EXISTS chat.idx_notes_body ON notes(body)")
+        row = conn.execute(
+            "SELECT schemaname, tablename FROM pg_indexes WHERE indexname = 'idx_notes_body'"
+        ).fetchone()
+        self.assertEqual(row, ("chat", "notes"))
+
+    def test_insert_or_ignore_and_begin_immediate(self):
+        conn = self.connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS tags (name TEXT PRIMARY KEY)")
+        conn.execute("BEGIN IMMEDIATE")
+        self.assertTrue(conn.in_transaction)
+        conn.execute("INSERT OR IGNORE INTO tags (name) VALUES (?)", ("math",))
+        conn.execute("INSERT OR IGNORE INTO tags (name) VALUES (?)", ("math",))
+        conn.execute("COMMIT")
+        self.assertFalse(conn.in_transaction)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM tags").fetchone(), (1,))
+
+    def test_explain_query_plan(self):
+        conn = self.connect()
+        plan = conn.execute("EXPLAIN QUERY PLAN SELECT 1").fetchall()
+        self.assertTrue(plan)
+
+    def test_unsupported_statements(self):
+        with self.assertRaises(sqlite3.NotSupportedError):
+            translate_sql("PRAGMA user_version")
+        with self.assertRaises(sqlite3.NotSupportedError):
+            translate_sql("INSERT OR REPLACE INTO tags (name) VALUES (?)")
+
+
+class LastRowIdTest(PostgresTestCase):
+    def test_lastrowid(self):
+        conn = self.connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS users_test (id INTEGER PRIMARY KEY, name TEXT)")
+        first = conn.execute("INSERT INTO users_test (name) VALUES (?)", ("a",)).lastrowid
+        second = conn.execute("INSERT INTO users_test (name) VALUES (?)", ("b",)).lastrowid
+        conn.commit()
+        self.assertEqual((first, second), (1, 2))
+        self.assertEqual(
+            conn.execute("SELECT name FROM users_test WHERE id = ?", (second,)).fetchone(), ("b",)
+        )
+
+    def test_table_without_id(self):
+        conn = self.connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS pairs (a INTEGER, b INTEGER)")
+        cursor = conn.execute("INSERT INTO pairs (a, b) VALUES (?, ?)", (1, 2))
+        conn.commit()
+        self.assertIsNone(cursor.lastrowid)
+
+    def test_table_created_after_connection_opened(self):
+        # A long-lived connection (one per executor thread) must see the ids
+        # of tables that another connection creates later.
+        reader = self.connect()
+        reader.execute("SELECT 1")
+        reader.tables_with_id()
+
+        def create():
+            writer = self.backend.connect(attach=True)
+            try:
+                writer.execute("BEGIN")
+                writer.execute("CREATE TABLE IF NOT EXISTS later (id INTEGER PRIMARY KEY, body TEXT)")
+                # Loaded before the table is visible to other connections.
+                reader.tables_with_id()
+                writer.execute("COMMIT")
+            finally:
+                writer.close()
+
+        thread = threading.Thread(target=create)
+        thread.start()
+        thread.join()
+
+        cursor = reader.execute("INSERT INTO later (body) VALUES (?)", ("x",))
+        reader.commit()
+        self.assertEqual(cursor.lastrowid, 1)
+
+
+class ErrorMappingTest(PostgresTestCase):
+    def setUp(self):
+        conn = self.connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS accounts (id INTEGER PRIMARY KEY, email TEXT UNIQUE)")
+        conn.execute("DELETE FROM accounts")
+        conn.execute("INSERT INTO accounts (id, email) VALUES (?, ?)", (1, "a@example.com"))
+        conn.commit()
+
+    def test_integrity_error(self):
+        conn = self.connect()
+        with self.assertRaises(sqlite3.IntegrityError):
+            conn.execute("INSERT INTO accounts (email) VALUES (?)", ("a@example.com",))
+        conn.rollback()
+
+    def test_programming_error(self):
+        conn = self.connect()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conn.execute("SELEC 1")
+
+    def test_missing_table_is_operational_error(self):
+        conn = self.connect()
+        with self.assertRaises(sqlite3.Error):
+            conn.execute("SELECT * FROM no_such_table")
+
+    def test_lock_timeout_is_busy(self):
+        holder = self.connect()
+        waiter = self.connect()
+        waiter.raw.execute("SET lock_timeout = '100ms'")
+        holder.execute("UPDATE accounts SET email = ? WHERE id = ?", ("b@example.com", 1))
+        try:
+            with self.assertRaises(sqlite3.OperationalError) as raised:
+                waiter.execute("UPDATE accounts SET email = ? WHERE id = ?", ("c@example.com", 1))
+            self.assertIn("busy", str(raised.exception))
+        finally:
+            waiter.rollback()
+            holder.rollback()
+
+
+class MigrationsTest(PostgresTestCase):
+    def setUp(self):
+        from utils import database, migrations
+
+        self.database = database
+        self.migrations = migrations
+        for module in (database, migrations):
+            patcher = mock.patch.object(module, "backend", self.backend)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        database.connection_manager.close_all()
+        self.addCleanup(database.connection_manager.close_all)
+
+    def test_migrate_fresh_database(self):
+        latest = max(version for version, _, _ in self.migrations.MIGRATIONS)
+        from_version, to_version, _, _ = self.migrations.migrate()
+        self.assertEqual((from_version, to_version), (0, latest))
+
+        conn = self.connect()
+        for table in ("users", "questions", "passages", "question_sources", "question_similar"):
+            self.assertIsNotNone(
+                conn.execute("SELECT to_regclass(?)", (table,)).fetchone()[0], table
+            )
+        for table in ("chat.chat_history", "usage.chatgpt_usage"):
+            self.assertIsNotNone(
+                conn.execute("SELECT to_regclass(?)", (table,)).fetchone()[0], table
+            )
+
+        # Running it again finds nothing to do.
+        from_version, to_version, _, _ = self.migrations.migrate()
+        self.assertEqual((from_version, to_version), (latest, latest))
+
+        # The query helpers work on the migrated schema, lastrowid included.
+        self.database.execute_query(
+            "INSERT INTO users (telegram_id, name) VALUES (?, ?)", (42, "student")
+        )
+        self.assertEqual(
+            self.database.get_data("SELECT name FROM users WHERE telegram_id = ?", (42,)),
+            [("student",)],
+        )
+        test_id = self.database.execute_query_return_id(
+            "INSERT INTO previous_tests (user_id, num_questions) VALUES (?, ?)", (42, 10)
+        )
+        self.assertEqual(
+            self.database.get_data("SELECT num_questions FROM previous_tests WHERE id = ?", (test_id,)),
+            [(10,)],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,233 @@
+import bisect
+import math
+import random
+import threading
+import time
+from array import array
+
+from config import (
+    ADAPTIVE_CANDIDATES,
+    ADAPTIVE_MAX_QUESTIONS,
+    ADAPTIVE_MIN_QUESTIONS,
+    ADAPTIVE_TARGET_STANDARD_ERROR,
+    ITEM_DIFFICULTY_REFRESH_SECONDS,
+)
+from utils import database
+from utils.question_bank import question_bank, seen_questions
+
+# Adaptive level determination uses the one-parameter logistic (Rasch) model:
+# a student of ability theta answers a question of difficulty b correctly
+# with probability 1 / (1 + exp(b - theta)). Both live on the same logit
+# scale, 0 being a question half of the answers get right.
+
+# Abilities and difficulties are clamped to this range.
+MAX_LOGIT = 4.0
+
+
+def probability_correct(theta: float, difficulty: float) -> float:
+    return 1.0 / (1.0 + math.exp(difficulty - theta))
+
+
+def estimate_difficulty(answered: int, correct: int) -> float:
+    """Difficulty of a question from its answer counts (0 when unanswered).
+
+    The counts are smoothed with one right and one wrong answer, so
+    questions with few answers stay close to the middle of the scale.
+    """
+    difficulty = math.log((answered - correct + 1) / (correct + 1))
+    return max(-MAX_LOGIT, min(MAX_LOGIT, difficulty))
+
+
+def estimate_ability(responses) -> tuple:
+    """Returns (theta, standard_error) for [(difficulty, is_correct)].
+
+    Maximum a posteriori estimate with a standard normal prior, found with
+    Newton-Raphson; the prior keeps it finite for all-right or all-wrong
+    answers.
+    """
+    theta = 0.0
+    information = 1.0
+    for _ in range(25):
+        gradient = -theta
+        information = 1.0
+        for difficulty, is_correct in responses:
+            p = probability_correct(theta, difficulty)
+            gradient += (1.0 if is_correct else 0.0) - p
+            information += p * (1.0 - p)
+        step = gradient / information
+        theta = max(-MAX_LOGIT, min(MAX_LOGIT, theta + step))
+        if abs(step) < 1e-4:
+            break
+    return theta, 1.0 / math.sqrt(information)
+
+
+class DifficultyIndex:
+    """Question ids of each type sorted by estimated difficulty.
+
+    Difficulties are estimated from every recorded test and level
+    determination answer (archived ones included) and re-estimated every
+    ITEM_DIFFICULTY_REFRESH_SECONDS, or when the question bank reloads. The
+    question closest to an ability is then found by binary search.
+    """
+
+    def __init__(self, refresh_interval: float = ITEM_DIFFICULTY_REFRESH_SECONDS):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._sources = {}
+        self.difficulties = {}
+        self.ids = {}
+        self.difficulty_of = {}
+
+    def _ensure_fresh(self, question_type):
+        source = question_bank.ids_of_type(question_type)
+        if (
+            self._loaded_at is not None
+            and time.monotonic() - self._loaded_at < self.refresh_interval
+            and self._sources.get(question_type) is source
+        ):
+            return
+        with self._lock:
+            if (
+                self._loaded_at is not None
+                and time.monotonic() - self._loaded_at < self.refresh_interval
+                and self._sources.get(question_type) is source
+            ):
+                return
+            self._load()
+
+    def _load(self):
+        counts = {}
+        for view in ("all_user_answers", "all_level_determination_answers"):
+            for question_id, answered, correct in database.get_data(
+                f"""
+                SELECT question_id, COUNT(is_correct), COALESCE(SUM(is_correct), 0)
+                FROM {view} GROUP BY question_id
+                """
+            ):
+                previous = counts.get(question_id, (0, 0))
+                counts[question_id] = (previous[0] + answered, previous[1] + correct)
+
+        sources, difficulties, ids, difficulty_of = {}, {}, {}, {}
+        for question_type in question_bank.pools_by_type:
+            source = question_bank.ids_of_type(question_type)
+            ranked = sorted(
+                (estimate_difficulty(*counts.get(question_id, (0, 0))), question_id)
+                for question_id in source
+            )
+            sources[question_type] = source
+            difficulties[question_type] = array("d", (difficulty for difficulty, _ in ranked))
+            ids[question_type] = array("q", (question_id for _, question_id in ranked))
+            difficulty_of.update((question_id, difficulty) for difficulty, question_id in ranked)
+
+        self._sources = sources
+        self.difficulties = difficulties
+        self.ids = ids
+        self.difficulty_of = difficulty_of
+        self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        """Forces a re-estimate on the next lookup."""
+        self._loaded_at = None
+
+    def difficulty(self, question_id) -> float:
+        return self.difficulty_of.get(question_id, 0.0)
+
+    def closest(self, question_type, theta, exclude, candidates=ADAPTIVE_CANDIDATES, seen=None):
+        """Returns a question of the type with a difficulty close to theta.
+
+        Binary-searches theta, then walks outwards past excluded questions
+        and picks one of the `candidates` closest. Questions in seen are only
+        used when no other question is left.
+        """
+        self._ensure_fresh(question_type)
+        difficulties = self.difficulties.get(question_type, ())
+        ids = self.ids.get(question_type, ())
+        start = bisect.bisect_left(difficulties, theta)
+        for skip in (seen, None):
+            found = []
+            low, high = start - 1, start
+            while len(found) < candidates and (low >= 0 or high < len(ids)):
+                if high >= len(ids) or (
+                    low >= 0 and theta - difficulties[low] <= difficulties[high] - theta
+                ):
+                    index, low = low, low - 1
+                else:
+                    index, high = high, high + 1
+                question_id = ids[index]
+                if question_id in exclude or (skip is not None and question_id in skip):
+                    continue
+                found.append(question_id)
+            if found:
+                return random.choice(found)
+        return None
+
+    def expected_percentage(self, question_type, theta) -> float:
+        """Percentage of the type's questions a student of ability theta gets right."""
+        self._ensure_fresh(question_type)
+        difficulties = self.difficulties.get(question_type, ())
+        if not difficulties:
+            return 0
+        total = sum(probability_correct(theta, difficulty) for difficulty in difficulties)
+        return round(total / len(difficulties) * 100, 2)
+
+
+difficulty_index = DifficultyIndex()
+
+
+class AdaptiveTest:
+    """State of one adaptive level determination (kept in user_data).
+
+    Each answer updates the ability estimate; the next question is the one
+    whose difficulty is closest to it, which is where a question tells the
+    most about the student. The test ends once the estimate is precise
+    enough or max_questions were asked.
+    """
+
+    def __init__(
+        self,
+        user_id,
+        question_type,
+        max_questions=ADAPTIVE_MAX_QUESTIONS,
+        min_questions=ADAPTIVE_MIN_QUESTIONS,
+        target_standard_error=ADAPTIVE_TARGET_STANDARD_ERROR,
+    ):
+        self.user_id = user_id
+        self.question_type = question_type
+        self.max_questions = max_questions
+        self.min_questions = min(min_questions, max_questions)
+        self.target_standard_error = target_standard_error
+        self.asked = set()
+        self.responses = []
+        self.theta = 0.0
+        self.standard_error = 1.0
+
+    def next_question_id(self):
+        """Picks the next question (None when the type has no questions left)."""
+        question_id = difficulty_index.closest(
+            self.question_type,
+            self.theta,
+            self.asked,
+            seen=seen_questions.get(self.user_id),
+        )
+        if question_id is not None:
+            self.asked.add(question_id)
+        return question_id
+
+    def record(self, question_id, is_correct):
+        """Adds an answer and re-estimates the ability."""
+        self.responses.append((difficulty_index.difficulty(question_id), bool(is_correct)))
+        self.theta, self.standard_error = estimate_ability(self.responses)
+
+    def finished(self) -> bool:
+        answered = len(self.responses)
+        if answered >= self.max_questions:
+            return True
+        return (
+            answered >= self.min_questions
+            and self.standard_error <= self.target_standard_error
+        )
+
+    def expected_percentage(self) -> float:
+        """The level as the expected score over all questions of the type."""
+        return difficulty_index.expected_percentage(self.question_type, self.theta)
@@ -0,0 +1,142 @@
+import logging
+import sqlite3
+
+from config import ANSWER_COMPACTION_AGE_DAYS, ANSWER_COMPACTION_BATCH_SIZE
+from utils.database import transaction
+from utils.database_writer import database_writer
+from utils.timestamps import now_epoch
+
+logger = logging.getLogger(__name__)
+
+# Answers are only written while a test is running, so once a test is older
+# than the compaction age its answers never change again. Compaction folds
+# them into user_category_stats (which the user_category_totals view adds to
+# the live answers) and moves the raw rows to the *_archive tables, which the
+# all_* views still expose for test details and file regeneration.
+ANSWER_SOURCES = {
+    "tests": {
+        "table": "user_answers",
+        "archive": "user_answers_archive",
+        "parent": "previous_tests",
+        "parent_column": "previous_tests_id",
+        "columns": "id, user_id, previous_tests_id, question_id, user_answer, is_correct",
+    },
+    "level_determination": {
+        "table": "level_determination_answers",
+        "archive": "level_determination_answers_archive",
+        "parent": "level_determinations",
+        "parent_column": "level_determination_id",
+        "columns": "id, user_id, question_id, user_answer, is_correct, level_determination_id",
+    },
+}
+
+
+def compaction_cutoff(older_than_days: int = ANSWER_COMPACTION_AGE_DAYS) -> int:
+    """Returns the epoch before which tests are compacted."""
+    return now_epoch() - older_than_days * 86400
+
+
+def compact_answer_batch(
+    conn: sqlite3.Connection, source: str, cutoff: int, batch_size: int
+) -> tuple:
+    """Compacts the answers of up to batch_size tests older than cutoff.
+
+    Must run inside a transaction. Returns (tests, answers) compacted.
+    """
+    spec = ANSWER_SOURCES[source]
+    table, parent_column = spec["table"], spec["parent_column"]
+
+    parent_ids = [
+        row[0]
+        for row in conn.execute(
+            f"""
+            SELECT p.id FROM {spec['parent']} p
+            WHERE p.timestamp < ?
+            AND EXISTS (SELECT 1 FROM {table} a WHERE a.{parent_column} = p.id)
+            LIMIT ?
+            """,
+            (cutoff, batch_size),
+        )
+    ]
+    if not parent_ids:
+        return 0, 0
+    placeholders = ", ".join("?" * len(parent_ids))
+
+    conn.execute(
+        f"""
+        INSERT INTO user_category_stats (user_id, source, main_category_id, answered, correct, graded)
+        SELECT a.user_id, ?, q.main_category_id,
+               COUNT(a.id), COALESCE(SUM(a.is_correct), 0), COUNT(a.is_correct)
+        FROM {table} a
+        JOIN questions q ON a.question_id = q.id
+        WHERE a.{parent_column} IN ({placeholders})
+        AND a.user_id IS NOT NULL AND q.main_category_id IS NOT NULL
+        GROUP BY a.user_id, q.main_category_id
+        ON CONFLICT (user_id, source, main_category_id) DO UPDATE SET
+            answered = user_category_stats.answered + excluded.answered,
+            correct = user_category_stats.correct + excluded.correct,
+            graded = user_category_stats.graded + excluded.graded
+        """,
+        (source, *parent_ids),
+    )
+    conn.execute(
+        f"""
+        INSERT INTO {spec['archive']} ({spec['columns']})
+        SELECT {spec['columns']} FROM {table} WHERE {parent_column} IN ({placeholders})
+        """,
+        parent_ids,
+    )
+    answers = conn.execute(
+        f"DELETE FROM {table} WHERE {parent_column} IN ({placeholders})", parent_ids
+    ).rowcount
+    return len(parent_ids), answers
+
+
+def compact_answers(
+    older_than_days: int = ANSWER_COMPACTION_AGE_DAYS,
+    batch_size: int = ANSWER_COMPACTION_BATCH_SIZE,
+) -> dict:
+    """Compacts every old answer, one short transaction per batch.
+
+    Returns {source: (tests, answers)}. Used by `manage.py compact-answers`.
+    """
+    cutoff = compaction_cutoff(older_than_days)
+    totals = {}
+    for source in ANSWER_SOURCES:
+        tests = answers = 0
+        while True:
+            with transaction() as conn:
+                batch_tests, batch_answers = compact_answer_batch(
+                    conn, source, cutoff, batch_size
+                )
+            if not batch_tests:
+                break
+            tests += batch_tests
+            answers += batch_answers
+        totals[source] = (tests, answers)
+    return totals
+
+
+async def compact_answers_job(context):
+    """Periodic job: compacts old answers through the database writer.
+
+    Each batch is one writer transaction, so handler writes queued in between
+    are not held up for the whole compaction.
+    """
+    cutoff = compaction_cutoff()
+    for source in ANSWER_SOURCES:
+        tests = answers = 0
+        while True:
+            try:
+                batch_tests, batch_answers = await database_writer.run(
+                    compact_answer_batch, source, cutoff, ANSWER_COMPACTION_BATCH_SIZE
+                )
+            except sqlite3.Error as e:
+                logger.error(f"Answer compaction of {source} failed: {e}")
+                break
+            if not batch_tests:
+                break
+            tests += batch_tests
+            answers += batch_answers
+        if tests:
+            logger.info(f"Compacted {answers} {source} answers of {tests} tests")
@@ -1,70 +1,214 @@
 import os
 import pandas as pd
 
-from config import EXCEL_FILE_QUANTITATIVE
+from config import CACHE_VERSION_CHECK_SECONDS, EXCEL_FILE_QUANTITATIVE
 from utils import database
 
+CATEGORIES_CACHE = "categories"
+
+
+def _as_id(value):
+    """Category ids as int; callback data hands them over as strings."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class CategoryRegistry(database.VersionedCache):
+    """Process-wide, in-memory copy of the category reference tables.
+
+    main_categories, subcategories and main_sub_links are loaded once and
+    answer id -> name and parent/child lookups from dicts. The registry
+    reloads itself when the "categories" entry in cache_versions changes,
+    which importers bump through invalidate_category_cache().
+    """
+
+    cache_name = CATEGORIES_CACHE
+
+    def __init__(self, check_interval: float = CACHE_VERSION_CHECK_SECONDS):
+        super().__init__(check_interval)
+        self.main_names = {}
+        self.sub_names = {}
+        self.main_ids_by_name = {}
+        self.sub_ids_by_name = {}
+        self.subs_by_main = {}
+        self.mains_by_sub = {}
+        self.main_ids_by_type = {}
+
+    def _load(self, version):
+        main_names = dict(database.get_data("SELECT id, name FROM main_categories ORDER BY id"))
+        sub_names = dict(database.get_data("SELECT id, name FROM subcategories ORDER BY id"))
+        subs_by_main = {}
+        mains_by_sub = {}
+        for main_id, sub_id in database.get_data(
+            "SELECT main_category_id, subcategory_id FROM main_sub_links ORDER BY id"
+        ):
+            subs_by_main.setdefault(main_id, []).append(sub_id)
+            mains_by_sub.setdefault(sub_id, []).append(main_id)
+        main_ids_by_type = {}
+        for question_type, main_id in database.get_data(
+            "SELECT DISTINCT question_type, main_category_id FROM active_questions ORDER BY main_category_id"
+        ):
+            if main_id in main_names:
+                main_ids_by_type.setdefault(question_type, []).append(main_id)
+
+        self.main_names = main_names
+        self.sub_names = sub_names
+        self.main_ids_by_name = {name: id for id, name in main_names.items()}
+        self.sub_ids_by_name = {name: id for id, name in sub_names.items()}
+        self.subs_by_main = subs_by_main
+        self.mains_by_sub = mains_by_sub
+        self.main_ids_by_type = main_ids_by_type
+
+    def main_category_name(self, main_category_id):
+        self._ensure_fresh()
+        return self.main_names.get(_as_id(main_category_id))
+
+    def subcategory_name(self, subcategory_id):
+        self._ensure_fresh()
+        return self.sub_names.get(_as_id(subcategory_id))
+
+    def main_category_id(self, name):
+        self._ensure_fresh()
+        return self.main_ids_by_name.get(name)
+
+    def subcategory_id(self, name):
+        self._ensure_fresh()
+        return self.sub_ids_by_name.get(name)
+
+    def main_categories(self):
+        """Returns [(id, name)] of all main categories."""
+        self._ensure_fresh()
+        return list(self.main_names.items())
+
+    def subcategories(self):
+        """Returns [(id, name)] of all subcategories."""
+        self._ensure_fresh()
+        return list(self.sub_names.items())
+
+    def subcategories_of(self, main_category_id):
+        """Returns [(id, name)] of the subcategories linked to a main category."""
+        self._ensure_fresh()
+        return [
+            (sub_id, self.sub_names[sub_id])
+            for sub_id in self.subs_by_main.get(_as_id(main_category_id), [])
+            if sub_id in self.sub_names
+        ]
+
+    def main_categories_of(self, subcategory_id):
+        """Returns [(id, name)] of the main categories linked to a subcategory."""
+        self._ensure_fresh()
+        return [
+            (main_id, self.main_names[main_id])
+            for main_id in self.mains_by_sub.get(_as_id(subcategory_id), [])
+            if main_id in self.main_names
+        ]
+
+    def main_categories_for_type(self, question_type):
+        """Returns [(id, name)] of main categories that have questions of a type."""
+        self._ensure_fresh()
+        return [
+            (main_id, self.main_names[main_id])
+            for main_id in self.main_ids_by_type.get(question_type, [])
+        ]
+
+
+category_registry = CategoryRegistry()
+
+
+def invalidate_category_cache():
+    """Tells every process that categories (or their questions) changed."""
+    database.bump_cache_version(CATEGORIES_CACHE)
+    category_registry.invalidate()
+
+
+def paginate(items, page=1, per_page=10):
+    """Returns the items of a 1-based page."""
+    start = (page - 1) * per_page
+    return items[start:start + per_page]
+
+
+def ensure_category_ids(conn, table, names):
+    """Inserts missing category names and returns {name: id} for the table.
+
+    table is "main_categories" or "subcategories".
+    """
+    conn.executemany(
+        f"INSERT OR IGNORE INTO {table} (name) VALUES (?)",
+        ((name,) for name in set(names)),
+    )
+    return {name: id for id, name in conn.execute(f"SELECT id, name FROM {table}")}
+
+
+def split_subcategories(value):
+    """Splits an Arabic-comma separated subcategory cell into clean names."""
+    if not isinstance(value, str):
+        return []
+    return [name.strip() for name in value.split("،") if name.strip()]
+
+
+def link_categories(conn, main_categories, subcategory_lists, main_id_map, sub_id_map):
+    """Links every main category to the subcategories listed next to it.
+
+    main_categories and subcategory_lists are the category names of each
+    row; main_id_map and sub_id_map resolve them to ids.
+    """
+    conn.executemany(
+        "INSERT OR IGNORE INTO main_sub_links (main_category_id, subcategory_id) VALUES (?, ?)",
+        {
+            (main_id_map[main], sub_id_map[sub])
+            for main, subs in zip(main_categories, subcategory_lists)
+            for sub in subs
+        },
+    )
+
 
 def populate_categories_data():
     """Populates the database with main and subcategories from your Excel file."""
     excel_file_path = EXCEL_FILE_QUANTITATIVE  # Replace with your Excel file
-    df = pd.read_excel(excel_file_path) 
-
-    for _, row in df.iterrows():
-        main_category = row["التصنيف الرئيسي مدقق"]
-
-        # Insert main category if it doesn't exist
-        database.execute_query("INSERT OR IGNORE INTO main_categories (name) VALUES (?)", (main_category,))
-        main_category_id = database.get_data("SELECT id FROM main_categories WHERE name = ?", (main_category,))[0][0] 
+    df = pd.read_excel(
+        excel_file_path, usecols=["التصنيف الرئيسي مدقق", "التصنيفات الفرعية مدققة"]
+    )
 
-        subcategories = row["التصنيفات الفرعية مدققة"].split('،')  
+    main_categories = df["التصنيف الرئيسي مدقق"].astype(str).tolist()
+    subcategory_lists = df["التصنيفات الفرعية مدققة"].map(split_subcategories).tolist()
 
-        for subcategory in subcategories:
-            subcategory = subcategory.strip()
-            # Insert subcategory if it doesn't exist
-            database.execute_query("INSERT OR IGNORE INTO subcategories (name) VALUES (?)", (subcategory,))
-            subcategory_id = database.get_data("SELECT id FROM subcategories WHERE name = ?", (subcategory,))[0][0]
+    with database.transaction() as conn:
+        main_id_map = ensure_category_ids(conn, "main_categories", main_categories)
+        sub_id_map = ensure_category_ids(
+            conn, "subcategories", [sub for subs in subcategory_lists for sub in subs]
+        )
+        link_categories(conn, main_categories, subcategory_lists, main_id_map, sub_id_map)
 
-            # Create the link
-            database.execute_query(
-                "INSERT OR IGNORE INTO main_sub_links (main_category_id, subcategory_id) VALUES (?, ?)", 
-                (main_category_id, subcategory_id)
-            )
+    invalidate_category_cache()
 
 
 async def get_subcategory_name(subcategory_id):
-    """Fetches the name of a subcategory by its ID."""
-    subcategory_name = database.get_data("SELECT name FROM subcategories WHERE id = ?", (subcategory_id,))
-    return subcategory_name[0][0] if subcategory_name else None
+    """Fetches the name of a subcategory by its ID.
+
+    Runs on the database executor, as the lookup may reload the registry.
+    """
+    return await database.db.run(category_registry.subcategory_name, subcategory_id)
 
 async def get_main_category_name(main_category_id):
-    """Fetches the name of a main_category by its ID."""
-    main_category_name = database.get_data("SELECT name FROM main_categories WHERE id = ?", (main_category_id,))
-    return main_category_name[0][0] if main_category_name else None
+    """Fetches the name of a main_category by its ID.
+
+    Runs on the database executor, as the lookup may reload the registry.
+    """
+    return await database.db.run(category_registry.main_category_name, main_category_id)
 
 def get_main_categories(page=1, per_page=10):
     """Fetches a paginated list of main categories with IDs."""
-    categories = database.get_data("SELECT id, name FROM main_categories LIMIT ? OFFSET ?", (per_page, (page - 1) * per_page))
-    return categories
+    return paginate(category_registry.main_categories(), page, per_page)
 
 def get_subcategories(main_category_id, page=1, per_page=10):
     """Fetches a paginated list of subcategories with IDs."""
-    subcategories = database.get_data(
-        '''
-        SELECT s.id, s.name 
-        FROM subcategories s
-        JOIN main_sub_links msl ON s.id = msl.subcategory_id
-        WHERE msl.main_category_id = ?
-        LIMIT ? OFFSET ?
-        ''', 
-        (main_category_id, per_page, (page - 1) * per_page)
-    )
-    return subcategories
+    return paginate(category_registry.subcategories_of(main_category_id), page, per_page)
 
 def get_subcategories_all(page=1, per_page=10):
     """Fetches a paginated list of all subcategories with IDs."""
-    subcategories = database.get_data("SELECT id, name FROM subcategories LIMIT ? OFFSET ?", (per_page, (page - 1) * per_page))
-    return subcategories
+    return paginate(category_registry.subcategories(), page, per_page)
 
 def get_material_path(main_category_name, subcategory_name, material_number, format):
     """Constructs the file path for the requested material.
@@ -86,14 +230,4 @@ def get_material_path(main_category_name, subcategory_name, material_number, for
 
 def get_main_categories_by_subcategory(subcategory_id, page=1, per_page=10):
     """Fetches a paginated list of main categories linked to a specific subcategory."""
-    main_categories = database.get_data(
-        '''
-        SELECT mc.id, mc.name 
-        FROM main_categories mc
-        JOIN main_sub_links msl ON mc.id = msl.main_category_id
-        WHERE msl.subcategory_id = ?
-        LIMIT ? OFFSET ?
-        ''', 
-        (subcategory_id, per_page, (page - 1) * per_page)
-    )
-    return main_categories
\ No newline at end of file
+    return paginate(category_registry.main_categories_of(subcategory_id), page, per_page)
\ No newline at end of file
@@ -1,28 +1,192 @@
+import asyncio
+import functools
+import logging
 import os
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 from telegram import Update
 from telegram.ext import CallbackContext
-from config import DATABASE_FILE
+from config import CACHE_VERSION_CHECK_SECONDS, DATABASE_EXECUTOR_WORKERS, DATABASE_FILE
+from utils.query_stats import track_query
+from utils.storage_backends import ATTACHED_DATABASES, get_backend
+
+logger = logging.getLogger(__name__)
+
+# Opens every connection below; selected by DATABASE_BACKEND.
+backend = get_backend()
+
+# Every database file of the bot, by name.
+DATABASE_FILES = {"database": DATABASE_FILE, **ATTACHED_DATABASES}
+
+# High-churn tables and the attached schema each one lives in. Queries keep
+# using the bare table names; SQLite resolves them in the attached schema.
+HIGH_CHURN_TABLES = {
+    "chat_history": "chat",
+    "chatgpt_usage": "usage",
+    "ai_image_usage": "usage",
+}
+
+
+class ConnectionManager:
+    """Hands out one long-lived connection per thread.
+
+    Each connection keeps its own prepared-statement cache, so the same SQL
+    string is only compiled once per thread instead of once per call. With
+    attach=True the high-churn databases are attached as well. On PostgreSQL
+    the threads of the database executor make this the connection pool.
+    """
+
+    def __init__(self, database_file: str = DATABASE_FILE, attach: bool = False):
+        self.database_file = database_file
+        self.attach = attach
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = set()
+        self.opened = 0
+        self.reused = 0
+        self.closed = 0
+
+    def _open(self) -> sqlite3.Connection:
+        conn = backend.connect(self.database_file, attach=self.attach)
+        with self._lock:
+            self._connections.add(conn)
+            self.opened += 1
+        return conn
+
+    def get_connection(self) -> sqlite3.Connection:
+        """Returns this thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+        else:
+            with self._lock:
+                self.reused += 1
+        return conn
+
+    def close_connection(self):
+        """Closes the connection owned by the calling thread, if any."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        self._local.conn = None
+        self._close(conn)
+
+    def close_all(self):
+        """Closes every connection handed out so far (used at shutdown)."""
+        with self._lock:
+            connections = list(self._connections)
+        for conn in connections:
+            self._close(conn)
+        self._local = threading.local()
+        logger.info(f"Database connections: {self.stats()}")
+
+    def _close(self, conn: sqlite3.Connection):
+        with self._lock:
+            if conn not in self._connections:
+                return
+            self._connections.discard(conn)
+            self.closed += 1
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"Error closing database connection: {e}")
+
+    def stats(self) -> dict:
+        """Returns how many connections were opened, reused and closed."""
+        with self._lock:
+            return {
+                "opened": self.opened,
+                "reused": self.reused,
+                "closed": self.closed,
+                "open": len(self._connections),
+            }
+
+
+connection_manager = ConnectionManager(attach=True)
+
+
+def get_connection_stats() -> dict:
+    """Returns the connection counters of the shared connection manager."""
+    return connection_manager.stats()
 
 
 def create_connection():
-    """Creates a connection to the SQLite database."""
+    """Creates a standalone connection to the database.
+
+    The caller owns the returned connection and must close it. Code that
+    just runs statements should use get_data/execute_query instead, which
+    reuse the calling thread's pooled connection.
+    """
     conn = None
     try:
-        conn = sqlite3.connect(DATABASE_FILE)
-        return conn
+        return backend.connect(DATABASE_FILE, attach=True)
     except sqlite3.Error as e:
         print(e)
     return conn
 
 
+def create_high_churn_tables(conn: sqlite3.Connection):
+    """Creates the high-churn tables in their attached databases.
+
+    Foreign keys cannot point across database files, so these tables
+    reference users only by convention.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS usage.ai_image_usage (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            usage_time DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS usage.chatgpt_usage (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            usage_count INTEGER DEFAULT 0,
+            last_used INTEGER
+        )
+    """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS chat.chat_history (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            messages TEXT
+        )
+    """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS usage.idx_ai_image_usage_user_time ON ai_image_usage(user_id, usage_time)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS usage.idx_chatgpt_usage_user ON chatgpt_usage(user_id)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS chat.idx_chat_history_user ON chat_history(user_id)"
+    )
+
+
 def create_tables(update: Update = None, context: CallbackContext = None):
     """Creates all the necessary tables in the database."""
 
     os.makedirs(os.path.dirname(DATABASE_FILE), exist_ok=True)
 
-    conn = sqlite3.connect(DATABASE_FILE)
+    conn = backend.connect(DATABASE_FILE, attach=True)
+    if backend.name == "sqlite":
+        # Must be set before the first table exists; lets db-maintain give
+        # free pages back to the file system with PRAGMA incremental_vacuum.
+        # The attached files get it in attach_databases().
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
     cursor = conn.cursor()
 
     # Users Table
@@ -38,13 +202,13 @@ def create_tables(update: Update = None, context: CallbackContext = None):
             last_score INTEGER DEFAULT 0,
             referral_code TEXT,
             gender TEXT,
-            subscription_end_time TEXT,
+            subscription_end_time INTEGER,
             type_of_last_subscription TEXT,
             reminder_times_per_week INTEGER DEFAULT 1,
             percentage_expected INTEGER DEFAULT 0,
             usage_time TEXT,
             number_of_daily_gifts_used INTEGER DEFAULT 0,
-            last_daily_reward_claim TEXT,
+            last_daily_reward_claim INTEGER,
             total_number_of_created_questions INTEGER DEFAULT 0,
             points INTEGER DEFAULT 0,
             person_referred_me TEXT,
@@ -72,29 +236,8 @@ def create_tables(update: Update = None, context: CallbackContext = None):
     """
     )
 
-    # ai_image_usage Table
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS ai_image_usage (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            usage_time DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(telegram_id) ON DELETE CASCADE
-        );
-    """
-    )
-    # ChatGPT usage Table
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS chatgpt_usage (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            usage_count INTEGER DEFAULT 0,
-            last_used TEXT,
-            FOREIGN KEY (user_id) REFERENCES users(telegram_id) ON DELETE CASCADE
-        );
-    """
-    )
+    # ai_image_usage, chatgpt_usage and chat_history Tables
+    create_high_churn_tables(conn)
 
     # Categorys Tables
     cursor.execute(
@@ -128,6 +271,18 @@ def create_tables(update: Update = None, context: CallbackContext = None):
     """
     )
 
+    # Passages Table (the texts verbal questions refer to by name)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS passages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            content TEXT NOT NULL,
+            content_hash TEXT NOT NULL
+        )
+    """
+    )
+
     # Questions Table
     cursor.execute(
         """
@@ -143,7 +298,7 @@ def create_tables(update: Update = None, context: CallbackContext = None):
             main_category_id INTEGER,
             question_type TEXT DEFAULT 'quantitative',
             image_path TEXT,
-            passage_name TEXT,
+            passage_name TEXT REFERENCES passages(name),
             FOREIGN KEY (main_category_id) REFERENCES main_categories(id) ON DELETE CASCADE
         )
     """
@@ -155,7 +310,7 @@ def create_tables(update: Update = None, context: CallbackContext = None):
         CREATE TABLE IF NOT EXISTS level_determinations (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER,
-            timestamp TEXT,
+            timestamp INTEGER,
             num_questions INTEGER,
             percentage REAL,
             time_taken REAL,
@@ -189,7 +344,7 @@ def create_tables(update: Update = None, context: CallbackContext = None):
         CREATE TABLE IF NOT EXISTS previous_tests (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER,
-            timestamp TEXT,
+            timestamp INTEGER,
             num_questions INTEGER,
             score INTEGER,
             time_taken REAL,
@@ -217,18 +372,6 @@ def create_tables(update: Update = None, context: CallbackContext = None):
     """
     )
 
-    # Chat History Table
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS chat_history (
-            id INTEGER PRIMARY KEY,
-            user_id INTEGER,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            messages TEXT,
-            FOREIGN KEY (user_id) REFERENCES users(telegram_id) ON DELETE CASCADE
-        )
-    """
-    )
     conn.commit()
     conn.close()
     print("Database Created.")
@@ -236,21 +379,25 @@ def create_tables(update: Update = None, context: CallbackContext = None):
 
 def get_data(query, params=None):
     """Executes a SELECT query and returns the result."""
-    conn = create_connection()
+    conn = connection_manager.get_connection()
     cursor = conn.cursor()
-    if params:
-        cursor.execute(query, params)
-    else:
-        cursor.execute(query)
-    data = cursor.fetchall()
-    conn.close()
-    return data
+    try:
+        with track_query(query, params, conn):
+            if params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+            return cursor.fetchall()
+    finally:
+        cursor.close()
 
 
 def execute_query(query, params=None, commit=True, fetch_all=False, fetch_one=False):
-    """Executes a query. Optionally commits, fetches results, and handles connection closing."""
-    conn = create_connection()
-    if not conn:
+    """Executes a query. Optionally commits and fetches results."""
+    try:
+        conn = connection_manager.get_connection()
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
         return None
 
     cursor = conn.cursor()
@@ -258,30 +405,191 @@ def execute_query(query, params=None, commit=True, fetch_all=False, fetch_one=Fa
     description = None  # Store the description here
 
     try:
-        cursor.execute(query, params or ())
-        if commit:
-            conn.commit()
-        if fetch_all:
-            result = cursor.fetchall() 
-        if fetch_one:
-            result = cursor.fetchone() 
+        with track_query(query, params, conn):
+            cursor.execute(query, params or ())
+            if commit:
+                conn.commit()
+            if fetch_all:
+                result = cursor.fetchall() 
+            if fetch_one:
+                result = cursor.fetchone() 
         description = cursor.description # Fetch description here
     except sqlite3.Error as e:
         print(f"Database error: {e}")
         return None, None # Return None, None on error
     finally:
-        conn.close()
+        cursor.close()
+        # A pooled connection outlives this call, so never leave a
+        # half-finished transaction behind (closing used to discard it).
+        if conn.in_transaction:
+            conn.rollback()
     return result, description  # Return both the result and the description
 
 def execute_query_return_id(query, params=None):
     """Executes a non-SELECT query and returns the last inserted row ID."""
-    conn = create_connection()
+    conn = connection_manager.get_connection()
     cursor = conn.cursor()
-    if params:
-        cursor.execute(query, params)
-    else:
-        cursor.execute(query)
-    lastrowid = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    try:
+        with track_query(query, params, conn):
+            if params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+            lastrowid = cursor.lastrowid
+            conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
     return lastrowid
+
+
+def fetch_one(query, params=None):
+    """Executes a SELECT query and returns its first row (or None)."""
+    conn = connection_manager.get_connection()
+    cursor = conn.cursor()
+    try:
+        with track_query(query, params, conn):
+            cursor.execute(query, params or ())
+            return cursor.fetchone()
+    finally:
+        cursor.close()
+
+
+
+@contextmanager
+def transaction():
+    """Runs the enclosed statements in one transaction on the pooled connection.
+
+    Yields the connection; commits on success and rolls back on any error.
+    """
+    conn = connection_manager.get_connection()
+    if conn.in_transaction:
+        conn.rollback()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def get_cache_version(name):
+    """Returns the version counter of a cached data set (0 if never bumped)."""
+    try:
+        row = fetch_one("SELECT version FROM cache_versions WHERE name = ?", (name,))
+    except sqlite3.OperationalError:
+        # cache_versions does not exist before migration 2.
+        return 0
+    return row[0] if row else 0
+
+
+def bump_cache_version(name):
+    """Marks a cached data set as changed so every process reloads it."""
+    execute_query(
+        """
+        INSERT INTO cache_versions (name, version) VALUES (?, 1)
+        ON CONFLICT(name) DO UPDATE SET version = cache_versions.version + 1
+        """,
+        (name,),
+    )
+
+
+class VersionedCache:
+    """Base of the in-process caches that follow a cache_versions entry.
+
+    _ensure_fresh() reads the version at most every check_interval seconds
+    and calls _load(version) when it changed. _load builds the new data
+    aside and assigns it last, so readers never see a half-loaded cache.
+    Subclasses set cache_name, or override _current_version() to follow
+    several entries.
+    """
+
+    cache_name = None
+
+    def __init__(self, check_interval: float = CACHE_VERSION_CHECK_SECONDS):
+        self.check_interval = check_interval
+        self._reload_lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+
+    def _current_version(self):
+        return get_cache_version(self.cache_name)
+
+    def _load(self, version):
+        raise NotImplementedError
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < self.check_interval:
+            return
+        with self._reload_lock:
+            if self._version is not None and now - self._checked_at < self.check_interval:
+                return
+            version = self._current_version()
+            if version != self._version:
+                self._load(version)
+                self._version = version
+            self._checked_at = now
+
+    def invalidate(self):
+        """Forces a reload on the next lookup."""
+        self._version = None
+
+
+class AsyncDatabase:
+    """Awaitable wrapper around the query helpers for async handlers.
+
+    Queries run on a dedicated thread pool (each worker keeps its own pooled
+    connection), so a slow statement never blocks the event loop.
+    """
+
+    def __init__(self, max_workers: int = DATABASE_EXECUTOR_WORKERS):
+        self.max_workers = max_workers
+        self._executor = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="db"
+            )
+        return self._executor
+
+    async def run(self, func, *args, **kwargs):
+        """Runs any blocking database function on the database executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._get_executor(), functools.partial(func, *args, **kwargs)
+        )
+
+    async def fetch_all(self, query, params=None):
+        """Awaitable version of get_data."""
+        return await self.run(get_data, query, params)
+
+    async def fetch_one(self, query, params=None):
+        """Returns the first row of a SELECT query, or None."""
+        return await self.run(fetch_one, query, params)
+
+    async def fetch_value(self, query, params=None, default=None):
+        """Returns the first column of the first row, or default."""
+        row = await self.fetch_one(query, params)
+        return row[0] if row else default
+
+    async def execute(self, query, params=None):
+        """Awaitable version of execute_query for statements that modify data."""
+        return await self.run(execute_query, query, params)
+
+    async def execute_return_id(self, query, params=None):
+        """Awaitable version of execute_query_return_id."""
+        return await self.run(execute_query_return_id, query, params)
+
+    def shutdown(self):
+        """Waits for queued queries and stops the worker threads."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+db = AsyncDatabase()
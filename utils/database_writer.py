@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (
+    CHAT_DATABASE_FILE,
+    DATABASE_FILE,
+    DATABASE_WRITER_BATCH_SIZE,
+    DATABASE_WRITER_BATCH_WINDOW_MS,
+    DATABASE_WRITER_MAX_RETRIES,
+    DATABASE_WRITER_RETRY_BACKOFF_MS,
+    USAGE_DATABASE_FILE,
+)
+from utils.database import ConnectionManager
+from utils.query_stats import track_query
+
+logger = logging.getLogger(__name__)
+
+
+class _WriteRequest:
+    """A single queued write: either a statement or a callable(conn)."""
+
+    __slots__ = ("query", "params", "func", "future")
+
+    def __init__(self, query=None, params=None, func=None, future=None):
+        self.query = query
+        self.params = params
+        self.func = func
+        self.future = future
+
+    def apply(self, conn: sqlite3.Connection):
+        if self.func is not None:
+            return self.func(conn)
+        with track_query(self.query, self.params, conn):
+            cursor = conn.execute(self.query, self.params or ())
+        return cursor.lastrowid
+
+
+def _is_busy_error(error: sqlite3.Error) -> bool:
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+class DatabaseWriter:
+    """Funnels hot-path writes through one task and one connection.
+
+    Writes are queued, grouped into short ``BEGIN IMMEDIATE`` transactions
+    and committed together, so concurrent handlers no longer race each other
+    for the SQLite write lock. Each caller awaits its own acknowledgement,
+    which resolves only after the transaction holding its write committed.
+
+    There is one writer per database file. Its connection does not attach the
+    other files, so ``BEGIN IMMEDIATE`` only takes that file's write lock.
+    """
+
+    def __init__(
+        self,
+        database_file: str = DATABASE_FILE,
+        batch_size: int = DATABASE_WRITER_BATCH_SIZE,
+        batch_window_ms: float = DATABASE_WRITER_BATCH_WINDOW_MS,
+        max_retries: int = DATABASE_WRITER_MAX_RETRIES,
+        retry_backoff_ms: float = DATABASE_WRITER_RETRY_BACKOFF_MS,
+    ):
+        self.batch_size = batch_size
+        self.batch_window = batch_window_ms / 1000
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff_ms / 1000
+        self.name = os.path.basename(database_file)
+        self.connections = ConnectionManager(database_file)
+        self._queue = None
+        self._task = None
+        self._executor = None
+        self.batches = 0
+        self.writes = 0
+        self.retries = 0
+
+    def _ensure_started(self):
+        if self._executor is None:
+            # A single thread owns the writer connection.
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="db-writer"
+            )
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def _enqueue(self, request: _WriteRequest) -> asyncio.Future:
+        self._ensure_started()
+        request.future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(request)
+        return request.future
+
+    async def write(self, query, params=None):
+        """Queues a statement and waits until it is committed.
+
+        Returns the row id of the last inserted row (like
+        execute_query_return_id).
+        """
+        return await self._enqueue(_WriteRequest(query=query, params=params))
+
+    async def run(self, func, *args, **kwargs):
+        """Queues func(conn, *args, **kwargs) inside the writer transaction.
+
+        Useful for read-modify-write updates that must not interleave with
+        other writes. The callable must not commit or roll back itself.
+        """
+        return await self._enqueue(
+            _WriteRequest(func=lambda conn: func(conn, *args, **kwargs))
+        )
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            request = await self._queue.get()
+            if request is None:
+                break
+            batch = [request]
+            stop = False
+
+            # Give concurrent handlers a moment to join this transaction.
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                try:
+                    if timeout > 0:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    else:
+                        item = self._queue.get_nowait()
+                except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, self._commit_batch, batch
+                )
+            except Exception as e:
+                results = [(None, e)] * len(batch)
+
+            for item, (result, error) in zip(batch, results):
+                if item.future.done():
+                    continue
+                if error is not None:
+                    item.future.set_exception(error)
+                else:
+                    item.future.set_result(result)
+
+            if stop:
+                break
+
+    def _commit_batch(self, batch):
+        """Commits the batch in one transaction (runs on the writer thread)."""
+        conn = self.connections.get_connection()
+        attempt = 0
+        while True:
+            try:
+                results = self._apply_in_transaction(conn, batch)
+            except sqlite3.OperationalError as e:
+                if _is_busy_error(e) and attempt < self.max_retries:
+                    attempt += 1
+                    self.retries += 1
+                    delay = self.retry_backoff * (2 ** (attempt - 1))
+                    logger.warning(
+                        f"Database busy, retrying batch of {len(batch)} in {delay:.3f}s ({e})"
+                    )
+                    time.sleep(delay)
+                    continue
+                error = e
+            except Exception as e:
+                error = e
+            else:
+                self.batches += 1
+                self.writes += len(batch)
+                return [(result, None) for result in results]
+            break
+
+        if len(batch) == 1 or _is_busy_error(error):
+            logger.error(f"Database write failed: {error}")
+            return [(None, error)] * len(batch)
+        # One bad statement must not fail the writes it was grouped with.
+        return [self._commit_batch([item])[0] for item in batch]
+
+    @staticmethod
+    def _apply_in_transaction(conn: sqlite3.Connection, batch):
+        if conn.in_transaction:
+            conn.rollback()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            results = [item.apply(conn) for item in batch]
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        return results
+
+    async def close(self):
+        """Flushes every queued write and stops the writer task."""
+        if self._task is not None and not self._task.done():
+            self._queue.put_nowait(None)
+            await self._task
+        self._task = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.connections.close_all()
+        logger.info(
+            f"Database writer ({self.name}): {self.writes} writes in {self.batches} batches, "
+            f"{self.retries} busy retries"
+        )
+
+
+database_writer = DatabaseWriter(DATABASE_FILE)
+# chat_history
+chat_writer = DatabaseWriter(CHAT_DATABASE_FILE)
+# chatgpt_usage and ai_image_usage
+usage_writer = DatabaseWriter(USAGE_DATABASE_FILE)
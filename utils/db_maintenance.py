@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+
+from config import (
+    DATABASE_BUSY_TIMEOUT_SECONDS,
+    MAINTENANCE_ANALYSIS_LIMIT,
+    MAINTENANCE_TIME_BUDGET_SECONDS,
+    MAINTENANCE_VACUUM_PAGES_PER_STEP,
+)
+from utils.database import DATABASE_FILES
+
+logger = logging.getLogger(__name__)
+
+# Steps in the order they run. Cheap, high-value steps come first so a tight
+# time budget still gets planner statistics refreshed.
+MAINTENANCE_STEPS = ["optimize", "incremental_vacuum", "wal_checkpoint", "integrity_check"]
+
+
+def _file_size(database_file: str) -> int:
+    return sum(
+        os.path.getsize(path)
+        for path in (database_file, f"{database_file}-wal")
+        if os.path.exists(path)
+    )
+
+
+def _optimize(conn: sqlite3.Connection, deadline: float, options: dict) -> str:
+    conn.execute(f"PRAGMA analysis_limit = {MAINTENANCE_ANALYSIS_LIMIT}")
+    has_stats = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+    ).fetchone()
+    if options.get("analyze") or not has_stats:
+        # PRAGMA optimize skips tables it thinks are unchanged, so the first
+        # run (or --analyze) gathers statistics for every index.
+        conn.execute("ANALYZE")
+        return "ANALYZE"
+    conn.execute("PRAGMA optimize")
+    return "PRAGMA optimize"
+
+
+def _incremental_vacuum(conn: sqlite3.Connection, deadline: float, options: dict) -> str:
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return "skipped: auto_vacuum is not INCREMENTAL (run db-maintain --enable-incremental-vacuum)"
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    pages = options.get("vacuum_pages", MAINTENANCE_VACUUM_PAGES_PER_STEP)
+    free = free_before
+    # Small steps keep each write lock short; stop when the budget runs out.
+    while free and time.monotonic() < deadline:
+        conn.execute(f"PRAGMA incremental_vacuum({pages})")
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    released = free_before - free
+    return f"released {released} pages ({released * page_size / 1024:.0f} KiB), {free} free pages left"
+
+
+def _wal_checkpoint(conn: sqlite3.Connection, deadline: float, options: dict) -> str:
+    if conn.execute("PRAGMA journal_mode").fetchone()[0].lower() != "wal":
+        return "skipped: not in WAL mode"
+    mode = options.get("checkpoint_mode", "PASSIVE")
+    busy, log_frames, checkpointed = conn.execute(
+        f"PRAGMA wal_checkpoint({mode})"
+    ).fetchone()
+    return f"{mode}: {checkpointed}/{log_frames} frames checkpointed{' (busy)' if busy else ''}"
+
+
+def _integrity_check(conn: sqlite3.Connection, deadline: float, options: dict) -> str:
+    pragma = "integrity_check" if options.get("full_check") else "quick_check"
+    problems = [row[0] for row in conn.execute(f"PRAGMA {pragma}")]
+    if problems == ["ok"]:
+        return f"{pragma}: ok"
+    logger.error(f"{pragma} found problems: {problems[:10]}")
+    return f"{pragma}: {len(problems)} problems, first: {problems[0]}"
+
+
+_STEP_FUNCTIONS = {
+    "optimize": _optimize,
+    "incremental_vacuum": _incremental_vacuum,
+    "wal_checkpoint": _wal_checkpoint,
+    "integrity_check": _integrity_check,
+}
+
+
+def run_maintenance(
+    time_budget: float = MAINTENANCE_TIME_BUDGET_SECONDS,
+    steps: list = None,
+    **options,
+) -> list:
+    """Runs the maintenance steps on every database file within time_budget.
+
+    Options: analyze (always run a full ANALYZE), vacuum_pages,
+    checkpoint_mode (PASSIVE, FULL, RESTART or TRUNCATE) and full_check
+    (integrity_check instead of quick_check).
+
+    Returns [{"database", "step", "ms", "result"}], including the steps that
+    were skipped because the budget ran out.
+    """
+    steps = steps or MAINTENANCE_STEPS
+    deadline = time.monotonic() + time_budget
+    report = []
+    for name, database_file in DATABASE_FILES.items():
+        if not os.path.exists(database_file):
+            continue
+        size_before = _file_size(database_file)
+        conn = sqlite3.connect(
+            database_file, timeout=DATABASE_BUSY_TIMEOUT_SECONDS, isolation_level=None
+        )
+        try:
+            for step in steps:
+                if time.monotonic() >= deadline:
+                    result, elapsed_ms = "skipped: time budget exhausted", 0.0
+                else:
+                    started = time.perf_counter()
+                    try:
+                        result = _STEP_FUNCTIONS[step](conn, deadline, options)
+                    except sqlite3.Error as e:
+                        result = f"failed: {e}"
+                    elapsed_ms = (time.perf_counter() - started) * 1000
+                report.append(
+                    {"database": name, "step": step, "ms": elapsed_ms, "result": result}
+                )
+                logger.info(f"Maintenance {name} {step} ({elapsed_ms:.1f} ms): {result}")
+        finally:
+            conn.close()
+        reclaimed = size_before - _file_size(database_file)
+        report.append(
+            {
+                "database": name,
+                "step": "size",
+                "ms": 0.0,
+                "result": f"{size_before / 1024:.0f} KiB -> {_file_size(database_file) / 1024:.0f} KiB "
+                f"({reclaimed / 1024:.0f} KiB reclaimed)",
+            }
+        )
+        logger.info(f"Maintenance {name}: {report[-1]['result']}")
+    return report
+
+
+def enable_incremental_vacuum() -> list:
+    """Switches every database file to auto_vacuum=INCREMENTAL.
+
+    Existing files need a full VACUUM for that, which rewrites the file and
+    blocks the bot while it runs, so this is only offered from manage.py.
+    Returns the names of the files that were converted.
+    """
+    converted = []
+    for name, database_file in DATABASE_FILES.items():
+        if not os.path.exists(database_file):
+            continue
+        conn = sqlite3.connect(
+            database_file, timeout=DATABASE_BUSY_TIMEOUT_SECONDS, isolation_level=None
+        )
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                continue
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            converted.append(name)
+        finally:
+            conn.close()
+    return converted
+
+
+def format_maintenance_report(report: list) -> str:
+    """Formats the result of run_maintenance as plain text."""
+    return "\n".join(
+        f"{entry['database']:<10} {entry['step']:<20} {entry['ms']:>9.1f} ms  {entry['result']}"
+        for entry in report
+    )
+
+
+async def maintenance_job(context):
+    """Periodic job: runs the maintenance steps off the event loop."""
+    started = time.perf_counter()
+    await asyncio.to_thread(run_maintenance)
+    logger.info(f"Database maintenance finished in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,536 @@
+import logging
+import os
+import re
+import sqlite3
+
+from config import CONTEXT_DIRECTORY, DATABASE_BUSY_TIMEOUT_SECONDS, DATABASE_FILE
+from utils.database import (
+    HIGH_CHURN_TABLES,
+    backend,
+    create_high_churn_tables,
+    create_tables,
+)
+from utils.passage_store import NO_PASSAGE, import_passages, read_passage_files
+from utils.question_search import SEARCH_TABLES_SQL, rebuild_search_index
+from utils.question_similarity import SIMILAR_QUESTIONS_SQL
+from utils.question_sync import QUESTION_SOURCES_SQL, backfill_question_sources
+from utils.storage_backends import attach_databases
+from utils.timestamps import to_epoch
+
+logger = logging.getLogger(__name__)
+
+
+# ----------------
+# Migrations
+#
+# Each migration is (version, description, function(conn)). They run in
+# order inside one transaction each, and PRAGMA user_version records the last
+# one applied. Keep them idempotent (IF NOT EXISTS ...) so they are also safe
+# on databases that create_tables() has just created.
+
+
+def _add_secondary_indexes(conn: sqlite3.Connection):
+    statements = [
+        "CREATE INDEX IF NOT EXISTS idx_questions_type_main ON questions(question_type, main_category_id)",
+        "CREATE INDEX IF NOT EXISTS idx_user_answers_user ON user_answers(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_user_answers_test ON user_answers(previous_tests_id)",
+        "CREATE INDEX IF NOT EXISTS idx_previous_tests_user_time ON previous_tests(user_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_level_determinations_user_time ON level_determinations(user_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_level_answers_determination ON level_determination_answers(level_determination_id)",
+        "CREATE INDEX IF NOT EXISTS idx_users_referral_code ON users(referral_code)",
+        # The high-churn tables get their indexes in create_high_churn_tables().
+        "CREATE INDEX IF NOT EXISTS idx_main_sub_links_sub ON main_sub_links(subcategory_id)",
+    ]
+    for statement in statements:
+        conn.execute(statement)
+    # Give the query planner statistics for the new indexes.
+    conn.execute("ANALYZE")
+
+
+def _add_cache_versions(conn: sqlite3.Connection):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cache_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+
+
+def _rebuild_table(conn: sqlite3.Connection, table: str, rewrite, select=None):
+    """Rebuilds table from its CREATE statement as changed by rewrite(sql).
+
+    SQLite cannot change a column definition in place, so the table is copied
+    into a new one with the same column order, then renamed back and its
+    indexes recreated. select maps a column name to the expression it is
+    copied with (default: the column itself).
+    """
+    names = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    create_sql = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()[0]
+    index_sqls = [
+        row[0]
+        for row in conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+            (table,),
+        )
+    ]
+
+    new_sql = re.sub(
+        rf"CREATE TABLE\s+(IF NOT EXISTS\s+)?\"?{table}\"?",
+        f"CREATE TABLE {table}__new",
+        rewrite(create_sql),
+        count=1,
+    )
+    select = select or {}
+    expressions = ", ".join(select.get(name, name) for name in names)
+    conn.execute(new_sql)
+    conn.execute(
+        f"INSERT INTO {table}__new ({', '.join(names)}) SELECT {expressions} FROM {table}"
+    )
+    conn.execute(f"DROP TABLE {table}")
+    # Views may name the table; the legacy rename does not re-check them
+    # while the table is missing.
+    conn.execute("PRAGMA legacy_alter_table = ON")
+    try:
+        conn.execute(f"ALTER TABLE {table}__new RENAME TO {table}")
+    finally:
+        conn.execute("PRAGMA legacy_alter_table = OFF")
+    for sql in index_sqls:
+        conn.execute(sql)
+
+
+def _retype_columns_as_epoch(conn: sqlite3.Connection, table: str, columns):
+    """Rebuilds table with columns declared INTEGER and converted to epochs."""
+    info = conn.execute(f"PRAGMA table_info({table})").fetchall()
+    types = {row[1]: (row[2] or "").upper() for row in info}
+    if all(types.get(column) == "INTEGER" for column in columns):
+        return
+
+    def retype(sql):
+        for column in columns:
+            sql = re.sub(rf"(\b{column}\s+)\w+", r"\1INTEGER", sql, count=1)
+        return sql
+
+    _rebuild_table(
+        conn, table, retype, {column: f"to_epoch({column})" for column in columns}
+    )
+
+
+def _convert_timestamps_to_epoch(conn: sqlite3.Connection):
+    _retype_columns_as_epoch(conn, "previous_tests", ["timestamp"])
+    _retype_columns_as_epoch(conn, "level_determinations", ["timestamp"])
+    _retype_columns_as_epoch(
+        conn, "users", ["subscription_end_time", "last_daily_reward_claim"]
+    )
+    _retype_columns_as_epoch(conn, "chatgpt_usage", ["last_used"])
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_previous_tests_user_time ON previous_tests(user_id, timestamp)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_level_determinations_user_time ON level_determinations(user_id, timestamp)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_subscription_end ON users(subscription_end_time)"
+    )
+    conn.execute("ANALYZE")
+
+
+def _add_answer_rollups(conn: sqlite3.Connection):
+    # Per-user, per-main-category totals of compacted answers. graded counts
+    # non-NULL is_correct values so SUM(correct) / SUM(graded) equals the
+    # AVG(is_correct) of the raw rows.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_category_stats (
+            user_id INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            main_category_id INTEGER NOT NULL,
+            answered INTEGER NOT NULL DEFAULT 0,
+            correct INTEGER NOT NULL DEFAULT 0,
+            graded INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, source, main_category_id)
+        )
+        """
+    )
+    # Cold copies of the compacted raw rows (same columns as the hot tables).
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_answers_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            previous_tests_id INTEGER,
+            question_id INTEGER,
+            user_answer TEXT,
+            is_correct INTEGER
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS level_determination_answers_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            question_id INTEGER,
+            user_answer TEXT,
+            is_correct INTEGER,
+            level_determination_id INTEGER
+        )
+        """
+    )
+    # user_category_totals looks level answers up by user.
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_level_answers_user ON level_determination_answers(user_id)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_user_answers_archive_test ON user_answers_archive(previous_tests_id)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_level_answers_archive_determination ON level_determination_answers_archive(level_determination_id)"
+    )
+    # Every answer of a test or level determination, hot or archived.
+    conn.execute(
+        """
+        CREATE VIEW IF NOT EXISTS all_user_answers AS
+        SELECT id, user_id, previous_tests_id, question_id, user_answer, is_correct FROM user_answers
+        UNION ALL
+        SELECT id, user_id, previous_tests_id, question_id, user_answer, is_correct FROM user_answers_archive
+        """
+    )
+    conn.execute(
+        """
+        CREATE VIEW IF NOT EXISTS all_level_determination_answers AS
+        SELECT id, user_id, question_id, user_answer, is_correct, level_determination_id FROM level_determination_answers
+        UNION ALL
+        SELECT id, user_id, question_id, user_answer, is_correct, level_determination_id FROM level_determination_answers_archive
+        """
+    )
+    # Per-category totals of a user: the live answers plus the rollup.
+    conn.execute(
+        """
+        CREATE VIEW IF NOT EXISTS user_category_totals AS
+        SELECT ua.user_id AS user_id, 'tests' AS source, q.main_category_id AS main_category_id,
+               COUNT(ua.id) AS answered, SUM(ua.is_correct) AS correct, COUNT(ua.is_correct) AS graded
+        FROM user_answers ua
+        JOIN questions q ON ua.question_id = q.id
+        GROUP BY ua.user_id, q.main_category_id
+        UNION ALL
+        SELECT lda.user_id, 'level_determination', q.main_category_id,
+               COUNT(lda.id), SUM(lda.is_correct), COUNT(lda.is_correct)
+        FROM level_determination_answers lda
+        JOIN questions q ON lda.question_id = q.id
+        GROUP BY lda.user_id, q.main_category_id
+        UNION ALL
+        SELECT user_id, source, main_category_id, answered, correct, graded
+        FROM user_category_stats
+        """
+    )
+
+
+def _move_high_churn_tables(conn: sqlite3.Connection):
+    """Moves chat_history and the usage tables into their attached files."""
+    create_high_churn_tables(conn)
+    for table, schema in HIGH_CHURN_TABLES.items():
+        columns = [row[1] for row in conn.execute(f"PRAGMA main.table_info({table})")]
+        if not columns:
+            continue
+        column_list = ", ".join(columns)
+        # OR REPLACE keeps a re-run safe if only the attached file committed.
+        conn.execute(
+            f"INSERT OR REPLACE INTO {schema}.{table} ({column_list}) "
+            f"SELECT {column_list} FROM main.{table}"
+        )
+        conn.execute(f"DROP TABLE main.{table}")
+
+
+def _index_archived_answers_by_user(conn: sqlite3.Connection):
+    # The no-repeat sampler loads a user's answered questions through the
+    # all_* views, which look both the hot and the archive tables up by user.
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_user_answers_archive_user ON user_answers_archive(user_id)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_level_answers_archive_user ON level_determination_answers_archive(user_id)"
+    )
+
+
+def _add_passages(conn: sqlite3.Connection):
+    """Moves the passage texts from CONTEXT_DIRECTORY into a passages table."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS passages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            content TEXT NOT NULL,
+            content_hash TEXT NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_passages_hash ON passages(content_hash)")
+    names = [
+        row[0]
+        for row in conn.execute(
+            "SELECT DISTINCT passage_name FROM questions WHERE passage_name IS NOT NULL"
+        )
+        if row[0] not in NO_PASSAGE
+    ]
+    imported = import_passages(conn, read_passage_files(CONTEXT_DIRECTORY, names))
+    logger.info(f"Imported {imported} of {len(names)} passages from {CONTEXT_DIRECTORY}")
+    conn.execute(
+        """
+        INSERT INTO cache_versions (name, version) VALUES ('passages', 1)
+        ON CONFLICT(name) DO UPDATE SET version = cache_versions.version + 1
+        """
+    )
+
+    if backend.name != "sqlite":
+        return
+    # Declare questions.passage_name as a reference to passages(name).
+    create_sql = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'questions'"
+    ).fetchone()[0]
+    if "REFERENCES passages" not in create_sql:
+        _rebuild_table(
+            conn,
+            "questions",
+            lambda sql: re.sub(
+                r"(\bpassage_name\s+TEXT)", r"\1 REFERENCES passages(name)", sql, count=1
+            ),
+        )
+
+
+def _add_search_index(conn: sqlite3.Connection):
+    """Full-text index of the questions and passages (SQLite FTS5)."""
+    for create_sql in SEARCH_TABLES_SQL:
+        conn.execute(create_sql)
+    # Search results for a passage are the questions that belong to it.
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_questions_passage ON questions(passage_name)"
+    )
+    # Filled by migration 9, which adds the active_questions view it reads.
+
+
+def _add_question_sources(conn: sqlite3.Connection):
+    """Tracks the workbook row of each question for incremental re-imports."""
+    for create_sql in QUESTION_SOURCES_SQL:
+        conn.execute(create_sql)
+    backfill_question_sources(conn)
+    rebuild_search_index(conn)
+
+
+def _add_similar_questions(conn: sqlite3.Connection):
+    """Table of precomputed similar questions; filled by `manage.py build-similar`."""
+    for create_sql in SIMILAR_QUESTIONS_SQL:
+        conn.execute(create_sql)
+
+
+MIGRATIONS = [
+    (1, "Add secondary indexes", _add_secondary_indexes),
+    (2, "Add cache_versions table", _add_cache_versions),
+    (3, "Store timestamps as integer epochs", _convert_timestamps_to_epoch),
+    (4, "Add answer rollup and archive tables", _add_answer_rollups),
+    (5, "Move high-churn tables to their own database files", _move_high_churn_tables),
+    (6, "Index archived answers by user", _index_archived_answers_by_user),
+    (7, "Store passages in the database", _add_passages),
+    (8, "Add full-text search index", _add_search_index),
+    (9, "Track question sources for incremental imports", _add_question_sources),
+    (10, "Add similar questions table", _add_similar_questions),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# Migrations that only reshape SQLite files. PostgreSQL databases are created
+# by create_tables() with epoch columns and the chat/usage schemas already,
+# and search falls back to LIKE there as there is no FTS5.
+SQLITE_ONLY_MIGRATIONS = {3, 5, 8}
+
+
+# ----------------
+# Query plan report
+
+# Representative statements taken from the handlers.
+REPORT_QUERIES = [
+    (
+        "Questions by type and main category",
+        "SELECT id FROM questions WHERE question_type = ? AND main_category_id = ?",
+    ),
+    (
+        "Previous tests of a user",
+        "SELECT id, timestamp, num_questions, score FROM previous_tests WHERE user_id = ? ORDER BY timestamp DESC LIMIT 5",
+    ),
+    (
+        "Level determinations of a user",
+        "SELECT timestamp, percentage FROM level_determinations WHERE user_id = ? ORDER BY timestamp",
+    ),
+    (
+        "Main category performance",
+        "SELECT mc.name, SUM(t.correct) * 1.0 / SUM(t.graded) FROM user_category_totals t "
+        "JOIN main_categories mc ON t.main_category_id = mc.id "
+        "WHERE t.user_id = ? AND t.source = 'tests' GROUP BY mc.id",
+    ),
+    (
+        "Answers of a test",
+        "SELECT question_id, user_answer, is_correct FROM user_answers WHERE previous_tests_id = ?",
+    ),
+    (
+        "Answers of a level determination",
+        "SELECT question_id, is_correct FROM level_determination_answers WHERE level_determination_id = ?",
+    ),
+    (
+        "Questions a user has answered",
+        "SELECT question_id FROM all_user_answers WHERE user_id = ?",
+    ),
+    ("Referral code lookup", "SELECT 1 FROM users WHERE referral_code = ?"),
+    (
+        "ChatGPT usage of a user",
+        "SELECT usage_count, last_used FROM chatgpt_usage WHERE user_id = ?",
+    ),
+    (
+        "AI image usage since a time",
+        "SELECT COUNT(*) FROM ai_image_usage WHERE user_id = ? AND usage_time >= ?",
+    ),
+    ("Chat history of a user", "SELECT messages FROM chat_history WHERE user_id = ?"),
+    (
+        "Main categories of a subcategory",
+        "SELECT main_category_id FROM main_sub_links WHERE subcategory_id = ?",
+    ),
+]
+
+
+def explain_query_plan(conn: sqlite3.Connection, query: str) -> str:
+    """Returns the EXPLAIN QUERY PLAN output of a query as one line."""
+    params = (None,) * query.count("?")
+    try:
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+    except sqlite3.Error as e:
+        return f"error: {e}"
+    return "; ".join(row[-1] for row in rows)
+
+
+def capture_query_plans(conn: sqlite3.Connection) -> dict:
+    """Returns {description: plan} for every query in REPORT_QUERIES."""
+    return {
+        description: explain_query_plan(conn, query)
+        for description, query in REPORT_QUERIES
+    }
+
+
+def format_plan_report(before: dict, after: dict) -> str:
+    """Formats a before/after comparison of captured query plans."""
+    lines = []
+    for description, _ in REPORT_QUERIES:
+        lines.append(f"[{description}]")
+        lines.append(f"  before: {before.get(description, '-')}")
+        lines.append(f"  after:  {after.get(description, '-')}")
+    return "\n".join(lines)
+
+
+# ----------------
+# Runner
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Returns the schema version stored in PRAGMA user_version."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _has_base_schema(conn: sqlite3.Connection) -> bool:
+    return (
+        conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'"
+        ).fetchone()
+        is not None
+    )
+
+
+def migrate(target_version: int = None):
+    """Creates the database if needed and applies pending migrations.
+
+    Returns (from_version, to_version, plans_before, plans_after).
+    """
+    target_version = LATEST_VERSION if target_version is None else target_version
+    if backend.name == "postgresql":
+        return _migrate_postgres(target_version)
+
+    os.makedirs(os.path.dirname(DATABASE_FILE), exist_ok=True)
+    conn = sqlite3.connect(
+        DATABASE_FILE, timeout=DATABASE_BUSY_TIMEOUT_SECONDS, isolation_level=None
+    )
+    # Used by migrations that convert legacy timestamp strings.
+    conn.create_function("to_epoch", 1, to_epoch, deterministic=True)
+    attach_databases(conn)
+    try:
+        if not _has_base_schema(conn):
+            create_tables()
+
+        from_version = get_schema_version(conn)
+        plans_before = capture_query_plans(conn)
+
+        for version, description, apply in MIGRATIONS:
+            if version <= from_version or version > target_version:
+                continue
+            logger.info(f"Applying migration {version}: {description}")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                apply(conn)
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                logger.error(f"Migration {version} failed, rolled back")
+                raise
+
+        to_version = get_schema_version(conn)
+        plans_after = capture_query_plans(conn)
+    finally:
+        conn.close()
+
+    if to_version != from_version:
+        logger.info(f"Database schema migrated from v{from_version} to v{to_version}")
+    return from_version, to_version, plans_before, plans_after
+
+
+def _migrate_postgres(target_version: int):
+    """migrate() for the PostgreSQL backend.
+
+    There is no PRAGMA user_version, so the version lives in a one-row
+    schema_version table. Each migration still runs in its own transaction.
+    """
+    conn = backend.connect(DATABASE_FILE, attach=True)
+    try:
+        conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+        row = conn.execute("SELECT version FROM schema_version").fetchone()
+        if row is None:
+            if conn.execute("SELECT to_regclass('users')").fetchone()[0] is None:
+                create_tables()
+            conn.execute("INSERT INTO schema_version (version) VALUES (0)")
+            conn.commit()
+            row = (0,)
+        from_version = row[0]
+        plans_before = capture_query_plans(conn)
+
+        for version, description, apply in MIGRATIONS:
+            if version <= from_version or version > target_version:
+                continue
+            logger.info(f"Applying migration {version}: {description}")
+            conn.execute("BEGIN")
+            try:
+                if version not in SQLITE_ONLY_MIGRATIONS:
+                    apply(conn)
+                conn.execute("UPDATE schema_version SET version = ?", (version,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                logger.error(f"Migration {version} failed, rolled back")
+                raise
+
+        to_version = conn.execute("SELECT version FROM schema_version").fetchone()[0]
+        plans_after = capture_query_plans(conn)
+    finally:
+        conn.close()
+
+    if to_version != from_version:
+        logger.info(f"Database schema migrated from v{from_version} to v{to_version}")
+    return from_version, to_version, plans_before, plans_after
@@ -0,0 +1,117 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from config import CACHE_VERSION_CHECK_SECONDS, PASSAGE_CACHE_SIZE
+from utils import database
+
+PASSAGES_CACHE = "passages"
+
+# passage_name values of questions that do not belong to a passage.
+NO_PASSAGE = {None, "", "-", "nan", "N/A"}
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def import_passages(conn, passages) -> int:
+    """Upserts (name, content) pairs into the passages table.
+
+    Rows whose content hash is unchanged are left alone. Must run inside a
+    transaction; returns how many passages were added or changed.
+    """
+    changed = 0
+    for name, content in passages:
+        cursor = conn.execute(
+            """
+            INSERT INTO passages (name, content, content_hash) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET
+                content = excluded.content,
+                content_hash = excluded.content_hash
+            WHERE passages.content_hash != excluded.content_hash
+            """,
+            (name, content, content_hash(content)),
+        )
+        changed += cursor.rowcount
+    return changed
+
+
+def read_passage_files(directory: str, names=None):
+    """Yields (name, content) for the <name>.txt files of a directory."""
+    if not os.path.isdir(directory):
+        return
+    if names is None:
+        names = [
+            file_name[:-4] for file_name in os.listdir(directory) if file_name.endswith(".txt")
+        ]
+    for name in names:
+        file_path = os.path.join(directory, f"{name}.txt")
+        if os.path.exists(file_path):
+            with open(file_path, "r", encoding="utf-8") as file:
+                yield name, file.read().strip()
+
+
+class PassageStore(database.VersionedCache):
+    """Bounded LRU cache of passage texts, keyed by passage name.
+
+    A miss costs one primary-key lookup; unknown names are cached as "" so
+    they are not looked up again. The cache is dropped when the "passages"
+    entry in cache_versions changes, which the importers bump through
+    invalidate_passage_cache().
+    """
+
+    cache_name = PASSAGES_CACHE
+
+    def __init__(
+        self,
+        max_size: int = PASSAGE_CACHE_SIZE,
+        check_interval: float = CACHE_VERSION_CHECK_SECONDS,
+    ):
+        super().__init__(check_interval)
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._passages = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self, version):
+        with self._lock:
+            self._passages.clear()
+
+    def get(self, name) -> str:
+        """Returns the text of a passage ("" if there is none)."""
+        if name in NO_PASSAGE:
+            return ""
+        self._ensure_fresh()
+        with self._lock:
+            content = self._passages.get(name)
+            if content is not None:
+                self._passages.move_to_end(name)
+                self.hits += 1
+                return content
+        row = database.fetch_one("SELECT content FROM passages WHERE name = ?", (name,))
+        content = row[0] if row else ""
+        with self._lock:
+            self.misses += 1
+            self._passages[name] = content
+            self._passages.move_to_end(name)
+            while len(self._passages) > self.max_size:
+                self._passages.popitem(last=False)
+        return content
+
+    def invalidate(self):
+        """Drops every cached passage."""
+        with self._lock:
+            self._passages.clear()
+        super().invalidate()
+
+
+passage_store = PassageStore()
+
+
+def invalidate_passage_cache():
+    """Tells every process that passages changed."""
+    database.bump_cache_version(PASSAGES_CACHE)
+    passage_store.invalidate()
@@ -0,0 +1,198 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from config import QUERY_STATS_FILE, SLOW_QUERY_THRESHOLD_MS
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (ms) of the latency histogram buckets; the last one is open.
+HISTOGRAM_BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500]
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+# Statements that have no useful query plan.
+_NO_PLAN_PREFIXES = ("BEGIN", "COMMIT", "ROLLBACK", "PRAGMA", "CREATE", "DROP",
+                     "ALTER", "ANALYZE", "VACUUM", "ATTACH", "DETACH", "EXPLAIN")
+
+
+def normalize_sql(query: str) -> str:
+    """Collapses whitespace and literals so equivalent statements share a key."""
+    query = _STRING_LITERAL.sub("?", query)
+    query = _NUMBER_LITERAL.sub("?", query)
+    query = _WHITESPACE.sub(" ", query).strip().rstrip(";")
+    return _IN_LIST.sub("(?, ...)", query)
+
+
+def _bucket_index(elapsed_ms: float) -> int:
+    for index, bound in enumerate(HISTOGRAM_BUCKETS_MS):
+        if elapsed_ms <= bound:
+            return index
+    return len(HISTOGRAM_BUCKETS_MS)
+
+
+def estimate_percentile(histogram: list, percentile: float) -> float:
+    """Returns the bucket upper bound that contains the given percentile."""
+    total = sum(histogram)
+    if not total:
+        return 0.0
+    threshold = total * percentile / 100
+    cumulative = 0
+    for index, count in enumerate(histogram):
+        cumulative += count
+        if cumulative >= threshold:
+            if index < len(HISTOGRAM_BUCKETS_MS):
+                return float(HISTOGRAM_BUCKETS_MS[index])
+            return float("inf")
+    return float("inf")
+
+
+class QueryStats:
+    """Per-statement latency histograms keyed by normalized SQL.
+
+    Statements slower than the threshold are logged, and the first time a
+    statement is slow its EXPLAIN QUERY PLAN is captured so full table scans
+    are visible in `manage.py db-stats`.
+    """
+
+    def __init__(self, slow_threshold_ms: float = SLOW_QUERY_THRESHOLD_MS):
+        self.slow_threshold_ms = slow_threshold_ms
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+
+    def record(self, query, params, elapsed_ms, conn=None):
+        key = normalize_sql(query)
+        with self._lock:
+            entry = self._stats.get(key)
+            if entry is None:
+                entry = self._stats[key] = {
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "slow_count": 0,
+                    "histogram": [0] * (len(HISTOGRAM_BUCKETS_MS) + 1),
+                    "plan": None,
+                }
+            entry["count"] += 1
+            entry["total_ms"] += elapsed_ms
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+            entry["histogram"][_bucket_index(elapsed_ms)] += 1
+            is_slow = elapsed_ms >= self.slow_threshold_ms
+            if is_slow:
+                entry["slow_count"] += 1
+            needs_plan = is_slow and entry["plan"] is None
+
+        if not is_slow:
+            return
+        logger.warning(f"Slow query ({elapsed_ms:.1f} ms): {key}")
+        if needs_plan and conn is not None:
+            plan = self._explain(conn, query, params)
+            if plan:
+                logger.warning(f"Query plan: {plan}")
+                with self._lock:
+                    entry["plan"] = plan
+
+    @staticmethod
+    def _explain(conn, query, params):
+        if query.lstrip().upper().startswith(_NO_PLAN_PREFIXES):
+            return None
+        try:
+            rows = conn.execute(f"EXPLAIN QUERY PLAN {query}", params or ()).fetchall()
+        except sqlite3.Error as e:
+            logger.debug(f"Could not explain query: {e}")
+            return None
+        return "; ".join(row[-1] for row in rows)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            statements = {
+                key: dict(entry, histogram=list(entry["histogram"]))
+                for key, entry in self._stats.items()
+            }
+        return {
+            "started_at": self.started_at,
+            "written_at": datetime.now().isoformat(timespec="seconds"),
+            "slow_threshold_ms": self.slow_threshold_ms,
+            "buckets_ms": HISTOGRAM_BUCKETS_MS,
+            "statements": statements,
+        }
+
+    def dump(self, path: str = QUERY_STATS_FILE):
+        """Writes the current statistics to a JSON file (atomically)."""
+        data = self.snapshot()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temp_path = f"{path}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.error(f"Could not write query stats to {path}: {e}")
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.started_at = datetime.now().isoformat(timespec="seconds")
+
+
+def load_stats(path: str = QUERY_STATS_FILE) -> dict:
+    """Reads statistics written by QueryStats.dump (empty dict if missing)."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def format_stats_report(data: dict, sort_by: str = "total_ms", limit: int = 20) -> str:
+    """Formats statistics as a plain-text table, slowest statements first."""
+    statements = data.get("statements", {})
+    if not statements:
+        return "No query statistics recorded yet."
+
+    rows = sorted(
+        statements.items(), key=lambda item: item[1].get(sort_by, 0), reverse=True
+    )
+    lines = [
+        f"Recorded since {data.get('started_at')} (written {data.get('written_at')}), "
+        f"slow threshold {data.get('slow_threshold_ms')} ms",
+        "",
+    ]
+    for query, entry in rows[:limit]:
+        count = entry["count"]
+        average = entry["total_ms"] / count if count else 0
+        p50 = estimate_percentile(entry["histogram"], 50)
+        p95 = estimate_percentile(entry["histogram"], 95)
+        lines.append(
+            f"{count:>7} calls  total {entry['total_ms']:>9.1f} ms  avg {average:>7.2f} ms  "
+            f"p50<={p50:g} ms  p95<={p95:g} ms  max {entry['max_ms']:.1f} ms  "
+            f"slow {entry['slow_count']}"
+        )
+        lines.append(f"    {query}")
+        if entry.get("plan"):
+            lines.append(f"    plan: {entry['plan']}")
+    return "\n".join(lines)
+
+
+query_stats = QueryStats()
+
+
+@contextmanager
+def track_query(query, params=None, conn=None):
+    """Times the enclosed execute/fetch and records it under the statement."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        query_stats.record(query, params, elapsed_ms, conn)
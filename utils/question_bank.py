@@ -0,0 +1,381 @@
+import bisect
+import itertools
+import logging
+import random
+import threading
+from array import array
+from collections import OrderedDict
+
+from config import (
+    CACHE_VERSION_CHECK_SECONDS,
+    QUESTION_NO_REPEAT,
+    QUESTION_SNAPSHOT_FILE,
+    SEEN_QUESTIONS_CACHE_USERS,
+)
+from utils import database
+from utils.category_mangement import category_registry
+from utils.passage_store import NO_PASSAGE
+from utils.question_snapshot import load_snapshot, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+QUESTIONS_CACHE = "questions"
+_NO_IDS = array("q")
+
+# Random draws per requested question before the sampler stops guessing and
+# scans the pools for the questions a user has not seen.
+REJECTION_ATTEMPTS_PER_QUESTION = 4
+
+
+class IdBitset:
+    """Set of non-negative integer ids stored as one bit per id."""
+
+    __slots__ = ("bits", "count")
+
+    def __init__(self, ids=()):
+        self.bits = bytearray()
+        self.count = 0
+        for id in ids:
+            self.add(id)
+
+    def add(self, id):
+        byte = id >> 3
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(byte + 1 - len(self.bits)))
+        mask = 1 << (id & 7)
+        if not self.bits[byte] & mask:
+            self.bits[byte] |= mask
+            self.count += 1
+
+    def __contains__(self, id):
+        byte = id >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] & (1 << (id & 7)))
+
+    def __len__(self):
+        return self.count
+
+
+def _pick(pools, offsets, position):
+    """Maps a position of the concatenated pools back to its id."""
+    index = bisect.bisect_right(offsets, position)
+    start = offsets[index - 1] if index else 0
+    return int(pools[index][position - start])
+
+
+def _sample_from_pools(pools, k, seen=None, exclude=()):
+    """Returns up to k distinct random ids drawn from the union of pools.
+
+    Samples k positions of the concatenated pools and maps each one back to
+    its pool, so the cost is O(k log len(pools)) whatever the pool sizes.
+    Ids in seen are skipped by rejection while most of the pools is unseen;
+    otherwise the unseen ids are collected with one scan, and seen ids are
+    only repeated once the pools have no unseen ones left. Ids in exclude
+    are never returned.
+    """
+    offsets = list(itertools.accumulate(len(pool) for pool in pools))
+    total = offsets[-1] if offsets else 0
+    k = min(k, total)
+    if not seen and not exclude:
+        return [_pick(pools, offsets, position) for position in random.sample(range(total), k)]
+
+    seen = seen or ()
+    picked = {}
+    for _ in range(REJECTION_ATTEMPTS_PER_QUESTION * k):
+        if len(picked) == k:
+            return list(picked)
+        id = _pick(pools, offsets, random.randrange(total))
+        if id not in seen and id not in exclude:
+            picked[id] = None
+
+    unseen = [
+        int(id)
+        for pool in pools
+        for id in pool
+        if id not in seen and id not in picked and id not in exclude
+    ]
+    picked.update(dict.fromkeys(random.sample(unseen, min(k - len(picked), len(unseen)))))
+    if len(picked) < k:
+        repeats = [
+            int(id) for pool in pools for id in pool if id not in picked and id not in exclude
+        ]
+        picked.update(dict.fromkeys(random.sample(repeats, min(k - len(picked), len(repeats)))))
+    return list(picked)
+
+
+class SeenQuestions:
+    """Per-user sets of the questions each user should not get again.
+
+    A user's set is loaded from their test and level-determination answers
+    on first use and then kept up to date by record_answer(), so sampling
+    never runs a NOT IN subquery. Only the most recently active users are
+    kept; the rest are reloaded when they come back.
+    """
+
+    def __init__(self, policy: str = QUESTION_NO_REPEAT, max_users: int = SEEN_QUESTIONS_CACHE_USERS):
+        self.policy = policy
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._users = OrderedDict()
+
+    def _load(self, user_id) -> IdBitset:
+        condition = "AND is_correct = 1" if self.policy == "correct" else ""
+        rows = database.get_data(
+            f"""
+            SELECT question_id FROM all_user_answers WHERE user_id = ? {condition}
+            UNION
+            SELECT question_id FROM all_level_determination_answers WHERE user_id = ? {condition}
+            """,
+            (user_id, user_id),
+        )
+        return IdBitset(row[0] for row in rows if row[0] is not None)
+
+    def get(self, user_id):
+        """Returns the user's seen set (None when repeats are allowed)."""
+        if self.policy == "none" or user_id is None:
+            return None
+        with self._lock:
+            seen = self._users.get(user_id)
+            if seen is not None:
+                self._users.move_to_end(user_id)
+                return seen
+        seen = self._load(user_id)
+        with self._lock:
+            # Keep a set another thread loaded first; it may have answers since.
+            seen = self._users.setdefault(user_id, seen)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return seen
+
+    def record_answer(self, user_id, question_id, is_correct):
+        """Adds an answer to the user's set if it is loaded."""
+        if self.policy == "correct" and not is_correct:
+            return
+        with self._lock:
+            seen = self._users.get(user_id)
+            if seen is not None and question_id is not None:
+                seen.add(question_id)
+
+    def forget(self, user_id=None):
+        """Drops one user's set, or every set, so it is reloaded."""
+        with self._lock:
+            if user_id is None:
+                self._users.clear()
+            else:
+                self._users.pop(user_id, None)
+
+
+seen_questions = SeenQuestions()
+
+
+def draw_units(units, quota, seen=None):
+    """Draws random units (passage groups or single questions) up to quota ids.
+
+    Units the user has not seen come first, and whole units that fit before
+    cut ones, so a passage is only split when nothing else fills the quota.
+    Like _sample_from_pools, unseen units are drawn by rejection while most
+    of them are unseen, otherwise found with one scan of units; seen units
+    are only drawn once no unseen one is left.
+    """
+    if quota <= 0 or not units:
+        return []
+    seen = seen or ()
+    drawn = []
+    picked = set()
+
+    def unseen(index):
+        return not any(question_id in seen for question_id in units[index])
+
+    def take(index, whole):
+        room = quota - len(drawn)
+        if index in picked or (whole and len(units[index]) > room):
+            return
+        picked.add(index)
+        drawn.extend(units[index][:room])
+
+    for _ in range(REJECTION_ATTEMPTS_PER_QUESTION * quota):
+        if len(drawn) == quota:
+            return drawn
+        index = random.randrange(len(units))
+        if unseen(index):
+            take(index, whole=True)
+
+    fresh, repeats = [], []
+    for index in random.sample(range(len(units)), len(units)):
+        if index not in picked:
+            (fresh if unseen(index) else repeats).append(index)
+    for indexes in (fresh, repeats):
+        for whole in (True, False):
+            for index in indexes:
+                if len(drawn) == quota:
+                    return drawn
+                take(index, whole)
+    return drawn
+
+
+def group_questions(rows):
+    """Groups (id, question_type, main_category_id, passage_name) rows, in id order.
+
+    Returns (pools, strata): the ids of each (question_type,
+    main_category_id), and its sampling units, passage groups and single
+    questions as tuples of ids.
+    """
+    pools = {}
+    passages = {}
+    strata = {}
+    for question_id, question_type, main_id, passage_name in rows:
+        pools.setdefault((question_type, main_id), array("q")).append(question_id)
+        if passage_name in NO_PASSAGE:
+            strata.setdefault((question_type, main_id), []).append((question_id,))
+            continue
+        group = passages.get((question_type, passage_name))
+        if group is None:
+            # A passage group is filed under its first question's category.
+            group = passages[(question_type, passage_name)] = []
+            strata.setdefault((question_type, main_id), []).append(group)
+        group.append(question_id)
+    strata = {key: [tuple(unit) for unit in units] for key, units in strata.items()}
+    return pools, strata
+
+
+_ACTIVE_QUESTIONS_SQL = (
+    "SELECT id, question_type, main_category_id, passage_name FROM active_questions ORDER BY id"
+)
+
+
+class QuestionBank(database.VersionedCache):
+    """Process-wide index of question ids for random sampling.
+
+    The ids of the questions table are loaded once into compact arrays keyed
+    by (question_type, main_category_id); a subcategory samples from the
+    pools of its linked main categories. Like the category registry, the
+    bank reloads itself when the "questions" entry in cache_versions changes,
+    which the importers bump through invalidate_question_bank().
+
+    When QUESTION_SNAPSHOT_FILE was built for the current version, the bank
+    maps it instead of querying the table: the arrays are views of the file,
+    shared by every worker process through the page cache.
+    """
+
+    cache_name = QUESTIONS_CACHE
+
+    def __init__(self, check_interval: float = CACHE_VERSION_CHECK_SECONDS):
+        super().__init__(check_interval)
+        self.pools = {}
+        self.pools_by_type = {}
+        self.all_ids = array("q")
+        self.strata = {}
+        self.units_by_type = {}
+
+    def _load(self, version):
+        if self._load_snapshot(version):
+            return
+        pools, strata = group_questions(database.get_data(_ACTIVE_QUESTIONS_SQL))
+        pools_by_type = {}
+        all_ids = array("q")
+        for (question_type, _), ids in pools.items():
+            pools_by_type.setdefault(question_type, array("q")).extend(ids)
+            all_ids.extend(ids)
+        units_by_type = {}
+        for (question_type, _), units in strata.items():
+            units_by_type.setdefault(question_type, []).extend(units)
+
+        self.pools = pools
+        self.pools_by_type = pools_by_type
+        self.all_ids = all_ids
+        self.strata = strata
+        self.units_by_type = units_by_type
+
+    def _load_snapshot(self, version) -> bool:
+        """Maps the snapshot if it matches version; returns whether it did."""
+        try:
+            snapshot = load_snapshot(QUESTION_SNAPSHOT_FILE)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Ignoring question bank snapshot %s: %s", QUESTION_SNAPSHOT_FILE, e)
+            return False
+        if snapshot is None or snapshot.questions_version != version:
+            return False
+        self.pools = snapshot.pools
+        self.pools_by_type = snapshot.pools_by_type
+        self.all_ids = snapshot.all_ids
+        self.strata = snapshot.strata
+        self.units_by_type = snapshot.units_by_type
+        return True
+
+    # With user_id, questions the user has already seen are only repeated once
+    # the matching pools have no other questions left.
+
+    def units_of(self, question_type, main_category_id):
+        """Returns the sampling units of a category: passage groups and single questions."""
+        self._ensure_fresh()
+        return self.strata.get((question_type, main_category_id), [])
+
+    def ids_of_type(self, question_type):
+        """Returns the array of question ids of a type."""
+        self._ensure_fresh()
+        return self.pools_by_type.get(question_type, _NO_IDS)
+
+    def sample(self, k, question_type=None, user_id=None, exclude=()):
+        """Returns up to k random question ids, optionally of one type.
+
+        Ids in exclude (e.g. the questions a test already has) are left out.
+        """
+        self._ensure_fresh()
+        if question_type is None:
+            pools = [self.all_ids]
+        else:
+            pools = [self.pools_by_type.get(question_type, ())]
+        return _sample_from_pools(pools, k, seen_questions.get(user_id), exclude)
+
+    def sample_passage_groups(self, k, question_type, user_id=None):
+        """Returns up to k random ids of a type drawn as whole passage groups.
+
+        Questions of a passage come out together and in order, so the passage
+        only has to be sent once per group.
+        """
+        self._ensure_fresh()
+        return draw_units(
+            self.units_by_type.get(question_type, []), k, seen_questions.get(user_id)
+        )
+
+    def sample_main_category(self, main_category_id, k, question_type, user_id=None):
+        """Returns up to k random ids of a type from one main category."""
+        self._ensure_fresh()
+        return _sample_from_pools(
+            [self.pools.get((question_type, main_category_id), ())],
+            k,
+            seen_questions.get(user_id),
+        )
+
+    def sample_subcategory(self, subcategory_id, k, question_type, user_id=None):
+        """Returns up to k random ids of a type from a subcategory's main categories."""
+        self._ensure_fresh()
+        pools = [
+            self.pools.get((question_type, main_id), ())
+            for main_id, _ in category_registry.main_categories_of(subcategory_id)
+        ]
+        return _sample_from_pools(pools, k, seen_questions.get(user_id))
+
+
+question_bank = QuestionBank()
+
+
+def invalidate_question_bank():
+    """Tells every process that the questions table changed."""
+    database.bump_cache_version(QUESTIONS_CACHE)
+    question_bank.invalidate()
+
+
+def build_question_snapshot(path: str = QUESTION_SNAPSHOT_FILE) -> dict:
+    """Writes the bank of the current questions version to path.
+
+    Returns the snapshot header. Raises RuntimeError if the questions
+    changed while it was being read; run it again after the import.
+    """
+    version = database.get_cache_version(QUESTIONS_CACHE)
+    pools, strata = group_questions(database.get_data(_ACTIVE_QUESTIONS_SQL))
+    if database.get_cache_version(QUESTIONS_CACHE) != version:
+        raise RuntimeError("The questions changed while the snapshot was built")
+    header = write_snapshot(path, version, pools, strata)
+    question_bank.invalidate()
+    return header
@@ -0,0 +1,174 @@
+import re
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from config import NEAR_DUPLICATE_THRESHOLD
+from utils.question_search import normalize_arabic
+
+# Words, and the newlines the texts are joined with to tokenize them in one pass.
+_TOKEN = re.compile(r"\w+|\n")
+
+# Hash functions per signature. More make the Jaccard estimate of a pair
+# tighter (standard error ~ 0.5 / sqrt(MINHASH_PERMUTATIONS)) and cost more.
+MINHASH_PERMUTATIONS = 128
+MINHASH_SEED = 20241017
+
+# Shingles hashed at once. Small enough to stay in the CPU cache while every
+# permutation goes over them.
+MINHASH_CHUNK_SHINGLES = 65536
+
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+# Marks the start and end of a text, so even one-word texts have a shingle.
+_EDGE = "\n"
+
+
+def dedup_text(question) -> str:
+    """The text of a question compared for duplicates: its text and options.
+
+    question is a dict with the workbook columns. The explanation is left
+    out, as generated variants of a question keep the explanation as is.
+    """
+    return " ".join(
+        str(question.get(column, ""))
+        for column in ("نص السؤال", "الخيار أ", "الخيار ب", "الخيار ج", "الخيار د")
+    )
+
+
+def _shingles(texts):
+    """Returns (hashes, starts): the uint64 hashes of the word bigrams of the
+    normalized texts, text after text, and where each text's bigrams start.
+
+    Words are hashed with hash(), which is only stable within a process;
+    signatures are compared in the run that computed them.
+    """
+    # Every text is framed by an edge on each side; the edge between two
+    # texts both ends one and starts the next.
+    joined = _EDGE + _EDGE.join(str(text).replace(_EDGE, " ") for text in texts) + _EDGE
+    tokens = _TOKEN.findall(normalize_arabic(joined))
+    hashes = np.fromiter(map(hash, tokens), dtype=np.int64, count=len(tokens)).view(np.uint64)
+    # Bigram i pairs token i with token i + 1, so the bigrams of a text run
+    # from its first edge up to its last one, where the next text starts.
+    starts = np.flatnonzero(hashes == np.uint64(hash(_EDGE) % 2**64))
+    bigrams = hashes[:-1] * _MIX + hashes[1:]
+    bigrams ^= bigrams >> np.uint64(31)
+    return bigrams, starts
+
+
+def minhash_signatures(texts, permutations: int = MINHASH_PERMUTATIONS) -> np.ndarray:
+    """MinHash signatures (one uint32 row per text) of the texts' word bigrams.
+
+    Each permutation is a multiply-shift hash; the minimum of a text's
+    shingles is taken with one reduceat over all texts at once.
+    """
+    hashes, starts = _shingles(texts)
+    rng = np.random.default_rng(MINHASH_SEED)
+    multipliers = rng.integers(1, 2**63, size=permutations, dtype=np.uint64) * 2 + 1
+    offsets = rng.integers(0, 2**63, size=permutations, dtype=np.uint64)
+    signatures = np.empty((permutations, len(starts) - 1), dtype=np.uint64)
+    shift = np.uint64(32)
+    # Chunks of whole texts, so each reduceat group lies in one chunk.
+    first = 0
+    while first < len(starts) - 1:
+        last = int(np.searchsorted(starts, starts[first] + MINHASH_CHUNK_SHINGLES, "right")) - 1
+        last = max(last, first + 1)
+        chunk = hashes[starts[first] : starts[last]]
+        chunk_starts = starts[first:last] - starts[first]
+        values = np.empty_like(chunk)
+        for permutation in range(permutations):
+            np.multiply(chunk, multipliers[permutation], out=values)
+            np.add(values, offsets[permutation], out=values)
+            np.right_shift(values, shift, out=values)
+            np.minimum.reduceat(values, chunk_starts, out=signatures[permutation, first:last])
+        first = last
+    return signatures.T.astype(np.uint32)
+
+
+def _bands(permutations: int, threshold: float):
+    """(bands, rows) whose LSH threshold is the highest at or below threshold.
+
+    Pairs from threshold up are then almost always candidates, and the
+    signatures filter out the rest.
+    """
+    splits = [
+        (bands, permutations // bands)
+        for bands in range(1, permutations + 1)
+        if permutations % bands == 0
+    ]
+    below = [split for split in splits if (1 / split[0]) ** (1 / split[1]) <= threshold]
+    return max(below or splits[-1:], key=lambda split: (1 / split[0]) ** (1 / split[1]))
+
+
+def find_near_duplicates(texts, threshold: float = NEAR_DUPLICATE_THRESHOLD):
+    """Groups texts whose word bigrams overlap by at least threshold (Jaccard).
+
+    Signatures are split into LSH bands; texts sharing a band are
+    candidates, kept when their signatures agree on at least threshold of
+    the permutations. Returns the clusters (lists of indices into texts, in
+    order) with more than one text, largest first.
+    """
+    texts = list(texts)
+    if len(texts) < 2:
+        return []
+    signatures = minhash_signatures(texts)
+    bands, rows = _bands(signatures.shape[1], threshold)
+
+    pairs = []
+    for band in range(bands):
+        keys = np.zeros(len(texts), dtype=np.uint64)
+        for column in signatures[:, band * rows : (band + 1) * rows].T:
+            keys = keys * _MIX + column
+        # Texts whose rows of the band are equal fall in the same bucket;
+        # each one is compared with the first text of its bucket.
+        _, first, bucket = np.unique(keys, return_index=True, return_inverse=True)
+        leaders = first[bucket]
+        members = np.flatnonzero(leaders != np.arange(len(texts)))
+        if len(members):
+            pairs.append(np.stack((leaders[members], members), axis=1))
+    if not pairs:
+        return []
+    pairs = np.unique(np.concatenate(pairs), axis=0)
+    agreement = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1)
+    pairs = pairs[agreement >= threshold]
+
+    graph = sparse.coo_matrix(
+        (np.ones(len(pairs), dtype=np.int8), (pairs[:, 0], pairs[:, 1])),
+        shape=(len(texts), len(texts)),
+    )
+    _, labels = connected_components(graph, directed=False)
+    grouped = np.flatnonzero(np.bincount(labels)[labels] > 1)
+    if not len(grouped):
+        return []
+    grouped = grouped[np.argsort(labels[grouped], kind="stable")]
+    bounds = np.flatnonzero(np.diff(labels[grouped])) + 1
+    clusters = [cluster.tolist() for cluster in np.split(grouped, bounds)]
+    clusters.sort(key=len, reverse=True)
+    return clusters
+
+
+def drop_near_duplicates(new_texts, existing_texts=(), threshold: float = NEAR_DUPLICATE_THRESHOLD):
+    """Filters new texts that near-duplicate an existing text or each other.
+
+    Returns (kept, clusters): the indices of new_texts to keep, and the
+    clusters that had a new text in them, as lists of ("existing", index)
+    and ("new", index). Of a cluster without an existing text the first new
+    text is kept.
+    """
+    existing_texts = list(existing_texts)
+    new_texts = list(new_texts)
+    dropped = set()
+    reported = []
+    for cluster in find_near_duplicates(existing_texts + new_texts, threshold):
+        members = [
+            ("existing", index) if index < len(existing_texts) else ("new", index - len(existing_texts))
+            for index in cluster
+        ]
+        new = [index for source, index in members if source == "new"]
+        if not new:
+            continue
+        has_existing = len(new) < len(members)
+        dropped.update(new if has_existing else new[1:])
+        reported.append(members)
+    kept = [index for index in range(len(new_texts)) if index not in dropped]
+    return kept, reported
@@ -1,86 +1,105 @@
-import os
 import sqlite3
+import time
+from itertools import repeat
 import pandas as pd
 
-from config import DATABASE_FILE, EXCEL_FILE_QUANTITATIVE, VERBAL_FILE
-from utils.database import create_connection, get_data, execute_query
+from config import (
+    DATABASE_FILE,
+    EXCEL_FILE_QUANTITATIVE,
+    PASSAGE_AWARE_SAMPLING,
+    VERBAL_FILE,
+)
+from utils.category_mangement import (
+    ensure_category_ids,
+    invalidate_category_cache,
+    link_categories,
+    split_subcategories,
+)
+from utils.database import create_connection, get_data, execute_query, transaction
+from utils.passage_store import (
+    NO_PASSAGE,
+    import_passages,
+    invalidate_passage_cache,
+    passage_store,
+)
+from utils.question_bank import invalidate_question_bank, question_bank
+from utils.question_search import rebuild_search_index, reindex_questions
+from utils.question_sync import sync_questions
+from utils.test_assembly import assemble_test
+
+
+def _report_sync(changes, started):
+    elapsed = time.perf_counter() - started
+    print(
+        f"Synced questions in {elapsed:.2f}s: {changes['unchanged']} unchanged, "
+        f"{changes['updated']} updated, {changes['inserted']} new, "
+        f"{changes['revived']} restored, {changes['deleted']} removed."
+    )
 
 
 def generate_questions_with_categories():
-    # Check if data already exists in the table
-    count = get_data("SELECT COUNT(*) FROM questions")
-    print(count)
-    if count[0][0] == 0:  # If the table is empty, populate it from Excel
-        df = pd.read_excel(
-            EXCEL_FILE_QUANTITATIVE,
-            usecols=[
-                "الجواب الصحيح",
-                "نص السؤال مدقق",
-                "الخيار أ مدقق",
-                "الخيار ب مدقق",
-                "الخيار ج مدقق",
-                "الخيار د مدقق",
-                "الشرح مدقق",
-                "التصنيف الرئيسي مدقق",
-                "التصنيفات الفرعية مدققة",
-            ],
+    """Syncs the quantitative questions with EXCEL_FILE_QUANTITATIVE.
+
+    Only rows that changed since the last import are written; question ids
+    (and so the answers recorded for them) are kept.
+    """
+    started = time.perf_counter()
+    df = pd.read_excel(
+        EXCEL_FILE_QUANTITATIVE,
+        usecols=[
+            "الجواب الصحيح",
+            "نص السؤال مدقق",
+            "الخيار أ مدقق",
+            "الخيار ب مدقق",
+            "الخيار ج مدقق",
+            "الخيار د مدقق",
+            "الشرح مدقق",
+            "التصنيف الرئيسي مدقق",
+            "التصنيفات الفرعية مدققة",
+        ],
+    )
+
+    main_categories = df["التصنيف الرئيسي مدقق"].astype(str).tolist()
+    subcategory_lists = df["التصنيفات الفرعية مدققة"].map(split_subcategories).tolist()
+
+    with transaction() as conn:
+        # Resolve every category name to its id once, in memory
+        main_id_map = ensure_category_ids(conn, "main_categories", main_categories)
+        sub_id_map = ensure_category_ids(
+            conn, "subcategories", [sub for subs in subcategory_lists for sub in subs]
+        )
+        link_categories(
+            conn, main_categories, subcategory_lists, main_id_map, sub_id_map
         )
 
-        for _, row in df.iterrows():
-            main_category = row["التصنيف الرئيسي مدقق"]
-            subcategories = row["التصنيفات الفرعية مدققة"].split("،")
+        # Rows in QUESTION_COLUMNS order
+        changes = sync_questions(
+            conn,
+            "quantitative",
+            zip(
+                df["الجواب الصحيح"].astype(str),
+                df["نص السؤال مدقق"].astype(str),
+                df["الخيار أ مدقق"].astype(str),
+                df["الخيار ب مدقق"].astype(str),
+                df["الخيار ج مدقق"].astype(str),
+                df["الخيار د مدقق"].astype(str),
+                df["الشرح مدقق"].astype(str),
+                (main_id_map[name] for name in main_categories),
+                repeat("quantitative"),
+                repeat(None),
+                repeat(None),
+            ),
+        )
+        reindex_questions(conn, changes["changed_ids"])
 
-            # Get or create main category ID
-            execute_query(
-                "INSERT OR IGNORE INTO main_categories (name) VALUES (?)",
-                (main_category,),
-            )
-            main_category_id = get_data(
-                "SELECT id FROM main_categories WHERE name = ?", (main_category,)
-            )[0][0]
-
-            # Link main category to subcategories
-            for subcategory in subcategories:
-                subcategory = subcategory.strip()
-                execute_query(
-                    "INSERT OR IGNORE INTO subcategories (name) VALUES (?)",
-                    (subcategory,),
-                )
-                subcategory_id = get_data(
-                    "SELECT id FROM subcategories WHERE name = ?", (subcategory,)
-                )[0][0]
-                execute_query(
-                    "INSERT OR IGNORE INTO main_sub_links (main_category_id, subcategory_id) VALUES (?, ?)",
-                    (main_category_id, subcategory_id),
-                )
-
-            # Now insert the question with the main_category_id
-            execute_query(
-                """
-                INSERT INTO questions (correct_answer, question_text, option_a, option_b, option_c, option_d, explanation, main_category_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-                (
-                    str(row["الجواب الصحيح"]),
-                    str(row["نص السؤال مدقق"]),
-                    str(row["الخيار أ مدقق"]),
-                    str(row["الخيار ب مدقق"]),
-                    str(row["الخيار ج مدقق"]),
-                    str(row["الخيار د مدقق"]),
-                    str(row["الشرح مدقق"]),
-                    main_category_id,
-                ),
-            )
+    invalidate_category_cache()
+    invalidate_question_bank()
+    _report_sync(changes, started)
 
 
 def generate_verbal_questions():
-    """Adds verbal questions to the database from an Excel file.
-
-    Args:
-        excel_file (str): The path to the Excel file.
-    """
-    count = get_data("SELECT COUNT(*) FROM questions")
-    print(count)
+    """Syncs the verbal questions with VERBAL_FILE, keeping question ids."""
+    started = time.perf_counter()
     df = pd.read_excel(
         VERBAL_FILE,
         usecols=[
@@ -96,84 +115,69 @@ def generate_verbal_questions():
         ],
     )
 
-    for _, row in df.iterrows():
-        main_category = row["التصنيف الرئيسي"]
-        question_type = "verbal"
-        if str(main_category).lower() == "nan":
-            continue
-        # Get the main category ID (create if it doesn't exist)
-        execute_query(
-            "INSERT OR IGNORE INTO main_categories (name) VALUES (?)",
-            (main_category,),
-        )
-        main_category_id = get_data(
-            "SELECT id FROM main_categories WHERE name = ?", (main_category,)
-        )[0][0]
-
-        # Insert the verbal question
-        execute_query(
-            """
-            INSERT INTO questions (correct_answer, question_text, option_a, option_b, 
-                                    option_c, option_d, explanation, main_category_id, 
-                                    image_path, question_type, passage_name)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                str(row["الجواب الصحيح"]),
-                str(row["نص السؤال"]),
-                str(row["الخيار أ"]),
-                str(row["الخيار ب"]),
-                str(row["الخيار ج"]),
-                str(row["الخيار د"]),
-                str(row["الشرح"]),
-                main_category_id,
-                None,
-                question_type,
-                str(row["القطعة"]),
+    # Skip rows without a main category
+    main_categories = df["التصنيف الرئيسي"].astype(str)
+    has_category = main_categories.str.lower() != "nan"
+    df = df[has_category]
+    main_categories = main_categories[has_category].tolist()
+
+    with transaction() as conn:
+        # Get the main category IDs (create the missing ones)
+        main_id_map = ensure_category_ids(conn, "main_categories", main_categories)
+
+        # Rows in QUESTION_COLUMNS order
+        changes = sync_questions(
+            conn,
+            "verbal",
+            zip(
+                df["الجواب الصحيح"].astype(str),
+                df["نص السؤال"].astype(str),
+                df["الخيار أ"].astype(str),
+                df["الخيار ب"].astype(str),
+                df["الخيار ج"].astype(str),
+                df["الخيار د"].astype(str),
+                df["الشرح"].astype(str),
+                (main_id_map[name] for name in main_categories),
+                repeat("verbal"),
+                repeat(None),
+                df["القطعة"].astype(str),
             ),
         )
+        reindex_questions(conn, changes["changed_ids"])
 
-    print("Questions has finished creating it.")
+    invalidate_category_cache()
+    invalidate_question_bank()
+    _report_sync(changes, started)
 
 
-def get_passage_content(context_folder, passage_name):
+def get_passage_content(passage_name):
     """Fetches the passage content based on the passage_name."""
-    if passage_name and passage_name != "N/A":
-        file_path = os.path.join(context_folder, f"{passage_name}.txt")
-        if os.path.exists(file_path):
-            with open(file_path, "r", encoding="utf-8") as file:
-                return file.read().strip()
-    return ""
+    return passage_store.get(passage_name)
 
 
-def create_context_files(excel_file, output_dir):
+def import_passages_from_excel(excel_file):
     """
-    Creates individual text files for each context from an Excel file.
+    Imports the passages of an Excel file into the passages table.
 
     Args:
-        excel_file (str): Path to the Excel file containing file names and contexts.
-        output_dir (str): Path to the directory where context files will be saved.
+        excel_file (str): Path to the Excel file containing passage names and texts.
     """
 
     try:
-        # Create the output directory if it doesn't exist
-        os.makedirs(output_dir, exist_ok=True)
-
-        df = pd.read_excel(excel_file)
-
-        for index, row in df.iterrows():
-            file_name = row['اسم القطعة']
-            context = row['النص']
-
-            file_path = os.path.join(output_dir, f"{file_name}.txt")
-
-            try:
-                with open(file_path, "w", encoding="utf-8") as f:
-                    f.write(str(context)) # Handle potential None values
-            except Exception as e:
-                print(f"Error writing file {file_name}.txt: {e}")
-
-        print("Context Files Created.")
+        started = time.perf_counter()
+        df = pd.read_excel(excel_file, usecols=["اسم القطعة", "النص"])
+        passages = [
+            (str(name).strip(), str(text).strip())
+            for name, text in zip(df["اسم القطعة"], df["النص"])
+            if str(name).strip() not in NO_PASSAGE
+        ]
+        with transaction() as conn:
+            changed = import_passages(conn, passages)
+            if changed:
+                rebuild_search_index(conn)
+        invalidate_passage_cache()
+        elapsed = time.perf_counter() - started
+        print(f"Imported {len(passages)} passages ({changed} new or changed) in {elapsed:.2f}s.")
     except FileNotFoundError:
         print(f"Error: Excel file not found at {excel_file}")
     except Exception as e:
@@ -212,23 +216,48 @@ def generate_questions():
                     row["الشرح مدقق"],
                 ),
             )
+        with transaction() as conn:
+            rebuild_search_index(conn)
+        invalidate_question_bank()
 
 
 def generate_question():
     # generate_questions_with_categories()
     generate_verbal_questions()
 
-def get_random_questions(num_questions, question_type):
+def fetch_questions(question_ids):
+    """Returns (rows, description) of the questions, in the order of the ids."""
+    if not question_ids:
+        return [], None
+    placeholders = ", ".join("?" * len(question_ids))
+    rows, description = execute_query(
+        f"SELECT * FROM questions WHERE id IN ({placeholders})",
+        tuple(question_ids),
+        fetch_all=True,
+    )
+    if rows is None:
+        return None, None
+    order = {question_id: index for index, question_id in enumerate(question_ids)}
+    rows.sort(key=lambda row: order[row[0]])
+    return rows, description
+
+
+def get_random_questions(num_questions, question_type, user_id=None):
     """Retrieves a specified number of random questions from the """
-    # Step 1: Retrieve a random set of questions
-    questions = get_data(
-        """
-        SELECT * FROM questions 
-        WHERE question_type = ?
-        ORDER BY RANDOM() 
-        LIMIT ?
-        """,
-        (question_type, num_questions),
+    # With a blueprint for the type, follow its category shares; the
+    # assembled ids already keep passage groups together.
+    question_ids = assemble_test(question_type, num_questions, user_id)
+    if question_ids is not None:
+        questions, _ = fetch_questions(question_ids)
+        return questions
+    if PASSAGE_AWARE_SAMPLING:
+        questions, _ = fetch_questions(
+            question_bank.sample_passage_groups(num_questions, question_type, user_id)
+        )
+        return questions
+    # Step 1: Sample a random set of questions the user has not seen yet
+    questions, _ = fetch_questions(
+        question_bank.sample(num_questions, question_type, user_id)
     )
     # Step 2: Group questions by passage name
     grouped_questions = sorted(
@@ -237,7 +266,9 @@ def get_random_questions(num_questions, question_type):
     return grouped_questions
 
 
-def get_questions_by_category(category_id, num_questions, category_type, question_type):
+def get_questions_by_category(
+    category_id, num_questions, category_type, question_type, user_id=None
+):
     """Retrieves random questions of a specific type from the specified category.
 
     Args:
@@ -245,34 +276,28 @@ def get_questions_by_category(category_id, num_questions, category_type, questio
         num_questions (int): The number of questions to retrieve.
         category_type (str): 'main_category_id' or 'sub_category_id'.
         question_type (str): 'verbal' or 'quantitative'.
+        user_id (int): Skip questions this user has seen, while others are left.
     """
     if category_type == "main_category_id":
-        query = """
-            SELECT * FROM questions
-            WHERE main_category_id = ? AND question_type = ?
-            ORDER BY RANDOM()
-            LIMIT ?
-        """
+        question_ids = question_bank.sample_main_category(
+            category_id, num_questions, question_type, user_id
+        )
     elif category_type == "sub_category_id":
-        query = """
-            SELECT q.* FROM questions q
-            JOIN main_sub_links msl ON q.main_category_id = msl.main_category_id
-            WHERE msl.subcategory_id = ? AND q.question_type = ?
-            ORDER BY RANDOM()
-            LIMIT ?
-        """
+        question_ids = question_bank.sample_subcategory(
+            category_id, num_questions, question_type, user_id
+        )
     else:
         raise ValueError(
             "Invalid category_type. Must be 'main_category_id' or 'sub_category_id'."
         )
-    
-    return execute_query(query, (category_id, question_type, num_questions), fetch_all=True)
+
+    return fetch_questions(question_ids)
 
 
 def get_random_question():
-    result, description = execute_query("SELECT * FROM questions ORDER BY RANDOM() LIMIT 1", fetch_one=True) # Expecting single row
-    if result is not None and result: # make sure to check result is valid
-        return dict(zip((col[0] for col in description), result))
+    question_ids = question_bank.sample(1)
+    if question_ids:
+        return get_question_by_id(question_ids[0])
     return None
 
 def get_question_by_id(question_id):
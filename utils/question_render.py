@@ -0,0 +1,163 @@
+import random
+import threading
+from collections import OrderedDict
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from config import CACHE_VERSION_CHECK_SECONDS, QUESTION_RENDER_CACHE_SIZE
+from utils import database
+from utils.passage_store import PASSAGES_CACHE, passage_store
+from utils.question_bank import QUESTIONS_CACHE
+
+# Bump when the layout of a question message changes, so messages rendered
+# with the old layout are not reused.
+RENDER_LAYOUT_VERSION = 1
+
+OPTION_LETTERS = ("أ", "ب", "ج", "د")
+
+# Shown instead of the passage when it was already sent in its own message.
+PASSAGE_REFERENCE = "📖 النص في الرسالة أعلاه\n\n"
+
+
+class RenderedQuestion:
+    """The parts of a question message that do not depend on the user."""
+
+    __slots__ = ("passage_text", "question_text", "buttons")
+
+    def __init__(self, passage_text, question_text, buttons):
+        self.passage_text = passage_text
+        self.question_text = question_text
+        self.buttons = buttons
+
+
+def render_question(question_data) -> RenderedQuestion:
+    """Formats a questions row: passage prefix, question text and the 4 buttons."""
+    (
+        question_id,
+        correct_answer,
+        question_text,
+        option_a,
+        option_b,
+        option_c,
+        option_d,
+        explanation,
+        main_category_id,
+        question_type,
+        image_path,
+        passage_name,
+        *_,
+    ) = question_data
+    passage_content = passage_store.get(passage_name)
+    passage_text = f"النص: {passage_content}\n\n" if passage_content else ""
+    buttons = tuple(
+        InlineKeyboardButton(f"{letter}. {option}", callback_data=f"answer_{question_id}_{letter}")
+        for letter, option in zip(OPTION_LETTERS, (option_a, option_b, option_c, option_d))
+    )
+    return RenderedQuestion(passage_text, question_text, buttons)
+
+
+class QuestionRenderCache(database.VersionedCache):
+    """Bounded LRU cache of rendered questions, keyed by (question id, layout).
+
+    Emptied when the questions or passages cache version changes, so an
+    import never leaves stale text behind.
+    """
+
+    def __init__(
+        self,
+        max_size: int = QUESTION_RENDER_CACHE_SIZE,
+        check_interval: float = CACHE_VERSION_CHECK_SECONDS,
+    ):
+        super().__init__(check_interval)
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._rendered = OrderedDict()
+
+    def _current_version(self):
+        return (
+            database.get_cache_version(QUESTIONS_CACHE),
+            database.get_cache_version(PASSAGES_CACHE),
+        )
+
+    def _load(self, version):
+        with self._lock:
+            self._rendered.clear()
+
+    def get(self, question_data) -> RenderedQuestion:
+        self._ensure_fresh()
+        key = (question_data[0], RENDER_LAYOUT_VERSION)
+        with self._lock:
+            rendered = self._rendered.get(key)
+            if rendered is not None:
+                self._rendered.move_to_end(key)
+                return rendered
+        rendered = render_question(question_data)
+        with self._lock:
+            self._rendered[key] = rendered
+            while len(self._rendered) > self.max_size:
+                self._rendered.popitem(last=False)
+        return rendered
+
+
+question_render_cache = QuestionRenderCache()
+
+
+def build_question_message(rendered, number, with_passage=True):
+    """Returns (text, reply_markup) of a rendered question with its options
+    shuffled.
+
+    Without with_passage, the passage is replaced by a pointer to the
+    message it was sent in.
+    """
+    buttons = list(rendered.buttons)
+    random.shuffle(buttons)
+    keyboard = [buttons[i : i + 2] for i in range(0, len(buttons), 2)]
+    if with_passage or not rendered.passage_text:
+        prefix = rendered.passage_text
+    else:
+        prefix = PASSAGE_REFERENCE
+    return (
+        f"{prefix}*{number}.* {rendered.question_text}",
+        InlineKeyboardMarkup(keyboard),
+    )
+
+
+async def send_question_message(message, user_data, question_data, index):
+    """Shows question index + 1 of a quiz in place of the previous one.
+
+    The first question is sent as a reply to message, the others edit it.
+    When the quiz was drawn as passage groups (user_data["passage_groups"]),
+    the first question of a group sends the passage once as a message of
+    its own and quotes it; the rest of the group only refer to it instead
+    of repeating the whole text. The message that quoted a finished group
+    is replaced by a new one.
+    """
+    # A cache miss or version check queries the database.
+    rendered = await database.db.run(question_render_cache.get, question_data)
+    if not user_data.get("passage_groups"):
+        text, reply_markup = build_question_message(rendered, index + 1)
+    else:
+        passage_name = question_data[11] if rendered.passage_text else None
+        previous_passage = user_data.get("sent_passage") if index > 0 else None
+        user_data["sent_passage"] = passage_name
+        text, reply_markup = build_question_message(
+            rendered, index + 1, with_passage=False
+        )
+        if passage_name != previous_passage:
+            if previous_passage is not None:
+                await message.delete()
+                send = message.chat.send_message
+            elif index == 0:
+                send = message.reply_text
+            else:
+                # The previous question message becomes the passage.
+                send = message.edit_text
+            if passage_name is None:
+                return await send(text, reply_markup=reply_markup)
+            passage_message = await send(rendered.passage_text.strip())
+            return await passage_message.reply_text(
+                text, reply_markup=reply_markup, do_quote=True
+            )
+    if index == 0:
+        return await message.reply_text(text, reply_markup=reply_markup)
+    return await message.edit_text(text, reply_markup=reply_markup)
@@ -0,0 +1,211 @@
+import re
+
+from config import SEARCH_RESULTS_LIMIT
+from utils import database
+
+# Harakat, tanween, shadda, sukun, Quranic marks, dagger alef and tatweel.
+_DIACRITICS = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+# Hamza carriers and alef variants fold to their base letter, alef maqsura to
+# ya and ta marbuta to ha, so spelling variants of a word match each other.
+# Applied with str.replace, which is far faster on Arabic text than translate.
+_FOLDING = (
+    ("أ", "ا"),
+    ("إ", "ا"),
+    ("آ", "ا"),
+    ("ٱ", "ا"),
+    ("ؤ", "و"),
+    ("ئ", "ي"),
+    ("ى", "ي"),
+    ("ة", "ه"),
+)
+_WORD = re.compile(r"\w+")
+
+# bm25 ranks every match, so a broad query (a common word or a short prefix)
+# is only ranked among its first RANK_CANDIDATES matches by rowid.
+RANK_CANDIDATES = 1000
+
+# Columns of a result row. Questions only carry their main category; the
+# subcategory is the first one linked to it, or 0 (verbal) when none is.
+RESULT_COLUMNS = """
+    q.id, q.question_type, q.main_category_id,
+    COALESCE(
+        (SELECT MIN(l.subcategory_id) FROM main_sub_links l
+         WHERE l.main_category_id = q.main_category_id),
+        0
+    ),
+    q.question_text
+"""
+
+SEARCH_TABLES_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS question_search USING fts5(
+        question_text, options, explanation, tokenize = 'unicode61', prefix = '2 3'
+    )
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS passage_search USING fts5(
+        content, tokenize = 'unicode61', prefix = '2 3'
+    )
+    """,
+]
+
+
+def normalize_arabic(text) -> str:
+    """Strips diacritics and folds letter variants, for indexing and queries."""
+    if text is None:
+        return ""
+    text = _DIACRITICS.sub("", str(text))
+    for variant, letter in _FOLDING:
+        text = text.replace(variant, letter)
+    return text.lower()
+
+
+def match_expression(words, prefix=False) -> str:
+    """FTS5 query matching every word; with prefix, the last one as a prefix."""
+    terms = [f'"{word}"' for word in words]
+    if prefix:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+_INDEXED_QUESTION_SQL = """
+    SELECT id, question_text, option_a, option_b, option_c, option_d, explanation
+    FROM active_questions
+"""
+
+
+def _index_questions(conn, questions):
+    conn.executemany(
+        "INSERT INTO question_search (rowid, question_text, options, explanation) VALUES (?, ?, ?, ?)",
+        (
+            (
+                question_id,
+                normalize_arabic(question_text),
+                normalize_arabic(" ".join(str(option) for option in options)),
+                normalize_arabic(explanation),
+            )
+            for question_id, question_text, *options, explanation in questions
+        ),
+    )
+
+
+def reindex_questions(conn, question_ids):
+    """Re-indexes some questions after an import changed, added or removed them."""
+    if database.backend.name != "sqlite":
+        return
+    question_ids = list(question_ids)
+    for start in range(0, len(question_ids), 500):
+        chunk = question_ids[start : start + 500]
+        placeholders = ", ".join("?" * len(chunk))
+        conn.execute(f"DELETE FROM question_search WHERE rowid IN ({placeholders})", chunk)
+        _index_questions(
+            conn,
+            conn.execute(
+                f"{_INDEXED_QUESTION_SQL} WHERE id IN ({placeholders})", chunk
+            ).fetchall(),
+        )
+
+
+def rebuild_search_index(conn):
+    """Re-indexes every question and passage. Must run inside a transaction.
+
+    The index lives in SQLite FTS5 tables (rowid = questions.id and
+    passages.id), so this is a no-op on other backends.
+    """
+    if database.backend.name != "sqlite":
+        return
+    questions = conn.execute(_INDEXED_QUESTION_SQL).fetchall()
+    conn.execute("DELETE FROM question_search")
+    _index_questions(conn, questions)
+    passages = conn.execute("SELECT id, content FROM passages").fetchall()
+    conn.execute("DELETE FROM passage_search")
+    conn.executemany(
+        "INSERT INTO passage_search (rowid, content) VALUES (?, ?)",
+        ((passage_id, normalize_arabic(content)) for passage_id, content in passages),
+    )
+
+
+def search_questions(query: str, question_type=None, limit: int = SEARCH_RESULTS_LIMIT):
+    """Returns up to limit (id, question_type, main_category_id, subcategory_id, question_text).
+
+    Questions whose own text, options or explanation match come first, best
+    match (bm25) first; questions of matching passages fill the rest. On
+    backends without FTS5 it falls back to a plain LIKE over the question
+    text and explanation.
+    """
+    if database.backend.name != "sqlite":
+        return _search_questions_like(query, question_type, limit)
+    words = _WORD.findall(normalize_arabic(query))
+    if not words:
+        return []
+    # Whole words first. The last word as a prefix only tops the results up:
+    # a prefix query merges the matches of every word it starts.
+    results = []
+    _add_matches(results, match_expression(words), question_type, limit)
+    if len(results) < limit and len(words[-1]) > 1:
+        _add_matches(results, match_expression(words, prefix=True), question_type, limit)
+    return results[:limit]
+
+
+def _add_matches(results, expression, question_type, limit):
+    """Appends the questions matching expression that results does not have yet."""
+    type_filter = "AND q.question_type = ?" if question_type else ""
+    type_params = (question_type,) if question_type else ()
+    candidates = database.get_data(
+        "SELECT rowid FROM question_search WHERE question_search MATCH ? LIMIT ?",
+        (expression, RANK_CANDIDATES),
+    )
+    if len(candidates) == RANK_CANDIDATES:
+        rowid_filter, rowid_params = "AND s.rowid <= ?", (candidates[-1][0],)
+    else:
+        rowid_filter, rowid_params = "", ()
+    found = {row[0] for row in results}
+    for row in database.get_data(
+        f"""
+        SELECT {RESULT_COLUMNS}
+        FROM question_search s JOIN questions q ON q.id = s.rowid
+        WHERE question_search MATCH ? {rowid_filter} {type_filter}
+        ORDER BY s.rank LIMIT ?
+        """,
+        (expression, *rowid_params, *type_params, limit),
+    ):
+        if row[0] not in found:
+            results.append(row)
+            found.add(row[0])
+    if len(results) >= limit:
+        return
+    for row in database.get_data(
+        f"""
+        SELECT {RESULT_COLUMNS}
+        FROM passage_search s
+        JOIN passages p ON p.id = s.rowid
+        JOIN active_questions q ON q.passage_name = p.name
+        WHERE passage_search MATCH ? {type_filter}
+        ORDER BY s.rank, q.id LIMIT ?
+        """,
+        (expression, *type_params, limit),
+    ):
+        if row[0] not in found:
+            results.append(row)
+            found.add(row[0])
+
+
+def _search_questions_like(query, question_type, limit):
+    pattern = f"%{query.strip()}%"
+    if question_type:
+        return database.get_data(
+            f"""
+            SELECT {RESULT_COLUMNS} FROM active_questions q
+            WHERE (question_text LIKE ? OR explanation LIKE ?) AND question_type = ?
+            ORDER BY id LIMIT ?
+            """,
+            (pattern, pattern, question_type, limit),
+        )
+    return database.get_data(
+        f"""
+        SELECT {RESULT_COLUMNS} FROM active_questions q
+        WHERE question_text LIKE ? OR explanation LIKE ?
+        ORDER BY id LIMIT ?
+        """,
+        (pattern, pattern, limit),
+    )
@@ -0,0 +1,195 @@
+import re
+
+import numpy as np
+from scipy import sparse
+
+from config import SIMILAR_QUESTIONS_PER_QUESTION
+from utils import database
+from utils.question_search import RESULT_COLUMNS, normalize_arabic
+
+_WORD = re.compile(r"\w+")
+
+# Words in more than this share of a type's questions say nothing about
+# which questions are alike, and would make every pair of questions overlap.
+MAX_DOCUMENT_FREQUENCY = 0.5
+
+# Candidates are found through the QUERY_TERMS highest weighted words of a
+# question (its rarest ones), then ranked by their exact cosine. Matching on
+# every word would make the product nearly dense: most pairs share a word.
+QUERY_TERMS = 24
+CANDIDATES_PER_NEIGHBOUR = 10
+
+# Entries of the candidate product computed at once; bounds a build's memory.
+SIMILARITY_CHUNK_ENTRIES = 20_000_000
+
+SIMILAR_QUESTIONS_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS question_similar (
+        question_id INTEGER NOT NULL,
+        rank INTEGER NOT NULL,
+        similar_id INTEGER NOT NULL,
+        score REAL NOT NULL,
+        PRIMARY KEY (question_id, rank)
+    )
+    """,
+]
+
+
+def _terms(text) -> list:
+    return [word for word in _WORD.findall(normalize_arabic(text)) if len(word) > 1]
+
+
+def tfidf_matrix(texts):
+    """Returns the L2-normalized TF-IDF rows of texts as a CSR matrix.
+
+    Term frequency is sublinear (1 + log count) and idf smoothed. Words of
+    a single text or of more than MAX_DOCUMENT_FREQUENCY of them are left
+    out, as neither can tell which texts are alike.
+    """
+    vocabulary = {}
+    indptr, indices, counts = [0], [], []
+    for text in texts:
+        row = {}
+        for term in _terms(text):
+            column = vocabulary.setdefault(term, len(vocabulary))
+            row[column] = row.get(column, 0) + 1
+        indices.extend(row)
+        counts.extend(row.values())
+        indptr.append(len(indices))
+    matrix = sparse.csr_matrix(
+        (np.asarray(counts, dtype=np.float32), np.asarray(indices, dtype=np.int32), indptr),
+        shape=(len(indptr) - 1, len(vocabulary)),
+    )
+
+    rows = matrix.shape[0]
+    document_frequency = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    idf = np.log((1 + rows) / (1 + document_frequency)) + 1
+    idf[(document_frequency < 2) | (document_frequency > MAX_DOCUMENT_FREQUENCY * rows)] = 0
+    matrix.data = (1 + np.log(matrix.data)) * idf[matrix.indices].astype(np.float32)
+    matrix.eliminate_zeros()
+
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.csr_matrix(sparse.diags(1 / norms) @ matrix, dtype=np.float32)
+
+
+def _top_terms(matrix, terms):
+    """Keeps only the terms highest weighted entries of each row."""
+    pruned = matrix.copy()
+    for row in range(pruned.shape[0]):
+        begin, end = pruned.indptr[row], pruned.indptr[row + 1]
+        if end - begin > terms:
+            weights = pruned.data[begin:end]
+            weights[np.argpartition(weights, end - begin - terms)[: end - begin - terms]] = 0
+    pruned.eliminate_zeros()
+    return pruned
+
+
+def _top(columns, scores, k):
+    if len(scores) > k:
+        top = np.argpartition(-scores, k)[:k]
+        columns, scores = columns[top], scores[top]
+    order = np.argsort(-scores, kind="stable")
+    return columns[order], scores[order]
+
+
+def nearest_neighbours(matrix, k):
+    """Yields (row, [(other_row, cosine), ...]) with the k most similar other rows.
+
+    Rows without any shared word get no neighbours.
+    """
+    queries = _top_terms(matrix, QUERY_TERMS)
+    transposed = matrix.T.tocsr()
+    chunk_rows = max(1, SIMILARITY_CHUNK_ENTRIES // max(1, matrix.shape[0]))
+    for start in range(0, matrix.shape[0], chunk_rows):
+        product = (queries[start : start + chunk_rows] @ transposed).tocsr()
+        rows, candidates = [], []
+        for offset in range(product.shape[0]):
+            begin, end = product.indptr[offset], product.indptr[offset + 1]
+            columns, _ = _top(
+                product.indices[begin:end],
+                product.data[begin:end],
+                CANDIDATES_PER_NEIGHBOUR * k + 1,
+            )
+            rows.append(np.full(len(columns), start + offset))
+            candidates.append(columns)
+        if not rows:
+            continue
+        rows, candidates = np.concatenate(rows), np.concatenate(candidates)
+        # Exact cosines of the candidate pairs, as the rows are unit length.
+        scores = np.asarray(matrix[rows].multiply(matrix[candidates]).sum(axis=1)).ravel()
+        bounds = np.searchsorted(rows, np.arange(start, start + product.shape[0] + 1))
+        for offset in range(product.shape[0]):
+            row = start + offset
+            begin, end = bounds[offset], bounds[offset + 1]
+            columns, row_scores = candidates[begin:end], scores[begin:end]
+            keep = columns != row
+            columns, row_scores = _top(columns[keep], row_scores[keep], k)
+            yield row, [(int(column), float(score)) for column, score in zip(columns, row_scores)]
+
+
+def build_similar_questions(k: int = SIMILAR_QUESTIONS_PER_QUESTION) -> dict:
+    """Recomputes the k most similar questions of every active question.
+
+    Questions are compared with others of their type by the cosine of the
+    TF-IDF vectors of their normalized text and explanation. Returns the
+    number of questions and stored neighbours.
+    """
+    questions = database.get_data(
+        "SELECT id, question_type, question_text, explanation FROM active_questions ORDER BY id"
+    )
+    by_type = {}
+    for question_id, question_type, question_text, explanation in questions:
+        by_type.setdefault(question_type, []).append((question_id, f"{question_text} {explanation}"))
+
+    neighbours = []
+    for rows in by_type.values():
+        ids = [question_id for question_id, _ in rows]
+        matrix = tfidf_matrix(text for _, text in rows)
+        for row, similar in nearest_neighbours(matrix, k):
+            neighbours.extend(
+                (ids[row], rank, ids[other], round(score, 4))
+                for rank, (other, score) in enumerate(similar)
+            )
+
+    with database.transaction() as conn:
+        conn.execute("DELETE FROM question_similar")
+        conn.executemany(
+            "INSERT INTO question_similar (question_id, rank, similar_id, score) VALUES (?, ?, ?, ?)",
+            neighbours,
+        )
+    return {"questions": len(questions), "neighbours": len(neighbours)}
+
+
+def similar_questions(question_id: int, limit: int = SIMILAR_QUESTIONS_PER_QUESTION):
+    """Returns up to limit search_questions() rows, most similar first.
+
+    A primary key lookup of the neighbours stored by build_similar_questions().
+    """
+    return database.get_data(
+        f"""
+        SELECT {RESULT_COLUMNS}
+        FROM question_similar s JOIN active_questions q ON q.id = s.similar_id
+        WHERE s.question_id = ? ORDER BY s.rank LIMIT ?
+        """,
+        (question_id, limit),
+    )
+
+
+def similar_to_any(question_ids, limit: int = SIMILAR_QUESTIONS_PER_QUESTION):
+    """Questions similar to any of question_ids, taking turns between them.
+
+    The questions themselves are left out, so a student practising their
+    mistakes gets new questions.
+    """
+    lists = [similar_questions(question_id, limit) for question_id in dict.fromkeys(question_ids)]
+    excluded = set(question_ids)
+    results = []
+    for rank in range(max((len(rows) for rows in lists), default=0)):
+        for rows in lists:
+            if rank < len(rows) and rows[rank][0] not in excluded:
+                excluded.add(rows[rank][0])
+                results.append(rows[rank])
+                if len(results) == limit:
+                    return results
+    return results
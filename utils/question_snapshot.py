@@ -0,0 +1,168 @@
+import json
+import os
+import time
+
+import numpy as np
+
+# File layout: MAGIC, the header length as a little-endian uint64, the JSON
+# header, then little-endian int64 arrays starting 8-byte aligned. The
+# header maps each array name to its [offset from the end of the header,
+# length] and indexes the pools and strata of the question bank by
+# (question_type, main_category_id) as slices of them, so opening a
+# snapshot is one read-only mmap and no row is parsed.
+MAGIC = b"QBSNAP1\n"
+_HEADER_START = len(MAGIC) + 8
+_ID_DTYPE = np.dtype("<i8")
+
+
+def _sort_key(key):
+    question_type, main_id = key
+    return (question_type is None, str(question_type), main_id is None, main_id or 0)
+
+
+def write_snapshot(path: str, questions_version: int, pools: dict, strata: dict) -> dict:
+    """Writes a snapshot of the question bank to path and returns its header.
+
+    pools maps (question_type, main_category_id) to question ids and strata
+    maps it to units (lists of ids), as QuestionBank groups them. The file
+    is written next to path and renamed over it, so processes that still map
+    the old snapshot keep reading it until they reopen it.
+    """
+    types = sorted({question_type for question_type, _ in pools}, key=lambda t: (t is None, str(t)))
+    type_codes = {question_type: code for code, question_type in enumerate(types)}
+
+    pool_ids, pool_index = [], []
+    for key in sorted(pools, key=_sort_key):
+        pool_index.append([type_codes[key[0]], key[1], len(pool_ids), len(pool_ids) + len(pools[key])])
+        pool_ids.extend(pools[key])
+    unit_ids, unit_bounds, strata_index = [], [0], []
+    for key in sorted(strata, key=_sort_key):
+        first_unit = len(unit_bounds) - 1
+        for unit in strata[key]:
+            unit_ids.extend(unit)
+            unit_bounds.append(len(unit_ids))
+        strata_index.append([type_codes[key[0]], key[1], first_unit, len(unit_bounds) - 1])
+
+    arrays = {
+        "pool_ids": np.asarray(pool_ids, dtype=_ID_DTYPE),
+        "unit_ids": np.asarray(unit_ids, dtype=_ID_DTYPE),
+        "unit_bounds": np.asarray(unit_bounds, dtype=_ID_DTYPE),
+    }
+    header = {
+        "questions_version": questions_version,
+        "built_at": int(time.time()),
+        "count": len(pool_ids),
+        "types": types,
+        "pools": pool_index,
+        "strata": strata_index,
+        "arrays": {},
+    }
+    offset = 0
+    for name, values in arrays.items():
+        header["arrays"][name] = [offset, len(values)]
+        offset += values.nbytes
+    header_bytes = json.dumps(header).encode("utf-8")
+    # Pad the header with spaces so the arrays start 8-byte aligned.
+    data_start = _aligned(_HEADER_START + len(header_bytes))
+    header_bytes = header_bytes.ljust(data_start - _HEADER_START)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(MAGIC)
+        file.write(np.uint64(len(header_bytes)).astype("<u8").tobytes())
+        file.write(header_bytes)
+        for values in arrays.values():
+            file.write(values.tobytes())
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    return header
+
+
+def _aligned(offset: int) -> int:
+    return (offset + 7) // 8 * 8
+
+
+class UnitList:
+    """The sampling units of a category, read from the snapshot on access.
+
+    Behaves like the list of tuples QuestionBank builds: len() and
+    indexing, each unit being a tuple of question ids.
+    """
+
+    __slots__ = ("ids", "bounds", "start", "stop")
+
+    def __init__(self, ids, bounds, start, stop):
+        self.ids = ids
+        self.bounds = bounds
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("unit index out of range")
+        begin = self.bounds[self.start + index]
+        end = self.bounds[self.start + index + 1]
+        return tuple(self.ids[begin:end].tolist())
+
+
+class QuestionSnapshot:
+    """A snapshot file mapped read-only; its arrays are views of the mapping.
+
+    Every process that opens the same file shares its pages through the
+    page cache instead of holding its own copy of the bank.
+    """
+
+    def __init__(self, path: str):
+        buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        if bytes(buffer[: len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a question bank snapshot")
+        header_length = int(buffer[len(MAGIC) : _HEADER_START].view("<u8")[0])
+        data_start = _HEADER_START + header_length
+        self.header = json.loads(bytes(buffer[_HEADER_START:data_start]))
+        self.questions_version = self.header["questions_version"]
+
+        arrays = {
+            name: buffer[
+                data_start + offset : data_start + offset + length * _ID_DTYPE.itemsize
+            ].view(_ID_DTYPE)
+            for name, (offset, length) in self.header["arrays"].items()
+        }
+        types = self.header["types"]
+        pool_ids = arrays["pool_ids"]
+        self.all_ids = pool_ids
+        self.pools = {
+            (types[code], main_id): pool_ids[start:stop]
+            for code, main_id, start, stop in self.header["pools"]
+        }
+        # Pools and strata are sorted by type first, so a type is one slice.
+        type_ranges, unit_ranges = {}, {}
+        for code, _, start, stop in self.header["pools"]:
+            low, high = type_ranges.get(code, (start, stop))
+            type_ranges[code] = (min(low, start), max(high, stop))
+        self.pools_by_type = {
+            types[code]: pool_ids[start:stop] for code, (start, stop) in type_ranges.items()
+        }
+        unit_ids, unit_bounds = arrays["unit_ids"], arrays["unit_bounds"]
+        self.strata = {}
+        for code, main_id, first, last in self.header["strata"]:
+            self.strata[(types[code], main_id)] = UnitList(unit_ids, unit_bounds, first, last)
+            low, high = unit_ranges.get(code, (first, last))
+            unit_ranges[code] = (min(low, first), max(high, last))
+        self.units_by_type = {
+            types[code]: UnitList(unit_ids, unit_bounds, first, last)
+            for code, (first, last) in unit_ranges.items()
+        }
+
+
+def load_snapshot(path: str):
+    """Opens the snapshot at path, or returns None if there is none."""
+    if not os.path.exists(path):
+        return None
+    return QuestionSnapshot(path)
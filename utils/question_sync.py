@@ -0,0 +1,192 @@
+import difflib
+import hashlib
+
+from utils.timestamps import now_epoch
+
+# Columns of questions an import sets, in the order of the rows it passes.
+QUESTION_COLUMNS = (
+    "correct_answer",
+    "question_text",
+    "option_a",
+    "option_b",
+    "option_c",
+    "option_d",
+    "explanation",
+    "main_category_id",
+    "question_type",
+    "image_path",
+    "passage_name",
+)
+
+# A changed row keeps the id of the old row in its place when their
+# question texts are at least this similar; otherwise the old question is
+# removed and the row added as a new one.
+SIMILARITY_TO_KEEP_ID = 0.5
+
+QUESTION_SOURCES_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS question_sources (
+        question_id INTEGER PRIMARY KEY REFERENCES questions(id),
+        source TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        content_hash TEXT NOT NULL,
+        deleted_at INTEGER
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_question_sources_source ON question_sources(source, position)",
+    # Questions removed from their workbook stay in questions (answers refer
+    # to them) but are no longer served.
+    """
+    CREATE VIEW IF NOT EXISTS active_questions AS
+    SELECT q.* FROM questions q
+    WHERE NOT EXISTS (
+        SELECT 1 FROM question_sources s
+        WHERE s.question_id = q.id AND s.deleted_at IS NOT NULL
+    )
+    """,
+]
+
+
+def row_hash(row) -> str:
+    """Hash of the QUESTION_COLUMNS values of a row."""
+    return hashlib.sha256("\x1f".join(str(value) for value in row).encode("utf-8")).hexdigest()
+
+
+def _similar(old_text, new_text) -> bool:
+    matcher = difflib.SequenceMatcher(None, str(old_text), str(new_text), autojunk=False)
+    return matcher.ratio() >= SIMILARITY_TO_KEEP_ID
+
+
+def sync_questions(conn, source: str, rows) -> dict:
+    """Makes the questions of a source match rows (tuples of QUESTION_COLUMNS).
+
+    The hashes of the rows are diffed against the stored ones of the
+    source: unchanged rows are left alone, an edited row updates the
+    question in its place (keeping its id, and so its answers), new rows
+    are inserted, and questions whose row is gone are soft-deleted. A
+    removed row that comes back gets its old id again. Must run inside a
+    transaction. Returns the counts of each change and the changed ids.
+    """
+    rows = list(rows)
+    hashes = [row_hash(row) for row in rows]
+    current = conn.execute(
+        """
+        SELECT question_id, content_hash, position FROM question_sources
+        WHERE source = ? AND deleted_at IS NULL ORDER BY position, question_id
+        """,
+        (source,),
+    ).fetchall()
+    old_ids = [question_id for question_id, _, _ in current]
+    old_positions = {question_id: position for question_id, _, position in current}
+    removed = {}
+    for question_id, content_hash in conn.execute(
+        "SELECT question_id, content_hash FROM question_sources WHERE source = ? AND deleted_at IS NOT NULL",
+        (source,),
+    ):
+        removed.setdefault(content_hash, []).append(question_id)
+
+    positions = {}
+    updated, inserted, deleted = [], [], []
+    matcher = difflib.SequenceMatcher(
+        None, [content_hash for _, content_hash, _ in current], hashes, autojunk=False
+    )
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            positions.update(zip(old_ids[i1:i2], range(j1, j2)))
+            continue
+        kept = 0
+        if tag == "replace":
+            old_texts = _question_texts(conn, old_ids[i1:i2])
+            # Pair edited rows with the old ones in their place while they match.
+            while (
+                kept < min(i2 - i1, j2 - j1)
+                and _similar(old_texts.get(old_ids[i1 + kept]), rows[j1 + kept][1])
+            ):
+                updated.append((old_ids[i1 + kept], j1 + kept))
+                kept += 1
+        deleted.extend(old_ids[i1 + kept : i2])
+        inserted.extend(range(j1 + kept, j2))
+
+    for question_id, index in updated:
+        conn.execute(
+            f"UPDATE questions SET {', '.join(f'{column} = ?' for column in QUESTION_COLUMNS)} WHERE id = ?",
+            (*rows[index], question_id),
+        )
+        conn.execute(
+            "UPDATE question_sources SET content_hash = ?, position = ? WHERE question_id = ?",
+            (hashes[index], index, question_id),
+        )
+    conn.executemany(
+        "UPDATE question_sources SET deleted_at = ? WHERE question_id = ?",
+        [(now_epoch(), question_id) for question_id in deleted],
+    )
+    revived, added = [], []
+    for index in inserted:
+        if removed.get(hashes[index]):
+            question_id = removed[hashes[index]].pop()
+            conn.execute(
+                "UPDATE question_sources SET deleted_at = NULL, position = ? WHERE question_id = ?",
+                (index, question_id),
+            )
+            revived.append(question_id)
+            continue
+        cursor = conn.execute(
+            f"INSERT INTO questions ({', '.join(QUESTION_COLUMNS)}) VALUES ({', '.join('?' * len(QUESTION_COLUMNS))})",
+            rows[index],
+        )
+        conn.execute(
+            "INSERT INTO question_sources (question_id, source, position, content_hash) VALUES (?, ?, ?, ?)",
+            (cursor.lastrowid, source, index, hashes[index]),
+        )
+        added.append(cursor.lastrowid)
+    conn.executemany(
+        "UPDATE question_sources SET position = ? WHERE question_id = ?",
+        [
+            (index, question_id)
+            for question_id, index in positions.items()
+            if old_positions[question_id] != index
+        ],
+    )
+
+    return {
+        "unchanged": len(positions),
+        "updated": len(updated),
+        "inserted": len(added),
+        "revived": len(revived),
+        "deleted": len(deleted),
+        "changed_ids": [question_id for question_id, _ in updated] + added + revived + deleted,
+    }
+
+
+def _question_texts(conn, question_ids) -> dict:
+    texts = {}
+    for start in range(0, len(question_ids), 500):
+        chunk = question_ids[start : start + 500]
+        texts.update(
+            conn.execute(
+                f"SELECT id, question_text FROM questions WHERE id IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            ).fetchall()
+        )
+    return texts
+
+
+def backfill_question_sources(conn):
+    """Records the questions imported before syncing existed, one source per type."""
+    positions = {}
+    sources = []
+    for question_id, *row in conn.execute(
+        f"""
+        SELECT id, {', '.join(QUESTION_COLUMNS)} FROM questions
+        WHERE id NOT IN (SELECT question_id FROM question_sources)
+        ORDER BY id
+        """
+    ).fetchall():
+        source = row[QUESTION_COLUMNS.index("question_type")] or "quantitative"
+        position = positions.get(source, 0)
+        positions[source] = position + 1
+        sources.append((question_id, source, position, row_hash(row)))
+    conn.executemany(
+        "INSERT INTO question_sources (question_id, source, position, content_hash) VALUES (?, ?, ?, ?)",
+        sources,
+    )
@@ -0,0 +1,184 @@
+import asyncio
+import gzip
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+from config import (
+    DATABASE_BUSY_TIMEOUT_SECONDS,
+    SNAPSHOT_DIRECTORY,
+    SNAPSHOT_KEEP_DAILY,
+    SNAPSHOT_KEEP_LAST,
+    SNAPSHOT_KEEP_WEEKLY,
+    SNAPSHOT_PAGES_PER_STEP,
+    SNAPSHOT_STEP_SLEEP_MS,
+)
+from utils.database import DATABASE_FILES
+
+logger = logging.getLogger(__name__)
+
+# A snapshot copies every file in DATABASE_FILES; the files of one snapshot
+# share its timestamp: <name>-<YYYYmmdd-HHMMSS>.db.gz
+SNAPSHOT_SUFFIX = ".db.gz"
+_SNAPSHOT_NAME = re.compile(r"^(\w+)-(\d{8}-\d{6})\.db\.gz$")
+_SNAPSHOT_TIME_FORMAT = "%Y%m%d-%H%M%S"
+
+# A write by the bot between two steps makes SQLite restart the copy. After
+# this many restarts the rest is copied in one step, which in WAL mode only
+# holds a read snapshot and still does not block writers.
+MAX_BACKUP_RESTARTS = 3
+
+
+class _BackupRestarted(Exception):
+    pass
+
+
+def _copy_database(
+    database_file: str, destination: str, pages: int, sleep_ms: float
+) -> int:
+    """Copies database_file into destination with the online backup API.
+
+    Returns the number of steps taken.
+    """
+    source = sqlite3.connect(database_file, timeout=DATABASE_BUSY_TIMEOUT_SECONDS)
+    target = sqlite3.connect(destination)
+    state = {"steps": 0, "remaining": None, "restarts": 0}
+
+    def progress(status, remaining, total):
+        state["steps"] += 1
+        if state["remaining"] is not None and remaining > state["remaining"]:
+            state["restarts"] += 1
+            if state["restarts"] > MAX_BACKUP_RESTARTS:
+                raise _BackupRestarted()
+        state["remaining"] = remaining
+        # Let the bot's queries run between steps.
+        time.sleep(sleep_ms / 1000)
+
+    try:
+        try:
+            source.backup(target, pages=pages, progress=progress)
+        except _BackupRestarted:
+            logger.info("Database changed during the snapshot, copying it in one step")
+            source.backup(target)
+            state["steps"] += 1
+        result = target.execute("PRAGMA quick_check").fetchone()[0]
+        if result != "ok":
+            raise sqlite3.DatabaseError(f"Snapshot failed quick_check: {result}")
+    finally:
+        target.close()
+        source.close()
+    return state["steps"]
+
+
+def _compress(source: str, destination: str):
+    temp_path = f"{destination}.tmp"
+    with open(source, "rb") as f_in, gzip.open(temp_path, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+    os.replace(temp_path, destination)
+
+
+def create_snapshot(
+    directory: str = SNAPSHOT_DIRECTORY,
+    pages: int = SNAPSHOT_PAGES_PER_STEP,
+    sleep_ms: float = SNAPSHOT_STEP_SLEEP_MS,
+) -> list:
+    """Writes gzip-compressed, consistent copies of the database files.
+
+    Each copy is taken with SQLite's online backup API a few pages at a time,
+    so the bot keeps reading and writing while it runs. Returns the paths.
+    """
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.now().strftime(_SNAPSHOT_TIME_FORMAT)
+    paths = []
+    for label, database_file in DATABASE_FILES.items():
+        if not os.path.exists(database_file):
+            continue
+        started = time.perf_counter()
+        name = f"{label}-{stamp}"
+        raw_path = os.path.join(directory, f"{name}.db.partial")
+        snapshot_path = os.path.join(directory, f"{name}{SNAPSHOT_SUFFIX}")
+        try:
+            steps = _copy_database(database_file, raw_path, pages, sleep_ms)
+            _compress(raw_path, snapshot_path)
+        finally:
+            if os.path.exists(raw_path):
+                os.remove(raw_path)
+        logger.info(
+            f"Database snapshot {snapshot_path} written in {steps} steps "
+            f"({os.path.getsize(snapshot_path) / 1024:.0f} KiB, "
+            f"{time.perf_counter() - started:.1f}s)"
+        )
+        paths.append(snapshot_path)
+    return paths
+
+
+def list_snapshots(directory: str = SNAPSHOT_DIRECTORY) -> list:
+    """Returns [(taken_at, paths)] of the snapshots in directory, newest first."""
+    if not os.path.isdir(directory):
+        return []
+    snapshots = {}
+    for file_name in os.listdir(directory):
+        match = _SNAPSHOT_NAME.match(file_name)
+        if match and match.group(1) in DATABASE_FILES:
+            taken_at = datetime.strptime(match.group(2), _SNAPSHOT_TIME_FORMAT)
+            snapshots.setdefault(taken_at, []).append(os.path.join(directory, file_name))
+    return sorted(
+        ((taken_at, sorted(paths)) for taken_at, paths in snapshots.items()),
+        reverse=True,
+    )
+
+
+def select_snapshots_to_keep(
+    snapshots: list,
+    keep_last: int = SNAPSHOT_KEEP_LAST,
+    keep_daily: int = SNAPSHOT_KEEP_DAILY,
+    keep_weekly: int = SNAPSHOT_KEEP_WEEKLY,
+) -> set:
+    """Returns the times retained from [(taken_at, paths)] (newest first).
+
+    Keeps the newest keep_last snapshots, plus the newest snapshot of each of
+    the keep_daily most recent days and keep_weekly most recent weeks.
+    """
+    keep = {taken_at for taken_at, _ in snapshots[:keep_last]}
+    for period_of, limit in (
+        (lambda taken_at: taken_at.date(), keep_daily),
+        (lambda taken_at: taken_at.isocalendar()[:2], keep_weekly),
+    ):
+        periods = set()
+        for taken_at, _ in snapshots:
+            period = period_of(taken_at)
+            if period in periods:
+                continue
+            if len(periods) >= limit:
+                break
+            periods.add(period)
+            keep.add(taken_at)
+    return keep
+
+
+def prune_snapshots(directory: str = SNAPSHOT_DIRECTORY, **retention) -> list:
+    """Deletes snapshots outside the retention rules and returns their paths."""
+    snapshots = list_snapshots(directory)
+    keep = select_snapshots_to_keep(snapshots, **retention)
+    removed = []
+    for taken_at, paths in snapshots:
+        if taken_at not in keep:
+            for path in paths:
+                os.remove(path)
+                removed.append(path)
+    if removed:
+        logger.info(f"Removed {len(removed)} old database snapshots")
+    return removed
+
+
+async def snapshot_job(context):
+    """Periodic job: writes a snapshot and applies the retention rules."""
+    try:
+        await asyncio.to_thread(create_snapshot)
+        await asyncio.to_thread(prune_snapshots)
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"Database snapshot failed: {e}")
@@ -0,0 +1,388 @@
+import logging
+import re
+import sqlite3
+import threading
+
+from config import (
+    CHAT_DATABASE_FILE,
+    DATABASE_BACKEND,
+    DATABASE_BUSY_TIMEOUT_SECONDS,
+    DATABASE_JOURNAL_MODE,
+    DATABASE_STATEMENT_CACHE_SIZE,
+    DATABASE_URL,
+    USAGE_DATABASE_FILE,
+)
+
+logger = logging.getLogger(__name__)
+
+# Schema name -> file of the databases attached to the main one. On
+# PostgreSQL these are schemas of the same database instead.
+ATTACHED_DATABASES = {
+    "chat": CHAT_DATABASE_FILE,
+    "usage": USAGE_DATABASE_FILE,
+}
+
+
+def attach_databases(conn: sqlite3.Connection):
+    """Attaches the high-churn databases to conn (outside a transaction)."""
+    attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+    for schema, database_file in ATTACHED_DATABASES.items():
+        if schema in attached:
+            continue
+        conn.execute(f"ATTACH DATABASE ? AS {schema}", (database_file,))
+        # Only takes effect while the file is still empty (see create_tables).
+        conn.execute(f"PRAGMA {schema}.auto_vacuum = INCREMENTAL")
+        if DATABASE_JOURNAL_MODE:
+            conn.execute(f"PRAGMA {schema}.journal_mode={DATABASE_JOURNAL_MODE}")
+
+
+# ----------------
+# Backends
+#
+# A backend opens connections that behave like sqlite3 connections: the
+# query helpers, the writers and the migrations only use execute(),
+# executemany(), cursor(), commit(), rollback(), in_transaction and close(),
+# and keep writing SQLite-flavoured SQL with "?" placeholders.
+
+
+class SQLiteBackend:
+    """The default backend: one SQLite file per database, attached together."""
+
+    name = "sqlite"
+
+    def connect(self, database_file: str, attach: bool = False) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            database_file,
+            timeout=DATABASE_BUSY_TIMEOUT_SECONDS,
+            cached_statements=DATABASE_STATEMENT_CACHE_SIZE,
+            # Connections never leave their thread; this only lets
+            # close_all() release them from the main thread at shutdown.
+            check_same_thread=False,
+        )
+        if DATABASE_JOURNAL_MODE:
+            conn.execute(f"PRAGMA journal_mode={DATABASE_JOURNAL_MODE}")
+        if attach:
+            attach_databases(conn)
+        return conn
+
+
+# ----------------
+# SQL translation for PostgreSQL
+
+_STRING_LITERAL = re.compile(r"('(?:[^']|'')*')")
+_BEGIN = re.compile(r"^\s*BEGIN(\s+(DEFERRED|IMMEDIATE|EXCLUSIVE))?(\s+TRANSACTION)?\s*;?\s*$", re.I)
+_END = re.compile(r"^\s*(COMMIT|END|ROLLBACK)\b", re.I)
+_INSERT_OR_IGNORE = re.compile(r"^\s*INSERT\s+OR\s+IGNORE\s+INTO\b", re.I)
+_INSERT_OR_REPLACE = re.compile(r"^\s*INSERT\s+OR\s+REPLACE\b", re.I)
+_INSERT_TABLE = re.compile(r"^\s*INSERT\s+(?:OR\s+IGNORE\s+)?INTO\s+(?:\w+\.)?(\w+)", re.I)
+_VALUES = re.compile(r"\bVALUES\b", re.I)
+_CREATE_TABLE = re.compile(r"^\s*CREATE\s+TABLE\b", re.I)
+_CREATE_VIEW = re.compile(r"^\s*CREATE\s+VIEW\s+IF\s+NOT\s+EXISTS\b", re.I)
+_QUALIFIED_INDEX = re.compile(
+    r"^(\s*CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?)(\w+)\.(\w+)(\s+ON\s+)(\w+)",
+    re.I,
+)
+# Foreign keys are dropped: the bot never turns on PRAGMA foreign_keys, so
+# existing data need not satisfy them (e.g. passage_name "-").
+_ON_ACTION = r"(\s+ON\s+(DELETE|UPDATE)\s+(SET\s+NULL|SET\s+DEFAULT|NO\s+ACTION|CASCADE|RESTRICT))*"
+_FOREIGN_KEY = re.compile(
+    rf",\s*FOREIGN\s+KEY\s*\([^)]*\)\s*REFERENCES\s+\w+\s*\([^)]*\){_ON_ACTION}",
+    re.I,
+)
+_INLINE_REFERENCES = re.compile(rf"\s+REFERENCES\s+\w+\s*\([^)]*\){_ON_ACTION}", re.I)
+# SQLite column types -> PostgreSQL. Booleans stay integers, as in SQLite.
+_DDL_TYPES = [
+    (re.compile(r"\bid\s+INTEGER\s+PRIMARY\s+KEY(\s+AUTOINCREMENT)?", re.I),
+     "id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY"),
+    (re.compile(r"\bINTEGER\b", re.I), "BIGINT"),
+    (re.compile(r"\bBOOLEAN\s+DEFAULT\s+TRUE\b", re.I), "BIGINT DEFAULT 1"),
+    (re.compile(r"\bBOOLEAN\s+DEFAULT\s+FALSE\b", re.I), "BIGINT DEFAULT 0"),
+    (re.compile(r"\bBOOLEAN\b", re.I), "BIGINT"),
+    (re.compile(r"\bDATETIME\b", re.I), "TIMESTAMP"),
+    (re.compile(r"\bREAL\b", re.I), "DOUBLE PRECISION"),
+]
+
+
+def _outside_literals(query: str, replace) -> str:
+    """Applies replace() to the parts of query that are not string literals."""
+    parts = _STRING_LITERAL.split(query)
+    return "".join(
+        part if index % 2 else replace(part) for index, part in enumerate(parts)
+    )
+
+
+def translate_sql(query: str) -> str:
+    """Rewrites a SQLite statement as the equivalent PostgreSQL statement.
+
+    Covers what the bot uses: "?" placeholders, BEGIN IMMEDIATE,
+    INSERT OR IGNORE, EXPLAIN QUERY PLAN and the DDL of create_tables()
+    and the migrations. RANDOM(), COALESCE, ON CONFLICT upserts and the
+    aggregate queries are already valid PostgreSQL.
+    """
+    if _BEGIN.match(query):
+        return "BEGIN"
+    if _INSERT_OR_REPLACE.match(query):
+        raise sqlite3.NotSupportedError("INSERT OR REPLACE needs an explicit ON CONFLICT target")
+    if query.lstrip().upper().startswith("PRAGMA"):
+        raise sqlite3.NotSupportedError(f"PRAGMA is SQLite only: {query.strip()}")
+
+    if _INSERT_OR_IGNORE.match(query):
+        query = _INSERT_OR_IGNORE.sub("INSERT INTO", query, count=1)
+        query = f"{query.rstrip().rstrip(';')} ON CONFLICT DO NOTHING"
+    if _CREATE_TABLE.match(query):
+        query = _FOREIGN_KEY.sub("", query)
+        query = _INLINE_REFERENCES.sub("", query)
+        for pattern, replacement in _DDL_TYPES:
+            query = pattern.sub(replacement, query)
+    query = _CREATE_VIEW.sub("CREATE OR REPLACE VIEW", query, count=1)
+    # PostgreSQL indexes live in their table's schema.
+    query = _QUALIFIED_INDEX.sub(r"\1\3\4\2.\5", query, count=1)
+    query = re.sub(r"^\s*EXPLAIN\s+QUERY\s+PLAN\b", "EXPLAIN", query, count=1, flags=re.I)
+
+    # psycopg uses %s placeholders, so percent signs are doubled, string
+    # literals included (psycopg parses those too).
+    return _outside_literals(query.replace("%", "%%"), lambda part: part.replace("?", "%s"))
+
+
+def _is_write(query: str) -> bool:
+    return query.lstrip()[:7].upper().startswith(("INSERT", "UPDATE", "DELETE", "REPLACE"))
+
+
+# ----------------
+# PostgreSQL connection adapter
+
+
+def _translate_error(error) -> sqlite3.Error:
+    """Maps a psycopg error onto the sqlite3 class the callers already catch."""
+    import psycopg.errors
+
+    message = str(error).strip()
+    if isinstance(
+        error,
+        (
+            psycopg.errors.SerializationFailure,
+            psycopg.errors.DeadlockDetected,
+            psycopg.errors.LockNotAvailable,
+        ),
+    ):
+        # DatabaseWriter retries errors that mention "busy".
+        return sqlite3.OperationalError(f"database is busy: {message}")
+    if isinstance(error, psycopg.IntegrityError):
+        return sqlite3.IntegrityError(message)
+    if isinstance(error, psycopg.ProgrammingError):
+        return sqlite3.ProgrammingError(message)
+    if isinstance(error, psycopg.NotSupportedError):
+        return sqlite3.NotSupportedError(message)
+    return sqlite3.OperationalError(message)
+
+
+def _adapt_params(params):
+    # SQLite stores booleans as 0/1, and so do the translated tables.
+    return tuple(int(value) if isinstance(value, bool) else value for value in params or ())
+
+
+class PostgresCursor:
+    """sqlite3.Cursor look-alike on top of a psycopg cursor."""
+
+    def __init__(self, connection: "PostgresConnection"):
+        self.connection = connection
+        self._cursor = connection.raw.cursor()
+        self.lastrowid = None
+
+    def execute(self, query, params=None):
+        import psycopg
+
+        statement = translate_sql(query)
+        returning_id = False
+        table = _INSERT_TABLE.match(query)
+        if (
+            table
+            and table.group(1) in self.connection.tables_with_id()
+            and _VALUES.search(statement)
+            and "RETURNING" not in statement.upper()
+        ):
+            # Emulates cursor.lastrowid for single-row inserts.
+            statement = f"{statement.rstrip().rstrip(';')} RETURNING id"
+            returning_id = True
+        self.connection.begin_if_needed(query)
+        try:
+            self._cursor.execute(statement, _adapt_params(params))
+        except psycopg.Error as e:
+            raise _translate_error(e) from e
+        if _CREATE_TABLE.match(query):
+            self.connection.schema_changed()
+        elif _END.match(query):
+            self.connection.transaction_ended()
+        if returning_id:
+            row = self._cursor.fetchone()
+            self.lastrowid = row[0] if row else None
+        return self
+
+    def executemany(self, query, seq_of_params):
+        import psycopg
+
+        self.connection.begin_if_needed(query)
+        try:
+            self._cursor.executemany(
+                translate_sql(query), [_adapt_params(params) for params in seq_of_params]
+            )
+        except psycopg.Error as e:
+            raise _translate_error(e) from e
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone() if self._cursor.description else None
+
+    def fetchall(self):
+        return self._cursor.fetchall() if self._cursor.description else []
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+
+class PostgresConnection:
+    """sqlite3.Connection look-alike on top of a psycopg connection.
+
+    The connection runs in autocommit mode and, like sqlite3, opens a
+    transaction implicitly before the first INSERT/UPDATE/DELETE; commit()
+    and rollback() end it. Explicit BEGIN/COMMIT/ROLLBACK work as well.
+    """
+
+    def __init__(self, raw, backend: "PostgresBackend"):
+        self.raw = raw
+        self.backend = backend
+        self._created_tables = False
+
+    def tables_with_id(self) -> set:
+        """The tables with an identity id, as currently known to the backend."""
+        return self.backend.tables_with_id(self.raw)
+
+    def schema_changed(self):
+        """Called after this connection created a table."""
+        self.backend.refresh_tables_with_id()
+        # Other connections only see the table once the transaction commits;
+        # a list they loaded before then is dropped again at commit().
+        self._created_tables = self.in_transaction
+
+    def transaction_ended(self):
+        if self._created_tables:
+            self._created_tables = False
+            self.backend.refresh_tables_with_id()
+
+    @property
+    def in_transaction(self) -> bool:
+        from psycopg.pq import TransactionStatus
+
+        return self.raw.info.transaction_status != TransactionStatus.IDLE
+
+    def begin_if_needed(self, query: str):
+        if _is_write(query) and not self.in_transaction:
+            self.raw.execute("BEGIN")
+
+    def cursor(self) -> PostgresCursor:
+        return PostgresCursor(self)
+
+    def execute(self, query, params=None) -> PostgresCursor:
+        return self.cursor().execute(query, params)
+
+    def executemany(self, query, seq_of_params) -> PostgresCursor:
+        return self.cursor().executemany(query, seq_of_params)
+
+    def commit(self):
+        if self.in_transaction:
+            self.raw.execute("COMMIT")
+        self.transaction_ended()
+
+    def rollback(self):
+        if self.in_transaction:
+            self.raw.execute("ROLLBACK")
+        self.transaction_ended()
+
+    def close(self):
+        self.raw.close()
+
+
+class PostgresBackend:
+    """Runs every database of the bot in one PostgreSQL database.
+
+    The attached SQLite files become schemas (chat, usage) on the
+    connection's search_path, so bare table names keep resolving. Each
+    thread of the database executor holds its own connection, which makes
+    the executor the connection pool: the blocking psycopg calls run on
+    those threads, like the sqlite3 ones. Needs the optional psycopg
+    package (see requirements-postgres.txt).
+    """
+
+    name = "postgresql"
+
+    def __init__(self, url: str = DATABASE_URL):
+        if not url:
+            raise ValueError("DATABASE_URL must be set when DATABASE_BACKEND is postgresql")
+        self.url = url
+        self._tables_with_id = None
+        self._lock = threading.Lock()
+
+    def _load_tables_with_id(self, raw) -> set:
+        rows = raw.execute(
+            """
+            SELECT table_name FROM information_schema.columns
+            WHERE column_name = 'id' AND (is_identity = 'YES' OR column_default LIKE 'nextval%')
+            """
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    def tables_with_id(self, raw) -> set:
+        """Tables with an identity id, whose inserts report lastrowid.
+
+        Loaded through raw on first use after a refresh, so every
+        connection sees tables created since it was opened.
+        """
+        with self._lock:
+            if self._tables_with_id is None:
+                import psycopg
+
+                try:
+                    self._tables_with_id = self._load_tables_with_id(raw)
+                except psycopg.Error as e:
+                    raise _translate_error(e) from e
+            return self._tables_with_id
+
+    def refresh_tables_with_id(self):
+        """Forgets the cached table list; creating a table calls this."""
+        with self._lock:
+            self._tables_with_id = None
+
+    def connect(self, database_file: str = None, attach: bool = False) -> PostgresConnection:
+        import psycopg
+
+        try:
+            raw = psycopg.connect(self.url, autocommit=True)
+            for schema in ATTACHED_DATABASES:
+                raw.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+            raw.execute(f"SET search_path TO public, {', '.join(ATTACHED_DATABASES)}")
+            raw.execute(
+                f"SET lock_timeout = '{int(DATABASE_BUSY_TIMEOUT_SECONDS * 1000)}ms'"
+            )
+        except psycopg.Error as e:
+            raise _translate_error(e) from e
+        return PostgresConnection(raw, self)
+
+
+def get_backend():
+    """Returns the backend selected by DATABASE_BACKEND."""
+    if DATABASE_BACKEND == "sqlite":
+        return SQLiteBackend()
+    if DATABASE_BACKEND in ("postgresql", "postgres"):
+        return PostgresBackend()
+    raise ValueError(f"Unknown DATABASE_BACKEND: {DATABASE_BACKEND}")
@@ -1,4 +1,3 @@
-from datetime import datetime, timedelta
 import openpyxl
 import random
 import string
@@ -6,6 +5,7 @@ import string
 from telegram import Update
 
 from utils import database
+from utils.timestamps import epoch_after, now_epoch
 
 
 async def handle_subscription_purchase(user_id, plan_details):
@@ -43,7 +43,7 @@ async def activate_free_trial(user_id):
             "UPDATE users SET type_of_last_subscription = ?, subscription_end_time = ? WHERE telegram_id = ?",
             (
                 "تجربة مجانية",
-                (datetime.now() + timedelta(hours=6)).strftime("%Y-%m-%d %H:%M:%S"),
+                epoch_after(hours=6),
                 user_id,
             ),
         )
@@ -62,13 +62,13 @@ async def handle_referral(user_id, referral_code):
 
         # Update referred user's subscription
         database.execute_query(
-            "UPDATE users SET subscription_end_time = CASE WHEN subscription_end_time IS NOT NULL THEN strftime('%Y-%m-%d %H:%M:%S', datetime(subscription_end_time, '+3 days')) ELSE NULL END WHERE telegram_id = ?",
+            "UPDATE users SET subscription_end_time = subscription_end_time + 3 * 86400 WHERE telegram_id = ?",
             (user_id,),
         )
 
         # Update referrer's subscription
         database.execute_query(
-            "UPDATE users SET subscription_end_time = CASE WHEN subscription_end_time IS NOT NULL THEN strftime('%Y-%m-%d %H:%M:%S', datetime(subscription_end_time, '+3 days')) ELSE NULL END, number_of_referrals = number_of_referrals + 1 WHERE telegram_id = ?",
+            "UPDATE users SET subscription_end_time = subscription_end_time + 3 * 86400, number_of_referrals = number_of_referrals + 1 WHERE telegram_id = ?",
             (referrer_id,),
         )
         return True
@@ -97,10 +97,7 @@ async def check_subscription(update: Update, context):
     )
 
     if subscription_data and subscription_data[0][0] is not None:
-        subscription_end_time = datetime.strptime(
-            subscription_data[0][0], "%Y-%m-%d %H:%M:%S"
-        )
-        if subscription_end_time > datetime.now():
+        if subscription_data[0][0] > now_epoch():
             return True  # Subscription is active
         else:
             if update.message:
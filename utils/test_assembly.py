@@ -0,0 +1,130 @@
+import logging
+import os
+import threading
+
+from config import TEST_BLUEPRINT_FILE
+from utils.category_mangement import category_registry
+from utils.question_bank import draw_units, question_bank, seen_questions
+
+logger = logging.getLogger(__name__)
+
+
+class TestBlueprint:
+    """Share of each main category in an assembled test, per question type.
+
+    Read from TEST_BLUEPRINT_FILE, one row per category with the columns
+    question_type, main_category (the category name) and share (any
+    positive weight; they are normalised per type). The file is re-read when
+    it changes; names are resolved to ids on every call, so a category
+    import takes effect without touching the file. Without a file, or for a
+    type it does not list, tests are sampled from the whole bank as before.
+    """
+
+    def __init__(self, blueprint_file: str = TEST_BLUEPRINT_FILE):
+        self.blueprint_file = blueprint_file
+        self._lock = threading.Lock()
+        self._modified_at = None
+        # question_type -> {main category name: share}
+        self.shares = {}
+        self._unknown_names = set()
+
+    def _ensure_fresh(self):
+        try:
+            modified_at = os.path.getmtime(self.blueprint_file)
+        except OSError:
+            self.shares, self._modified_at = {}, None
+            return
+        if modified_at == self._modified_at:
+            return
+        with self._lock:
+            if modified_at != self._modified_at:
+                self._load()
+                self._modified_at = modified_at
+
+    def _load(self):
+        import pandas as pd
+
+        shares = {}
+        try:
+            df = pd.read_excel(
+                self.blueprint_file, usecols=["question_type", "main_category", "share"]
+            )
+        except Exception as e:
+            logger.error(f"Error loading test blueprint: {e}")
+            self.shares = {}
+            return
+        for _, row in df.iterrows():
+            share = float(row["share"])
+            if share > 0:
+                question_type = str(row["question_type"]).strip()
+                name = str(row["main_category"]).strip()
+                shares.setdefault(question_type, {})[name] = share
+        self.shares = shares
+        self._unknown_names = set()
+
+    def shares_for(self, question_type) -> dict:
+        """Returns {main_category_id: share} for a question type.
+
+        A name matches the categories of the type whose names only differ
+        from it in surrounding spaces; its share is split between them by
+        their number of sampling units.
+        """
+        self._ensure_fresh()
+        main_ids_by_name = {}
+        for main_id, name in category_registry.main_categories_for_type(question_type):
+            main_ids_by_name.setdefault(name.strip(), []).append(main_id)
+        shares = {}
+        for name, share in self.shares.get(question_type, {}).items():
+            units = {
+                main_id: len(question_bank.units_of(question_type, main_id))
+                for main_id in main_ids_by_name.get(name, [])
+            }
+            total = sum(units.values())
+            if not total:
+                if (question_type, name) not in self._unknown_names:
+                    self._unknown_names.add((question_type, name))
+                    logger.warning(f"Test blueprint: no {question_type} questions in {name}")
+                continue
+            for main_id, count in units.items():
+                if count:
+                    shares[main_id] = share * count / total
+        return shares
+
+
+test_blueprint = TestBlueprint()
+
+
+def apportion(shares: dict, total: int) -> dict:
+    """Splits total questions by share with the largest-remainder method."""
+    weight = sum(shares.values())
+    exact = {key: total * share / weight for key, share in shares.items()}
+    counts = {key: int(value) for key, value in exact.items()}
+    remainder = total - sum(counts.values())
+    for key in sorted(exact, key=lambda key: exact[key] - counts[key], reverse=True)[:remainder]:
+        counts[key] += 1
+    return counts
+
+
+def assemble_test(question_type, total, user_id=None):
+    """Returns total question ids laid out by the blueprint, or None without one.
+
+    Each main category gets its apportioned number of questions from its
+    precomputed strata; passage groups stay together and in order. A short
+    category is topped up from the rest of the type.
+    """
+    shares = test_blueprint.shares_for(question_type)
+    if not shares:
+        return None
+    seen = seen_questions.get(user_id)
+    question_ids = []
+    for main_id, quota in apportion(shares, total).items():
+        question_ids.extend(
+            draw_units(question_bank.units_of(question_type, main_id), quota, seen)
+        )
+    if len(question_ids) < total:
+        question_ids.extend(
+            question_bank.sample(
+                total - len(question_ids), question_type, user_id, exclude=set(question_ids)
+            )
+        )
+    return question_ids
@@ -0,0 +1,58 @@
+from datetime import date, datetime, timedelta
+
+# Timestamp columns store integer Unix epochs (seconds). These helpers are the
+# only place that converts between them and local datetimes.
+
+
+def now_epoch() -> int:
+    """Returns the current time as an integer epoch."""
+    return int(datetime.now().timestamp())
+
+
+def to_epoch(value):
+    """Converts a datetime, date, epoch or legacy timestamp string to an epoch.
+
+    Legacy strings come in the formats the bot used to write:
+    "%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S" and "%Y-%m-%d".
+    Returns None for empty or unparseable values.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    if isinstance(value, date):
+        return int(datetime(value.year, value.month, value.day).timestamp())
+    text = str(value).strip()
+    if text.lstrip("-").isdigit():
+        return int(text)
+    try:
+        return int(datetime.fromisoformat(text).timestamp())
+    except ValueError:
+        return None
+
+
+def from_epoch(value):
+    """Converts an epoch (or a legacy string) to a local datetime, or None."""
+    epoch = to_epoch(value)
+    return datetime.fromtimestamp(epoch) if epoch is not None else None
+
+
+def epoch_after(value=None, **delta) -> int:
+    """Returns the epoch `delta` (timedelta kwargs) after value (default: now)."""
+    start = from_epoch(value) if value is not None else datetime.now()
+    return int((start + timedelta(**delta)).timestamp())
+
+
+def days_since(value) -> int:
+    """Whole days elapsed since the epoch (like timedelta.days)."""
+    return (now_epoch() - to_epoch(value)) // 86400
+
+
+def is_today(value) -> bool:
+    """True if the epoch falls on today's local date."""
+    moment = from_epoch(value)
+    return moment is not None and moment.date() == date.today()
@@ -3,13 +3,14 @@ import string
 from datetime import datetime, timedelta
 
 from utils import database
+from utils.database_writer import database_writer
 
 
 async def generate_referral_code():
     """Generates a unique 6-character referral code."""
     while True:
         code = "".join(random.choices(string.ascii_uppercase + string.digits, k=6))
-        user_exists = database.get_data(
+        user_exists = await database.db.fetch_all(
             "SELECT 1 FROM users WHERE referral_code = ?", (code,)
         )
         if not user_exists:
@@ -18,7 +19,7 @@ async def generate_referral_code():
 
 async def user_exists(user_id):
     """Checks if a user exists in the database."""
-    user_exists = database.get_data(
+    user_exists = await database.db.fetch_all(
         "SELECT 1 FROM users WHERE telegram_id = ?", (user_id,)
     )
     return True if user_exists else False
@@ -26,7 +27,7 @@ async def user_exists(user_id):
 
 async def user_exists_by_referral_code(referral_code):
     """Checks if a user exists with the given referral code."""
-    user_exists = database.get_data(
+    user_exists = await database.db.fetch_all(
         "SELECT 1 FROM users WHERE referral_code = ?", (referral_code,)
     )
     return True if user_exists else False
@@ -52,7 +53,7 @@ async def save_user_data(user_data, context, user_id):
     """Saves user data to the SQLite database."""
     referral_code = await generate_referral_code()
 
-    database.execute_query(
+    await database.db.execute(
         "INSERT INTO users (start_time, name, class, voice_written, taking_qiyas_before, last_score, referral_code, gender, telegram_username, telegram_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
         (
             datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
@@ -80,7 +81,7 @@ async def update_user_data(user_id, data):
     # Build the SET clause for the UPDATE statement dynamically
     set_clause = ", ".join(f"{key} = ?" for key in data)
 
-    database.execute_query(
+    await database.db.execute(
         f"UPDATE users SET {set_clause} WHERE telegram_id = ?",
         tuple(data.values()) + (user_id,),
     )
@@ -105,10 +106,10 @@ def calculate_points(time_taken, score, total_questions):
     return total_points
 
 
-def update_user_points(user_id, points_earned):
+async def update_user_points(user_id, points_earned):
     """Updates the user's points in the database."""
     # Assuming you have a 'points' column in the 'users' table
-    database.execute_query(
+    await database_writer.write(
         "UPDATE users SET points = points + ? WHERE telegram_id = ?",
         (points_earned, user_id),
     )
@@ -129,14 +130,13 @@ def update_user_percentage_expected(user_id, percentage_expected):
     )
 
 
-def update_user_usage_time(user_id, duration_seconds):
-    """Updates the user's total usage time in the database."""
-    conn = database.create_connection()
-    cursor = conn.cursor()
-
+def _add_usage_time(conn, user_id, duration_seconds):
+    """Adds duration_seconds to the stored HH:MM:SS usage time (writer callable)."""
     # Retrieve current usage time (if any)
-    cursor.execute("SELECT usage_time FROM users WHERE telegram_id = ?", (user_id,))
-    current_usage_time_str = cursor.fetchone()[0]
+    row = conn.execute(
+        "SELECT usage_time FROM users WHERE telegram_id = ?", (user_id,)
+    ).fetchone()
+    current_usage_time_str = row[0] if row else None
 
     # Convert current usage time to seconds (if it exists)
     if current_usage_time_str:
@@ -155,12 +155,17 @@ def update_user_usage_time(user_id, duration_seconds):
     new_total_usage_time_str = "{:02d}:{:02d}:{:02d}".format(hours, minutes, seconds)
 
     # Update usage time in the database
-    cursor.execute(
+    conn.execute(
         "UPDATE users SET usage_time = ? WHERE telegram_id = ?",
         (new_total_usage_time_str, user_id),
     )
-    conn.commit()
-    conn.close()
+
+
+async def update_user_usage_time(user_id, duration_seconds):
+    """Updates the user's total usage time in the database."""
+    # Read and update in the same writer transaction so concurrent
+    # sessions of one user cannot overwrite each other's time.
+    await database_writer.run(_add_usage_time, user_id, duration_seconds)
 
 
 def update_user_created_questions(user_id, num_questions_created):
@@ -174,26 +179,26 @@ def update_user_created_questions(user_id, num_questions_created):
 async def get_user_setting(user_id, setting_name):
     """Retrieves a specific setting for a user."""
     query = f"SELECT {setting_name} FROM users WHERE telegram_id = ?"
-    result = database.get_data(query, (user_id,))
+    result = await database.db.fetch_all(query, (user_id,))
     return result[0][0] if result else None  # Return the setting value or None
 
 
 async def get_user_reminder_times_per_week(user_id):
     """Retrieves a specific setting for a user."""
     query = f"SELECT reminder_times_per_week FROM users WHERE telegram_id = ?"
-    result = database.get_data(query, (user_id,))
+    result = await database.db.fetch_all(query, (user_id,))
     return result[0][0] if result else None  # Return the setting value or None
 
 
 async def get_user_name(user_id):
     """Retrieves a specific setting for a user."""
     query = f"SELECT name FROM users WHERE telegram_id = ?"
-    result = database.get_data(query, (user_id,))
+    result = await database.db.fetch_all(query, (user_id,))
     return result[0][0] if result else None  # Return the setting value or None
 
 async def get_user_phone_number(telegram_id):
     """retrieves the student phone number."""
-    result = database.get_data(
+    result = await database.db.fetch_all(
         "SELECT telegram_id FROM users WHERE telegram_id = ?", (telegram_id,)
     )
 
@@ -207,7 +212,7 @@ async def get_user_phone_number(telegram_id):
 async def get_user_for_reminder(user_id):
     """Retrieves a specific setting for a user."""
     query = f"SELECT name, voice_written, reminder_times_per_week FROM users WHERE telegram_id = ?"
-    result = database.get_data(query, (user_id,))
+    result = await database.db.fetch_all(query, (user_id,))
     user_name = result[0][0]
     preferred_method = "written"
     frequency = result[0][2]
@@ -217,19 +222,19 @@ async def get_user_for_reminder(user_id):
 async def update_user_setting(user_id, setting_name, new_value):
     """Updates a specific setting for a user."""
     query = f"UPDATE users SET {setting_name} = ? WHERE telegram_id = ?"
-    database.execute_query(query, (new_value, user_id))
+    await database.db.execute(query, (new_value, user_id))
 
 
 async def update_reminder_frequency(user_id, frequency):
     """Updates the user's reminder frequency in the database."""
     query = "UPDATE users SET reminder_times_per_week = ? WHERE telegram_id = ?"
-    database.execute_query(query, (frequency, user_id))
+    await database.db.execute(query, (frequency, user_id))
 
 
 async def get_reminder_frequency(user_id):
     """Gets the user's reminder frequency from the database."""
     query = "SELECT reminder_times_per_week FROM users WHERE telegram_id = ?"
-    result = database.get_data(query, (user_id,))
+    result = await database.db.fetch_all(query, (user_id,))
     return result[0][0] if result else 0  # Return 0 if no frequency is set
 
 
@@ -237,5 +242,5 @@ async def get_all_users_with_reminders():
     """Retrieves all users from the database who have a reminder frequency greater than 0."""
     # query = "SELECT * FROM users WHERE reminder_times_per_week > 0"
     query = "SELECT telegram_id, name, reminder_times_per_week, voice_written FROM users WHERE reminder_times_per_week > 0"
-    result = database.get_data(query)
+    result = await database.db.fetch_all(query)
     return result